@@ -16,6 +16,7 @@
 import os
 import re
 import socket
+import stat
 import traceback
 import time
 import datetime
@@ -110,6 +111,20 @@ def getIdentity():
     identity = socket.gethostname()
     return identity
 
+#Host name put on every perf counter, looked up once per collection
+#instead of once per counter
+HostName = None
+
+def refreshHostName():
+    global HostName
+    HostName = socket.gethostname()
+    return HostName
+
+def getHostName():
+    if HostName is None:
+        return refreshHostName()
+    return HostName
+
 def getMDSPartitionKey(identity, timestamp):
     hashVal = easyHash(identity)
     return "{0:0>19d}___{1:0>19d}".format(hashVal, timestamp)
@@ -125,6 +140,30 @@ def getAzureDiagnosticKeyRange():
     endKey = getMDSPartitionKey(identity, getMDSTimestamp(endTime))
     return startKey, endKey
 
+def queryEntities(tableService, table, ofilter, oselect, top=None,
+                  prefetch=True):
+    #A single query_entities call stops at the first continuation, which the
+    #table service may return before any matching row has been found.
+    if hasattr(tableService, "query_entities_iter"):
+        for entity in tableService.query_entities_iter(table, ofilter, oselect,
+                                                       top, prefetch):
+            yield entity
+        return
+    #Older SDK without query_entities_iter, follow the continuation here
+    nextPartitionKey, nextRowKey = None, None
+    while True:
+        entities = tableService.query_entities(table, ofilter, oselect, top,
+                                               nextPartitionKey, nextRowKey)
+        for entity in entities:
+            yield entity
+        continuation = getattr(entities, "x_ms_continuation", None)
+        if not continuation:
+            return
+        nextPartitionKey = continuation.get("nextpartitionkey")
+        nextRowKey = continuation.get("nextrowkey")
+        if not nextPartitionKey and not nextRowKey:
+            return
+
 def getAzureDiagnosticCPUData(accountName, accountKey, hostBase,
                               startKey, endKey, deploymentId):
     try:
@@ -136,10 +175,11 @@ def getAzureDiagnosticCPUData(accountName, accountKey, hostBase,
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}' "
                    "and DeploymentId eq '{2}'").format(startKey, endKey, deploymentId)
         oselect = ("PercentProcessorTime,DeploymentId")
-        data = tableService.query_entities(table, ofilter, oselect, 1)
-        if data is None or len(data) == 0:
+        data = next(queryEntities(tableService, table, ofilter, oselect, 1,
+                                  prefetch = False), None)
+        if data is None:
             return None
-        cpuPercent = float(data[0].PercentProcessorTime)
+        cpuPercent = float(data.PercentProcessorTime)
         return cpuPercent
     except Exception as e:
         waagent.Error((u"Failed to retrieve diagnostic data(CPU): {0} {1}"
@@ -160,10 +200,11 @@ def getAzureDiagnosticMemoryData(accountName, accountKey, hostBase,
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}' "
                    "and DeploymentId eq '{2}'").format(startKey, endKey, deploymentId)
         oselect = ("PercentAvailableMemory,DeploymentId")
-        data = tableService.query_entities(table, ofilter, oselect, 1)
-        if data is None or len(data) == 0:
+        data = next(queryEntities(tableService, table, ofilter, oselect, 1,
+                                  prefetch = False), None)
+        if data is None:
             return None
-        memoryPercent = 100 - float(data[0].PercentAvailableMemory)
+        memoryPercent = 100 - float(data.PercentAvailableMemory)
         return memoryPercent
     except Exception as e:
         waagent.Error((u"Failed to retrieve diagnostic data(Memory): {0} {1}"
@@ -201,9 +242,9 @@ class AzureDiagnosticData(object):
         return self.memoryPercent
 
 class AzureDiagnosticMetric(object):
-    def __init__(self, config):
+    def __init__(self, config, networkSampler=None, hwFacts=None):
         self.config = config
-        self.linux = LinuxMetric(self.config)
+        self.linux = LinuxMetric(self.config, networkSampler, hwFacts)
         self.azure = AzureDiagnosticData(self.config)
         self.timestamp = int(time.time()) - AzureTableDelay
 
@@ -357,8 +398,10 @@ class MemoryInfo(object):
     def getMemPercent(self):
         return self.memInfo[2] #%
 
+NetClassDir = "/sys/class/net"
+
 def getMacAddress(adapterId):
-    nicAddrPath = os.path.join("/sys/class/net", adapterId, "address")
+    nicAddrPath = os.path.join(NetClassDir, adapterId, "address")
     mac = waagent.GetFileContents(nicAddrPath)
     mac = mac.strip()
     mac = mac.replace(":", "-")
@@ -374,64 +417,98 @@ def sameList(l1, l2):
             return False
     return True
 
-class NetworkInfo(object):
+NetSnmpFile = "/proc/net/snmp"
+Counter32Max = 2 ** 32
+#A 32 bit counter that wrapped was close to Counter32Max and is small again
+Counter32WrapMargin = 2 ** 31
+
+def counterDelta(old, new):
+    if new >= old:
+        return new - old
+    wrapped = new + Counter32Max - old
+    if old < Counter32Max and wrapped < Counter32WrapMargin:
+        #32 bit counter wrapped
+        return wrapped
+    #Counter was reset, e.g. the driver was reloaded. A 64 bit counter
+    #below 2^32 that was reset is not mistaken for a wrap either.
+    return new
+
+class NetworkSampler(object):
+    """
+    Keeps the per NIC byte counters of the previous collection, so that the
+    throughput of every NIC comes from one psutil snapshot per cycle instead
+    of two snapshots and a sleep per NIC and direction.
+    """
     def __init__(self):
-        self.nics = psutil.net_io_counters(pernic=True)
+        self.lastCounters = None
+        self.lastTime = None
+        self.readRates = {}
+        self.writeRates = {}
         self.nicNames = []
-        for nicName, stat in self.nics.iteritems():
-            if nicName != 'lo':
-                self.nicNames.append(nicName)
+
+    def sample(self):
+        if self.lastCounters is None:
+            #First collection, take a short baseline once
+            self.update(psutil.net_io_counters(pernic=True), time.time())
+            time.sleep(0.2)
+        self.update(psutil.net_io_counters(pernic=True), time.time())
+
+    def update(self, counters, now):
+        self.nicNames = [nicName for nicName in counters if nicName != 'lo']
+        self.readRates = {}
+        self.writeRates = {}
+        if self.lastCounters is not None and now > self.lastTime:
+            interval = now - self.lastTime
+            for nicName in self.nicNames:
+                last = self.lastCounters.get(nicName)
+                if last is None:
+                    #NIC added since the last collection, no rate yet
+                    continue
+                stat = counters[nicName]
+                self.writeRates[nicName] = counterDelta(last[0], stat[0]) / interval
+                self.readRates[nicName] = counterDelta(last[1], stat[1]) / interval
+        #Removed NICs are dropped here
+        self.lastCounters = dict(counters)
+        self.lastTime = now
+
+def parseTcpRetransSegs(snmp):
+    header = None
+    for line in snmp.split("\n"):
+        if not line.startswith("Tcp:"):
+            continue
+        fields = line.split()[1:]
+        if header is None:
+            header = fields
+        elif "RetransSegs" in header and len(fields) == len(header):
+            return int(fields[header.index("RetransSegs")])
+    return None
+
+class NetworkInfo(object):
+    def __init__(self, sampler=None):
+        if sampler is None:
+            sampler = NetworkSampler()
+        self.sampler = sampler
+        self.sampler.sample()
+        self.nicNames = self.sampler.nicNames
 
     def getAdapterIds(self):
         return self.nicNames
 
     def getNetworkReadBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_recv1 = net[adapterId][1]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_recv2 = net[adapterId][1]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_recv2 - bytes_recv1) / interval
-        else:
-            return 0
+        return self.sampler.readRates.get(adapterId, 0)
 
     def getNetworkWriteBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_sent1 = net[adapterId][0]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_sent2 = net[adapterId][0]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_sent2 - bytes_sent1) / interval
-        else:
-            return 0
-
-    def getNetstat(self):
-        retCode, output = waagent.RunGetOutput("netstat -s", chk_err=False)
-        return output
+        return self.sampler.writeRates.get(adapterId, 0)
 
     def getNetworkPacketRetransmitted(self):
-        netstat = self.getNetstat()
-        match = re.search("(\d+)\s*segments retransmited", netstat)
-        if match != None:
-            return int(match.group(1))
+        snmp = waagent.GetFileContents(NetSnmpFile)
+        retransSegs = None
+        if snmp is not None:
+            retransSegs = parseTcpRetransSegs(snmp)
+        if retransSegs != None:
+            return retransSegs
         else:
-            waagent.Error("Failed to parse netstat output: {0}".format(netstat))
+            waagent.Error("Failed to parse {0}: {1}".format(NetSnmpFile, snmp))
             updateLatestErrorRecord(FAILED_TO_RETRIEVE_LOCAL_DATA)
             AddExtensionEvent(message=FAILED_TO_RETRIEVE_LOCAL_DATA)
             return None
@@ -439,12 +516,18 @@ class NetworkInfo(object):
 
 HwInfoFile = os.path.join(LibDir, "HwInfo")
 class HardwareChangeInfo(object):
-    def __init__(self, networkInfo):
+    def __init__(self, networkInfo, hwFacts=None):
         self.networkInfo = networkInfo
+        self.hwFacts = hwFacts
 
     def getHwInfo(self):
         if not os.path.isfile(HwInfoFile):
             return None, None
+        if self.hwFacts is not None:
+            return self.hwFacts.getHwInfo(self.readHwInfo)
+        return self.readHwInfo()
+
+    def readHwInfo(self):
         hwInfo = waagent.GetFileContents(HwInfoFile).split("\n")
         return int(hwInfo[0]), hwInfo[1:]
 
@@ -455,8 +538,11 @@ class HardwareChangeInfo(object):
 
     def getLastHardwareChange(self):
         oldTime, oldMacs = self.getHwInfo()
-        newMacs = map(lambda x : getMacAddress(x), 
-                      self.networkInfo.getAdapterIds())
+        adapterIds = self.networkInfo.getAdapterIds()
+        if self.hwFacts is not None:
+            newMacs = self.hwFacts.getMacAddresses(adapterIds)
+        else:
+            newMacs = map(lambda x : getMacAddress(x), adapterIds)
         newTime = int(time.time())
         newMacs.sort()
         if oldMacs is None or not sameList(newMacs, oldMacs):
@@ -470,17 +556,81 @@ class HardwareChangeInfo(object):
         else:
             return oldTime
 
+CpuOnlineFile = "/sys/devices/system/cpu/online"
+class HardwareFacts(object):
+    """
+    Hardware facts that don't change between collections unless the VM is
+    resized or a device is hot plugged: lscpu and /proc/cpuinfo, hypervisor
+    info, NIC MAC addresses and the HwInfo record. They are computed once and
+    all dropped when the NICs, their MAC addresses or the online CPUs change.
+    A NIC may keep its name while its MAC changes, e.g. when it is re-attached
+    or an accelerated networking VF is swapped, so the fingerprint holds the
+    address files of the NICs and not only their names.
+    """
+    def __init__(self):
+        self.fingerprint = None
+        self.invalidate()
+
+    def invalidate(self):
+        self.cpuInfo = None
+        self.hvInfo = None
+        self.macs = {}
+        self.hwInfo = None
+        self.hwInfoStat = None
+
+    def refresh(self, adapterIds):
+        addresses = [(adapterId, waagent.GetFileContents(
+                          os.path.join(NetClassDir, adapterId, "address")))
+                     for adapterId in sorted(adapterIds)]
+        fingerprint = (tuple(addresses),
+                       waagent.GetFileContents(CpuOnlineFile))
+        if fingerprint != self.fingerprint:
+            if self.fingerprint is not None:
+                waagent.Log(("Hardware change detected, reloading hardware "
+                             "facts: {0}").format(fingerprint))
+            self.fingerprint = fingerprint
+            self.invalidate()
+
+    def getCPUInfo(self):
+        if self.cpuInfo is None:
+            self.cpuInfo = CPUInfo.getCPUInfo()
+        return self.cpuInfo
+
+    def getHvInfo(self):
+        if self.hvInfo is None:
+            self.hvInfo = HvInfo()
+        return self.hvInfo
+
+    def getMacAddresses(self, adapterIds):
+        macs = []
+        for adapterId in adapterIds:
+            if adapterId not in self.macs:
+                self.macs[adapterId] = getMacAddress(adapterId)
+            macs.append(self.macs[adapterId])
+        return macs
+
+    def getHwInfo(self, readHwInfo):
+        #Reread the record only if someone else touched the file
+        stat = getFileStat(HwInfoFile)
+        if self.hwInfo is None or stat != self.hwInfoStat:
+            self.hwInfo = readHwInfo()
+            self.hwInfoStat = stat
+        return self.hwInfo
+
 class LinuxMetric(object):
-    def __init__(self, config):
+    def __init__(self, config, networkSampler=None, hwFacts=None):
         self.config = config
+        if hwFacts is None:
+            hwFacts = HardwareFacts()
+        #Network
+        self.networkInfo = NetworkInfo(networkSampler)
+        hwFacts.refresh(self.networkInfo.getAdapterIds())
         #CPU
-        self.cpuInfo = CPUInfo.getCPUInfo()
+        self.cpuInfo = hwFacts.getCPUInfo()
         #Memory
         self.memInfo = MemoryInfo()
-        #Network
-        self.networkInfo = NetworkInfo()
         #Detect hardware change
-        self.hwChangeInfo = HardwareChangeInfo(self.networkInfo)
+        self.hwChangeInfo = HardwareChangeInfo(self.networkInfo, hwFacts)
         self.timestamp = int(time.time())
 
     def getTimestamp(self):
@@ -565,15 +715,19 @@ class LinuxMetric(object):
         return self.hwChangeInfo.getLastHardwareChange()
 
 class VMDataSource(object):
-    def __init__(self, config):
+    def __init__(self, config, hwFacts=None):
         self.config = config
+        self.networkSampler = NetworkSampler()
+        self.hwFacts = hwFacts if hwFacts is not None else HardwareFacts()
 
     def collect(self):
         counters = []
         if self.config.isLADEnabled():
-            metrics = AzureDiagnosticMetric(self.config)
+            metrics = AzureDiagnosticMetric(self.config, self.networkSampler,
+                                            self.hwFacts)
         else:
-            metrics = LinuxMetric(self.config)
+            metrics = LinuxMetric(self.config, self.networkSampler,
+                                  self.hwFacts)
 
         #CPU
         counters.append(self.createCounterCurrHwFrequency(metrics))
@@ -819,7 +973,7 @@ def getStorageMetrics(account, key, hostBase, table, startKey, endKey):
                    "").format(startKey, endKey)
         oselect = ("TotalRequests,TotalIngress,TotalEgress,AverageE2ELatency,"
                    "AverageServerLatency,RowKey")
-        metrics = tableService.query_entities(table, ofilter, oselect)
+        metrics = list(queryEntities(tableService, table, ofilter, oselect))
         waagent.Log("{0} records returned.".format(len(metrics)))
         return metrics
     except Exception as e:
@@ -1174,12 +1328,13 @@ class HvInfo(object):
         return self.hvVersion
 
 class StaticDataSource(object):
-    def __init__(self, config):
+    def __init__(self, config, hwFacts=None):
         self.config = config
+        self.hwFacts = hwFacts if hwFacts is not None else HardwareFacts()
 
     def collect(self):
         counters = []
-        hvInfo = HvInfo()
+        hvInfo = self.hwFacts.getHvInfo()
         counters.append(self.createCounterCloudProvider())
         counters.append(self.createCounterCpuOverCommitted())
         counters.append(self.createCounterMemoryOverCommitted())
@@ -1290,7 +1445,7 @@ class PerfCounter(object):
             self.timestamp = timestamp
         else:
             self.timestamp = int(time.time())
-        self.machine = socket.gethostname()
+        self.machine = getHostName()
 
     def __str__(self):
         return (u"{0};{1};{2};{3};{4};{5};{6};{7};{8};{9};\n"
@@ -1309,29 +1464,71 @@ class PerfCounter(object):
 
 class EnhancedMonitor(object):
     def __init__(self, config):
+        self.hwFacts = HardwareFacts()
         self.dataSources = []
-        self.dataSources.append(VMDataSource(config))
+        self.dataSources.append(VMDataSource(config, self.hwFacts))
         self.dataSources.append(StorageDataSource(config))
-        self.dataSources.append(StaticDataSource(config))
+        self.dataSources.append(StaticDataSource(config, self.hwFacts))
         self.writer = PerfCounterWriter()
+        self.timings = []
 
     def run(self):
+        refreshHostName()
         counters = []
+        self.timings = []
         for dataSource in self.dataSources:
-            counters.extend(dataSource.collect())
+            startTime = time.time()
+            try:
+                counters.extend(dataSource.collect())
+            finally:
+                self.timings.append((type(dataSource).__name__,
+                                     time.time() - startTime))
         clearLastErrorRecord()
-        self.writer.write(counters)
+        startTime = time.time()
+        try:
+            self.writer.write(counters)
+        finally:
+            self.timings.append((type(self.writer).__name__,
+                                 time.time() - startTime))
+
+    def getTimings(self):
+        """
+        Seconds spent in each data source and in the writer during the last
+        run(), as a list of (name, seconds) in collection order.
+        """
+        return self.timings
 
 EventFile=os.path.join(LibDir, "PerfCounters")
+#Rewrite the event file at least this often even if no counter changed,
+#so that the timestamps seen by readers don't go stale
+MaxUnchangedInterval = 5 * MonitoringInterval
 class PerfCounterWriter(object):
+    def __init__(self, maxUnchangedInterval=MaxUnchangedInterval):
+        self.maxUnchangedInterval = maxUnchangedInterval
+        self.lineCache = {}
+        self.suffixCache = {}
+        self.lastKeys = None
+        self.lastEventFile = None
+        self.lastFileStat = None
+        self.lastWriteTime = 0
+
     def write(self, counters, maxRetry = 3, eventFile=EventFile):
+        data, keys = self.serialize(counters)
+        if self.isUnchanged(keys, eventFile):
+            waagent.Log(("{0} counters unchanged, skip writing event file."
+                         "").format(len(counters)))
+            return
         for i in range(0, maxRetry):
             try:
-                self._write(counters, eventFile)
+                self._write(data, eventFile)
+                self.lastKeys = keys
+                self.lastEventFile = eventFile
+                self.lastFileStat = getFileStat(eventFile)
+                self.lastWriteTime = time.time()
                 waagent.Log(("Write {0} counters to event file."
                              "").format(len(counters)))
                 return
-            except IOError as e:
+            except (IOError, OSError) as e:
                 waagent.Warn((u"Write to perf counters file failed: {0}"
                               "").format(e))
                 waagent.Log("Retry: {0}".format(i))
@@ -1343,15 +1540,86 @@ class PerfCounterWriter(object):
         AddExtensionEvent(message=FAILED_TO_SERIALIZE_PERF_COUNTERS)
         raise
 
-    def _write(self, counters, eventFile):
-        with open(eventFile, "w+") as F:
-            F.write("".join(map(lambda c : str(c), counters)).encode("utf8"))
+    def serialize(self, counters):
+        """
+        Same text as joining str(counter), but the part of each line before
+        the timestamp is formatted once and reused while the counter keeps
+        its value, which is the case for most of the config/disk counters.
+        Returns the encoded file content and the counter keys without
+        timestamps, used to tell whether anything changed.
+        """
+        lineCache = {}
+        parts = []
+        keys = []
+        for c in counters:
+            key = (c.counterType, c.category, c.name, c.instance, c.value,
+                   c.unit, c.refreshInterval, c.machine)
+            prefix = self.lineCache.get(key)
+            if prefix is None:
+                prefix = (u"{0};{1};{2};{3};{4};{5};{6};{7};"
+                          "").format(c.counterType,
+                                     c.category,
+                                     c.name,
+                                     c.instance,
+                                     0 if c.value is not None else 1,
+                                     c.value if c.value is not None else "",
+                                     c.unit,
+                                     c.refreshInterval)
+            lineCache[key] = prefix
+            suffix = self.suffixCache.get(c.machine)
+            if suffix is None:
+                suffix = u";{0};\n".format(c.machine)
+                self.suffixCache[c.machine] = suffix
+            parts.append(prefix)
+            parts.append(unicode(c.timestamp))
+            parts.append(suffix)
+            keys.append(key)
+        #Only keep the lines of the current counters
+        self.lineCache = lineCache
+        return u"".join(parts).encode("utf8"), keys
+
+    def isUnchanged(self, keys, eventFile):
+        if self.lastKeys is None or eventFile != self.lastEventFile:
+            return False
+        if time.time() - self.lastWriteTime >= self.maxUnchangedInterval:
+            return False
+        if getFileStat(eventFile) != self.lastFileStat:
+            return False
+        return keys == self.lastKeys
+
+    def _write(self, data, eventFile):
+        if os.path.exists(eventFile) and not os.path.isfile(eventFile):
+            #Not a regular file, e.g. a device, can't be replaced by rename
+            with open(eventFile, "w+") as F:
+                F.write(data)
+            return
+        #Write to a temp file and rename it over the event file, so that
+        #readers never see a partially written file
+        tmpFile = os.path.join(os.path.dirname(eventFile),
+                               ".{0}.tmp".format(os.path.basename(eventFile)))
+        try:
+            with open(tmpFile, "wb") as F:
+                F.write(data)
+            if os.path.exists(eventFile):
+                os.chmod(tmpFile, stat.S_IMODE(os.stat(eventFile).st_mode))
+            os.rename(tmpFile, eventFile)
+        except:
+            if os.path.exists(tmpFile):
+                os.remove(tmpFile)
+            raise
+
+def getFileStat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
 
+SharedConfigFile = '/var/lib/waagent/SharedConfig.xml'
 class EnhancedMonitorConfig(object):
     def __init__(self, publicConfig, privateConfig):
-        xmldoc = minidom.parse('/var/lib/waagent/SharedConfig.xml')
-        self.deployment = xmldoc.getElementsByTagName('Deployment')
-        self.role = xmldoc.getElementsByTagName('Role')
+        self.sharedConfigStat = None
+        self.loadSharedConfig()
         self.configData = {}
         diskCount = 0
         accountNames = []
@@ -1369,13 +1637,32 @@ class EnhancedMonitorConfig(object):
         self.configData["account.names"] = accountNames
 
 
+    def loadSharedConfig(self):
+        #Parsed again only when the agent rewrote the file
+        stat = getFileStat(SharedConfigFile)
+        if self.sharedConfigStat is not None and stat == self.sharedConfigStat:
+            return
+        xmldoc = minidom.parse(SharedConfigFile)
+        self.deployment = xmldoc.getElementsByTagName('Deployment')
+        self.role = xmldoc.getElementsByTagName('Role')
+        self.sharedConfigStat = stat
+
     def getVmSize(self):
         return self.configData.get("vmsize")
 
+    def refreshSharedConfig(self):
+        try:
+            self.loadSharedConfig()
+        except Exception as e:
+            waagent.Warn(("Failed to reload {0}, keep the last values: {1}"
+                          "").format(SharedConfigFile, e))
+
     def getVmRoleInstance(self):
+        self.refreshSharedConfig()
         return self.role[0].attributes['name'].value
 
     def getVmDeploymentId(self):
+        self.refreshSharedConfig()
         return self.deployment[0].attributes['name'].value
 
     def isMemoryOverCommitted(self):
@@ -100,7 +100,9 @@ def daemon(hutil):
             waagent.Error("{0} {1}".format(printable(e), 
                                            traceback.format_exc()))
             hutil.do_status_report("Enable", "error", 0, "{0}".format(e))
-        waagent.Log("Finished collection.")
+        timings = ", ".join(map(lambda t : "{0}={1:.3f}s".format(t[0], t[1]),
+                                monitor.getTimings()))
+        waagent.Log("Finished collection. {0}".format(timings))
         timeElapsed = time.time() - startTime
         timeToWait = (aem.MonitoringInterval - timeElapsed)
         #Make sure timeToWait is in the range [0, aem.MonitoringInterval)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares one collection cycle of building and writing the perf counters
+# file, per counter str() + gethostname() versus PerfCounterWriter.
+#
+# python bench_writer.py [disks] [nics] [cycles]
+
+import os
+import sys
+import socket
+import tempfile
+import time
+
+import env
+import aem
+
+def makeCounters(disks, nics, timestamp):
+    counters = []
+    for name in ["Cloud Provider", "Instance Type", "Virtualization Solution",
+                 "Data Provider Version", "Processor Type"]:
+        counters.append(aem.PerfCounter(counterType = 4, category = "config",
+                                        name = name, value = "static",
+                                        timestamp = timestamp))
+    for i in range(0, disks):
+        dev = "/dev/sd{0}".format(i)
+        for name in ["Phys. Disc to Storage Mapping", "Storage Type",
+                     "Caching", "SLA", "SLA Throughput"]:
+            counters.append(aem.PerfCounter(counterType = 4, category = "disk",
+                                            name = name, instance = dev,
+                                            value = "static",
+                                            timestamp = timestamp))
+    for i in range(0, nics):
+        adapter = "eth{0}".format(i)
+        for name in ["Adapter Id", "Mapping", "Minimum Network Bandwidth",
+                     "Maximum Network Bandwidth"]:
+            counters.append(aem.PerfCounter(counterType = 4, category = "network",
+                                            name = name, instance = adapter,
+                                            value = "static",
+                                            timestamp = timestamp))
+        for name in ["Network Read Bytes", "Network Write Bytes"]:
+            counters.append(aem.PerfCounter(counterType = 3, category = "network",
+                                            name = name, instance = adapter,
+                                            value = timestamp * 1000 + i,
+                                            timestamp = timestamp))
+    return counters
+
+def oldCycle(counters, eventFile):
+    for c in counters:
+        c.machine = socket.gethostname()
+    with open(eventFile, "w+") as F:
+        F.write("".join(map(lambda c : str(c), counters)).encode("utf8"))
+
+def main():
+    disks = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    nics = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    cycles = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    eventFile = os.path.join(tempfile.mkdtemp(), "PerfCounters")
+    aem.refreshHostName()
+    batches = [makeCounters(disks, nics, 1000 + i * 60) for i in range(0, cycles)]
+
+    start = time.time()
+    for counters in batches:
+        oldCycle(counters, eventFile)
+    before = time.time() - start
+
+    writer = aem.PerfCounterWriter()
+    start = time.time()
+    for counters in batches:
+        writer._write(writer.serialize(counters)[0], eventFile)
+    after = time.time() - start
+
+    print("counters per cycle        : {0}".format(len(batches[0])))
+    print("cycles                    : {0}".format(cycles))
+    print("per cycle, str + rewrite  : {0:.3f} ms".format(before * 1000 / cycles))
+    print("per cycle, writer         : {0:.3f} ms".format(after * 1000 / cycles))
+    print("speedup                   : {0:.1f}x".format(before / after))
+    os.remove(eventFile)
+
+if __name__ == '__main__':
+    main()
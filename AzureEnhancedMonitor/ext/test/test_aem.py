@@ -19,6 +19,8 @@
 import datetime
 import os
 import json
+import shutil
+import tempfile
 import unittest
 
 import env
@@ -184,10 +186,89 @@ class TestAEM(unittest.TestCase):
         self.assertNotEquals(0, len(adapterIds))
         adapterId = adapterIds[0]
         self.assertNotEquals(None, aem.getMacAddress(adapterId))
-        self.assertNotEquals(None, netinfo.getNetworkReadBytes())
-        self.assertNotEquals(None, netinfo.getNetworkWriteBytes())
+        self.assertNotEquals(None, netinfo.getNetworkReadBytes(adapterId))
+        self.assertNotEquals(None, netinfo.getNetworkWriteBytes(adapterId))
         self.assertNotEquals(None, netinfo.getNetworkPacketRetransmitted())
 
+    def test_network_sampler(self):
+        sampler = aem.NetworkSampler()
+        sampler.update({"lo": (5, 5), "eth0": (2 ** 32 - 300, 200)}, 1000)
+        self.assertEquals(["eth0"], sampler.nicNames)
+        self.assertEquals({}, sampler.readRates)
+
+        #eth0 send counter wrapped at 32 bit, eth1 hot added
+        sampler.update({"eth0": (300, 800), "eth1": (10, 10)}, 1060)
+        self.assertEquals(10, sampler.writeRates["eth0"])
+        self.assertEquals(10, sampler.readRates["eth0"])
+        self.assertFalse("eth1" in sampler.readRates)
+        self.assertEquals(2, len(sampler.nicNames))
+
+        #eth1 removed
+        sampler.update({"eth0": (300, 800)}, 1120)
+        self.assertEquals(["eth0"], sampler.nicNames)
+        self.assertEquals(0, sampler.readRates["eth0"])
+        self.assertFalse("eth1" in sampler.lastCounters)
+
+        #64 bit counter reset
+        self.assertEquals(60, aem.counterDelta(2 ** 40, 60))
+
+        #32 bit counter wrap
+        self.assertEquals(15, aem.counterDelta(2 ** 32 - 10, 5))
+
+        #Reset of a counter that was still below 2^32, no spurious 4GiB delta
+        self.assertEquals(60, aem.counterDelta(5000, 60))
+        self.assertEquals(2 * 10 ** 9, aem.counterDelta(3 * 10 ** 9, 2 * 10 ** 9))
+
+    def test_hardware_facts(self):
+        facts = aem.HardwareFacts()
+        facts.refresh(["eth0"])
+        cpuinfo = facts.getCPUInfo()
+        self.assertTrue(cpuinfo is facts.getCPUInfo())
+        facts.macs["eth0"] = "00-0d-3a-00-00-01"
+        self.assertEquals(["00-0d-3a-00-00-01"],
+                          facts.getMacAddresses(["eth0"]))
+
+        #Same NICs, nothing is reloaded
+        facts.refresh(["eth0"])
+        self.assertTrue(cpuinfo is facts.getCPUInfo())
+        self.assertEquals("00-0d-3a-00-00-01", facts.macs["eth0"])
+
+        #NIC hot added, everything is reloaded
+        facts.refresh(["eth0", "eth1"])
+        self.assertEquals({}, facts.macs)
+        self.assertFalse(cpuinfo is facts.getCPUInfo())
+
+    def test_hardware_facts_mac_change(self):
+        netClassDir = aem.NetClassDir
+        aem.NetClassDir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(aem.NetClassDir, "eth0"))
+            addressFile = os.path.join(aem.NetClassDir, "eth0", "address")
+            waagent.SetFileContents(addressFile, "00:0d:3a:00:00:01\n")
+            facts = aem.HardwareFacts()
+            facts.refresh(["eth0"])
+            self.assertEquals(["00-0d-3a-00-00-01"],
+                              facts.getMacAddresses(["eth0"]))
+
+            #Same NIC name, new MAC
+            waagent.SetFileContents(addressFile, "00:0d:3a:00:00:02\n")
+            facts.refresh(["eth0"])
+            self.assertEquals(["00-0d-3a-00-00-02"],
+                              facts.getMacAddresses(["eth0"]))
+        finally:
+            shutil.rmtree(aem.NetClassDir)
+            aem.NetClassDir = netClassDir
+
+    def test_parse_tcp_retrans_segs(self):
+        snmp = ("Ip: Forwarding DefaultTTL\n"
+                "Ip: 1 64\n"
+                "Tcp: RtoAlgorithm RtoMin RetransSegs InErrs\n"
+                "Tcp: 1 200 42 0\n"
+                "Udp: InDatagrams\n"
+                "Udp: 7\n")
+        self.assertEquals(42, aem.parseTcpRetransSegs(snmp))
+        self.assertEquals(None, aem.parseTcpRetransSegs("Ip: 1\n"))
+
     def test_hwchangeinfo(self):
         netinfo = aem.NetworkInfo()
         testHwInfoFile = "/tmp/HwInfo"
@@ -311,6 +392,27 @@ class TestAEM(unittest.TestCase):
         self.assertNotEquals(None, endKey)
         self.assertEquals(13, len(endKey))
 
+    def test_query_entities(self):
+        class Page(list):
+            pass
+        class OldTableService(object):
+            def __init__(self):
+                self.calls = []
+            def query_entities(self, table, ofilter, oselect, top,
+                               nextPartitionKey, nextRowKey):
+                self.calls.append(nextPartitionKey)
+                page = Page()
+                if nextPartitionKey is None:
+                    #no row yet, only a continuation
+                    page.x_ms_continuation = {"nextpartitionkey" : "p1"}
+                else:
+                    page.append("row")
+                return page
+        tableService = OldTableService()
+        rows = list(aem.queryEntities(tableService, "t", "f", "s", 1))
+        self.assertEquals(["row"], rows)
+        self.assertEquals([None, "p1"], tableService.calls)
+
     def test_storage_datasource(self):
         aem.getStorageMetrics = mock_getStorageMetrics
         config = self.test_config()
@@ -364,6 +466,45 @@ class TestAEM(unittest.TestCase):
         self.assertRaises(IOError, writer.write, counters, 2, testEventFile)
         print("==============================")
 
+    def test_writer_skip_unchanged(self):
+        testEventFile = "/tmp/Event"
+        if os.path.isfile(testEventFile):
+            os.remove(testEventFile)
+        writer = aem.PerfCounterWriter()
+        counters = [aem.PerfCounter(counterType = 1,
+                                    category = "test",
+                                    name = "test",
+                                    value = 1,
+                                    timestamp = 100),
+                    aem.PerfCounter(counterType = 4,
+                                    category = "test",
+                                    name = "none",
+                                    value = None,
+                                    timestamp = 100)]
+        writer.write(counters, eventFile = testEventFile)
+        with open(testEventFile) as F:
+            self.assertEquals("".join(map(str, counters)), F.read())
+        self.assertFalse(os.path.exists("/tmp/.Event.tmp"))
+
+        #Only timestamps changed, file is left as is
+        inode = os.stat(testEventFile).st_ino
+        counters[0].timestamp = 160
+        writer.write(counters, eventFile = testEventFile)
+        self.assertEquals(inode, os.stat(testEventFile).st_ino)
+
+        #A value changed, file is replaced
+        counters[0].value = 2
+        writer.write(counters, eventFile = testEventFile)
+        with open(testEventFile) as F:
+            self.assertEquals("".join(map(str, counters)), F.read())
+
+        #Stale file is rewritten even without changes
+        writer.maxUnchangedInterval = 0
+        counters[0].timestamp = 220
+        writer.write(counters, eventFile = testEventFile)
+        with open(testEventFile) as F:
+            self.assertEquals("".join(map(str, counters)), F.read())
+
     def test_easyHash(self):
         hashVal = aem.easyHash('a')
         self.assertEquals(97, hashVal)
@@ -27,7 +27,12 @@ if sys.version_info[0] < 3:
 
 import os
 import os.path
+import ctypes
+import ctypes.util
 import datetime
+import errno
+import select
+import struct
 import signal
 import pwd
 import grp
@@ -114,6 +119,7 @@ FluentCfgPath = '/etc/opt/microsoft/azuremonitoragent/config-cache/fluentbit/td-
 AMASyslogConfigMarkerPath = '/etc/opt/microsoft/azuremonitoragent/config-cache/syslog.marker'
 AMASyslogPortFilePath = '/etc/opt/microsoft/azuremonitoragent/config-cache/syslog.port'
 ArcSettingsFile = '/var/opt/azcmagent/localconfig.json'
+ConfigWatcherPollSeconds = 5
 
 SupportedArch = set(['x86_64', 'aarch64'])
 
@@ -984,12 +990,136 @@ def start_syslogconfig_process():
         hutil_log_info('start syslog watcher process '+str(args))
         subprocess.Popen(args, stdout=log, stderr=log)
 
+class ConfigWatcher(object):
+    """
+    Waits for changes to a set of configuration files. The directories
+    holding them are watched with inotify, a file counts as changed when its
+    inode, size or mtime is not the same as on the previous check. Directories
+    that cannot be watched, e.g. because they do not exist yet or inotify is
+    not available, are checked with stat every ConfigWatcherPollSeconds.
+    """
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_IGNORED = 0x00008000
+    # same as O_CLOEXEC, which the os module of python 2 does not have
+    IN_CLOEXEC = 0o2000000
+    WatchMask = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                 IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    EventHeader = struct.Struct('iIII')
+
+    def __init__(self, paths, poll_interval = ConfigWatcherPollSeconds):
+        self.paths = list(paths)
+        self.directories = set(os.path.dirname(path) for path in self.paths)
+        self.poll_interval = poll_interval
+        self.signatures = {}
+        self.watches = {}
+        self.libc = None
+        self.fd = None
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | self.IN_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+            else:
+                hutil_log_info('inotify is not available, errno {0}; polling configuration files'.format(ctypes.get_errno()))
+        except (OSError, AttributeError) as e:
+            hutil_log_info('inotify is not available, {0}; polling configuration files'.format(e))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def add_watches(self):
+        """
+        Watch the directories that are not watched yet, return True when all
+        of them are
+        """
+        if self.fd is None:
+            return False
+        watched = set(self.watches.values())
+        for directory in self.directories - watched:
+            wd = self.libc.inotify_add_watch(self.fd, directory.encode('utf-8'), self.WatchMask)
+            if wd >= 0:
+                self.watches[wd] = directory
+        return len(self.watches) == len(self.directories)
+
+    def read_events(self):
+        """
+        Drain the pending inotify events; only removed watches are of
+        interest, the files themselves are compared with stat
+        """
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            pos = 0
+            while pos + self.EventHeader.size <= len(buf):
+                wd, mask, cookie, length = self.EventHeader.unpack_from(buf, pos)
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                pos += self.EventHeader.size + length
+
+    @staticmethod
+    def get_signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        # st_mtime_ns is python 3 only, shim.sh may still run the extension with python 2
+        return st.st_ino, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime)
+
+    def changed(self):
+        """
+        Return the paths that changed since the previous call; on the first
+        call every path counts as changed
+        """
+        changed = set()
+        for path in self.paths:
+            signature = self.get_signature(path)
+            if path not in self.signatures or self.signatures[path] != signature:
+                self.signatures[path] = signature
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout = None):
+        """
+        Block until one of the files changes or timeout seconds passed, which
+        is forever when timeout is None, and return the changed paths
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            complete = self.add_watches()
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return set()
+            if not complete and (remaining is None or remaining > self.poll_interval):
+                remaining = self.poll_interval
+            if self.fd is not None:
+                if select.select([self.fd], [], [], remaining)[0]:
+                    self.read_events()
+            else:
+                time.sleep(remaining)
+            changed = self.changed()
+            if changed:
+                return changed
+
 def metrics_watcher(hutil_error, hutil_log):
     """
     Watcher thread to monitor metric configuration changes and to take action on them
     """
 
-    # Check every 30 seconds
+    # Check the metrics processes every 30 seconds, configuration changes
+    # are picked up as soon as they are written
     sleepTime =  30
 
     # Retrieve managed identity info that may be needed for token retrieval
@@ -997,17 +1127,23 @@ def metrics_watcher(hutil_error, hutil_log):
     if error_msg:
         hutil_error('Failed to determine managed identity settings; MSI token retreival will rely on default identity, if any. {0}.'.format(error_msg))
 
-    # Sleep before starting the monitoring
-    time.sleep(sleepTime)
     last_crc = None
     last_crc_fluent = None
     me_msi_token_expiry_epoch = None
+    metrics_configured = False
+
+    watcher = ConfigWatcher([FluentCfgPath, MdsdCounterJsonPath])
+    changed = watcher.changed()
 
     while True:
+        # changes that fail to apply are retried on the next check
+        pending = set(changed)
         try:
-            if os.path.isfile(FluentCfgPath):
-                f = open(FluentCfgPath, "r")
-                data = f.read()
+            if FluentCfgPath in changed:
+                data = ''
+                if os.path.isfile(FluentCfgPath):
+                    with open(FluentCfgPath, "r") as f:
+                        data = f.read()
 
                 if (data != ''):
                     crc_fluent = hashlib.sha256(data.encode('utf-8')).hexdigest()
@@ -1015,10 +1151,14 @@ def metrics_watcher(hutil_error, hutil_log):
                     if (crc_fluent != last_crc_fluent):
                         restart_launcher()
                         last_crc_fluent = crc_fluent
-           
-            if os.path.isfile(MdsdCounterJsonPath):
-                f = open(MdsdCounterJsonPath, "r")
-                data = f.read()
+                pending.discard(FluentCfgPath)
+
+            if MdsdCounterJsonPath in changed:
+                metrics_configured = False
+                data = ''
+                if os.path.isfile(MdsdCounterJsonPath):
+                    with open(MdsdCounterJsonPath, "r") as f:
+                        data = f.read()
 
                 if (data != ''):
                     json_data = json.loads(data)
@@ -1084,79 +1224,83 @@ def metrics_watcher(hutil_error, hutil_log):
 
                             last_crc = crc
 
-                        generate_token = False
-                        me_token_path = os.path.join(os.getcwd(), "/config/metrics_configs/AuthToken-MSI.json")
-
-                        if me_msi_token_expiry_epoch is None or me_msi_token_expiry_epoch == "":
-                            if os.path.isfile(me_token_path):
-                                with open(me_token_path, "r") as f:
-                                    authtoken_content = f.read()
-                                    if authtoken_content and "expires_on" in authtoken_content:
-                                        me_msi_token_expiry_epoch = authtoken_content["expires_on"]
-                                    else:
-                                        generate_token = True
-                            else:
-                                generate_token = True
+                        metrics_configured = True
+                pending.discard(MdsdCounterJsonPath)
 
-                        if me_msi_token_expiry_epoch:
-                            currentTime = datetime.datetime.now()
-                            token_expiry_time = datetime.datetime.fromtimestamp(int(me_msi_token_expiry_epoch))
-                            if token_expiry_time - currentTime < datetime.timedelta(minutes=30):
-                                # The MSI Token will expire within 30 minutes. We need to refresh the token
-                                generate_token = True
+            if metrics_configured:
+                generate_token = False
+                me_token_path = os.path.join(os.getcwd(), "/config/metrics_configs/AuthToken-MSI.json")
 
-                        if generate_token:
-                            generate_token = False
-                            msi_token_generated, me_msi_token_expiry_epoch, log_messages = me_handler.generate_MSI_token(identifier_name, identifier_value)
-                            if msi_token_generated:
-                                hutil_log("Successfully refreshed metrics-extension MSI Auth token.")
+                if me_msi_token_expiry_epoch is None or me_msi_token_expiry_epoch == "":
+                    if os.path.isfile(me_token_path):
+                        with open(me_token_path, "r") as f:
+                            authtoken_content = f.read()
+                            if authtoken_content and "expires_on" in authtoken_content:
+                                me_msi_token_expiry_epoch = authtoken_content["expires_on"]
                             else:
-                                hutil_error(log_messages)
-
-                        telegraf_restart_retries = 0
-                        me_restart_retries = 0
-                        max_restart_retries = 10
-
-                        # Check if telegraf is running, if not, then restart
-                        if not telhandler.is_running(is_lad=False):
-                            if telegraf_restart_retries < max_restart_retries:
-                                telegraf_restart_retries += 1
-                                hutil_log("Telegraf binary process is not running. Restarting telegraf now. Retry count - {0}".format(telegraf_restart_retries))
-                                tel_out, tel_msg = telhandler.stop_telegraf_service(is_lad=False)
-                                if tel_out:
-                                    hutil_log(tel_msg)
-                                else:
-                                    hutil_error(tel_msg)
-                                start_telegraf_res, log_messages = telhandler.start_telegraf(is_lad=False)
-                                if start_telegraf_res:
-                                    hutil_log("Successfully started metrics-sourcer.")
-                                else:
-                                    hutil_error(log_messages)
-                            else:
-                                hutil_error("Telegraf binary process is not running. Failed to restart after {0} retries. Please check telegraf.log".format(max_restart_retries))
+                                generate_token = True
+                    else:
+                        generate_token = True
+
+                if me_msi_token_expiry_epoch:
+                    currentTime = datetime.datetime.now()
+                    token_expiry_time = datetime.datetime.fromtimestamp(int(me_msi_token_expiry_epoch))
+                    if token_expiry_time - currentTime < datetime.timedelta(minutes=30):
+                        # The MSI Token will expire within 30 minutes. We need to refresh the token
+                        generate_token = True
+
+                if generate_token:
+                    generate_token = False
+                    msi_token_generated, me_msi_token_expiry_epoch, log_messages = me_handler.generate_MSI_token(identifier_name, identifier_value)
+                    if msi_token_generated:
+                        hutil_log("Successfully refreshed metrics-extension MSI Auth token.")
+                    else:
+                        hutil_error(log_messages)
+
+                telegraf_restart_retries = 0
+                me_restart_retries = 0
+                max_restart_retries = 10
+
+                # Check if telegraf is running, if not, then restart
+                if not telhandler.is_running(is_lad=False):
+                    if telegraf_restart_retries < max_restart_retries:
+                        telegraf_restart_retries += 1
+                        hutil_log("Telegraf binary process is not running. Restarting telegraf now. Retry count - {0}".format(telegraf_restart_retries))
+                        tel_out, tel_msg = telhandler.stop_telegraf_service(is_lad=False)
+                        if tel_out:
+                            hutil_log(tel_msg)
                         else:
-                            telegraf_restart_retries = 0
-
-                        # Check if ME is running, if not, then restart
-                        if not me_handler.is_running(is_lad=False):
-                            if me_restart_retries < max_restart_retries:
-                                me_restart_retries += 1
-                                hutil_log("MetricsExtension binary process is not running. Restarting MetricsExtension now. Retry count - {0}".format(me_restart_retries))
-                                me_out, me_msg = me_handler.stop_metrics_service(is_lad=False)
-                                if me_out:
-                                    hutil_log(me_msg)
-                                else:
-                                    hutil_error(me_msg)
-                                start_metrics_out, log_messages = me_handler.start_metrics(is_lad=False)
-
-                                if start_metrics_out:
-                                    hutil_log("Successfully started metrics-extension.")
-                                else:
-                                    hutil_error(log_messages)
-                            else:
-                                hutil_error("MetricsExtension binary process is not running. Failed to restart after {0} retries. Please check /var/log/syslog for ME logs".format(max_restart_retries))
+                            hutil_error(tel_msg)
+                        start_telegraf_res, log_messages = telhandler.start_telegraf(is_lad=False)
+                        if start_telegraf_res:
+                            hutil_log("Successfully started metrics-sourcer.")
                         else:
-                            me_restart_retries = 0
+                            hutil_error(log_messages)
+                    else:
+                        hutil_error("Telegraf binary process is not running. Failed to restart after {0} retries. Please check telegraf.log".format(max_restart_retries))
+                else:
+                    telegraf_restart_retries = 0
+
+                # Check if ME is running, if not, then restart
+                if not me_handler.is_running(is_lad=False):
+                    if me_restart_retries < max_restart_retries:
+                        me_restart_retries += 1
+                        hutil_log("MetricsExtension binary process is not running. Restarting MetricsExtension now. Retry count - {0}".format(me_restart_retries))
+                        me_out, me_msg = me_handler.stop_metrics_service(is_lad=False)
+                        if me_out:
+                            hutil_log(me_msg)
+                        else:
+                            hutil_error(me_msg)
+                        start_metrics_out, log_messages = me_handler.start_metrics(is_lad=False)
+
+                        if start_metrics_out:
+                            hutil_log("Successfully started metrics-extension.")
+                        else:
+                            hutil_error(log_messages)
+                    else:
+                        hutil_error("MetricsExtension binary process is not running. Failed to restart after {0} retries. Please check /var/log/syslog for ME logs".format(max_restart_retries))
+                else:
+                    me_restart_retries = 0
 
         except IOError as e:
             hutil_error('I/O error in setting up or monitoring metrics. Exception={0}'.format(e))
@@ -1165,33 +1309,32 @@ def metrics_watcher(hutil_error, hutil_log):
             hutil_error('Error in setting up or monitoring metrics. Exception={0}'.format(e))
 
         finally:
-            time.sleep(sleepTime)
+            changed = watcher.wait(sleepTime) | pending
 
 def syslogconfig_watcher(hutil_error, hutil_log):
     """
     Watcher thread to monitor syslog configuration changes and to take action on them
     """
-    syslog_enabled  = False
-    # Check for config changes every 30 seconds
-    sleepTime =  30
+    # Retry after 30 seconds when the configuration could not be applied
+    retryTime = 30
 
-    # Sleep before starting the monitoring
-    time.sleep(sleepTime)
+    watcher = ConfigWatcher([AMASyslogConfigMarkerPath, AMASyslogPortFilePath])
+    watcher.changed()
 
     while True:
-        try:       
+        timeout = None
+        try:
+            syslog_enabled  = False
             if os.path.isfile(AMASyslogConfigMarkerPath):
-                f = open(AMASyslogConfigMarkerPath, "r")
-                data = f.read()
+                with open(AMASyslogConfigMarkerPath, "r") as f:
+                    data = f.read()
 
                 if (data != ''):
                     if "true" in data:
                         syslog_enabled = True
-                f.close()
 
             if syslog_enabled:
                 # place syslog local configs
-                syslog_enabled  = False
                 generate_localsyslog_configs()
             else:
                 # remove syslog local configs
@@ -1199,12 +1342,15 @@ def syslogconfig_watcher(hutil_error, hutil_log):
 
         except IOError as e:
             hutil_error('I/O error in setting up syslog config watcher. Exception={0}'.format(e))
+            timeout = retryTime
 
         except Exception as e:
             hutil_error('Error in setting up syslog config watcher. Exception={0}'.format(e))
+            timeout = retryTime
 
         finally:
-            time.sleep(sleepTime)
+            # nothing to do until the marker or the port file changes
+            watcher.wait(timeout)
 
 def generate_localsyslog_configs():
     """
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import agent
+
+
+class ConfigWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'config', 'fluentbit.conf')
+        self.other_path = os.path.join(self.directory, 'marker')
+        self.watchers = []
+
+    def tearDown(self):
+        for watcher in self.watchers:
+            watcher.close()
+        shutil.rmtree(self.directory)
+
+    def _watcher(self, poll_interval = 0.1):
+        watcher = agent.ConfigWatcher([self.path, self.other_path], poll_interval = poll_interval)
+        self.watchers.append(watcher)
+        return watcher
+
+    def _write(self, path, content):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # replaced the way the configuration files are, by a rename
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.rename(path + '.tmp', path)
+
+    def test_changed(self):
+        self._write(self.other_path, 'a')
+        watcher = self._watcher()
+        self.assertEqual(set([self.path, self.other_path]), watcher.changed())
+        self.assertEqual(set(), watcher.changed())
+        self._write(self.other_path, 'ab')
+        self.assertEqual(set([self.other_path]), watcher.changed())
+        os.remove(self.other_path)
+        self.assertEqual(set([self.other_path]), watcher.changed())
+
+    def test_signature_without_mtime_ns(self):
+        class Python2Stat(object):
+            st_ino = 1
+            st_size = 2
+            st_mtime = 3.5
+        stat = agent.os.stat
+        agent.os.stat = lambda path: Python2Stat()
+        try:
+            self.assertEqual((1, 2, 3.5), agent.ConfigWatcher.get_signature(self.path))
+        finally:
+            agent.os.stat = stat
+
+    def test_wait_inotify(self):
+        self._write(self.path, 'a')
+        watcher = self._watcher(poll_interval = 60)
+        watcher.changed()
+        if watcher.fd is None:
+            self.skipTest('inotify is not available')
+        self.assertEqual(set(), watcher.wait(0.1))
+        start = time.time()
+        self._write(self.path, 'b')
+        self.assertEqual(set([self.path]), watcher.wait(5))
+        # woken by the event, not by the poll interval
+        self.assertTrue(time.time() - start < 5)
+
+    def test_wait_polls_missing_directory(self):
+        # the directory of self.path does not exist yet, so it cannot be watched
+        watcher = self._watcher()
+        watcher.changed()
+        self.assertFalse(watcher.add_watches())
+        self._write(self.path, 'a')
+        self.assertEqual(set([self.path]), watcher.wait(5))
+
+    def test_wait_polls_without_inotify(self):
+        watcher = self._watcher()
+        watcher.close()
+        watcher.changed()
+        self.assertFalse(watcher.add_watches())
+        self._write(self.other_path, 'a')
+        start = time.time()
+        self.assertEqual(set([self.other_path]), watcher.wait(5))
+        self.assertTrue(time.time() - start < 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
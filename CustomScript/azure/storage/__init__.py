@@ -19,6 +19,7 @@ from datetime import datetime
 from xml.dom import minidom
 from azure import (WindowsAzureData,
                    WindowsAzureError,
+                   ATOM_NS,
                    METADATA_NS,
                    xml_escape,
                    _create_entry,
@@ -32,6 +33,8 @@ from azure import (WindowsAzureData,
                    _get_children_from_path,
                    _get_entry_properties,
                    _general_error_handler,
+                   _get_continuation,
+                   _iterparse_entries,
                    _list_of,
                    _parse_response_for_dict,
                    _sign_string,
@@ -622,6 +625,16 @@ _PYTHON_TO_ENTITY_CONVERSIONS = {
     str: _to_entity_str,
 }
 
+# Qualified names looked up on every entry and property of a table feed
+_ENTITY_PROPERTIES_PATH = '{' + ATOM_NS + '}content/{' + METADATA_NS + \
+    '}properties'
+_ENTITY_ETAG_ATTR = '{' + METADATA_NS + '}etag'
+_ENTITY_TYPE_ATTR = '{' + METADATA_NS + '}type'
+_ENTITY_NULL_ATTR = '{' + METADATA_NS + '}null'
+
+# Property element tag -> property name, filled in as tags are seen
+_entity_property_names = {}
+
 if sys.version_info < (3,):
     _PYTHON_TO_ENTITY_CONVERSIONS.update({
         long: _to_entity_int,
@@ -766,13 +779,6 @@ def _convert_response_to_block_list(response):
     return blob_block_list
 
 
-def _remove_prefix(name):
-    colon = name.find(':')
-    if colon != -1:
-        return name[colon + 1:]
-    return name
-
-
 def _convert_response_to_entity(response):
     if response is None:
         return response
@@ -807,44 +813,46 @@ def _convert_xml_to_entity(xmlstr):
       </content>
     </entry>
     '''
-    xmldoc = minidom.parseString(xmlstr)
+    for entity in _iter_entities(xmlstr):
+        return entity
+    return None
+
 
-    xml_properties = None
-    for entry in _get_child_nodes(xmldoc, 'entry'):
-        for content in _get_child_nodes(entry, 'content'):
-            # TODO: Namespace
-            xml_properties = _get_child_nodesNS(
-                content, METADATA_NS, 'properties')
+def _get_entity_property_name(tag):
+    name = _entity_property_names.get(tag)
+    if name is None:
+        name = tag[tag.find('}') + 1:]
+        _entity_property_names[tag] = name
+    return name
 
-    if not xml_properties:
+
+def _convert_element_to_entity(entry, select=None):
+    ''' Converts a parsed entry element to an entity. Properties missing
+    from the select set are skipped without being converted. '''
+    xml_properties = entry.find(_ENTITY_PROPERTIES_PATH)
+    if xml_properties is None:
         return None
 
     entity = Entity()
-    # extract each property node and get the type from attribute and node value
-    for xml_property in xml_properties[0].childNodes:
-        name = _remove_prefix(xml_property.nodeName)
+    for xml_property in xml_properties:
+        name = _get_entity_property_name(xml_property.tag)
         # exclude the Timestamp since it is auto added by azure when
         # inserting entity. We don't want this to mix with real properties
-        if name in ['Timestamp']:
+        if name == 'Timestamp':
+            continue
+        if select is not None and name not in select:
             continue
 
-        if xml_property.firstChild:
-            value = xml_property.firstChild.nodeValue
-        else:
-            value = ''
-
-        isnull = xml_property.getAttributeNS(METADATA_NS, 'null')
-        mtype = xml_property.getAttributeNS(METADATA_NS, 'type')
+        value = xml_property.text or ''
+        isnull = xml_property.get(_ENTITY_NULL_ATTR, '')
+        mtype = xml_property.get(_ENTITY_TYPE_ATTR, '')
 
         # if not isnull and no type info, then it is a string and we just
         # need the str type to hold the property.
         if not isnull and not mtype:
             _set_entity_attr(entity, name, value)
         elif isnull == 'true':
-            if mtype:
-                property = EntityProperty(mtype, None)
-            else:
-                property = EntityProperty('Edm.String', None)
+            continue
         else:  # need an object to hold the property
             conv = _ENTITY_TO_PYTHON_CONVERSIONS.get(mtype)
             if conv is not None:
@@ -853,15 +861,43 @@ def _convert_xml_to_entity(xmlstr):
                 property = EntityProperty(mtype, value)
             _set_entity_attr(entity, name, property)
 
-        # extract id, updated and name value from feed entry and set them of
-        # rule.
-    for name, value in _get_entry_properties(xmlstr, True).items():
-        if name in ['etag']:
-            _set_entity_attr(entity, name, value)
+    etag = entry.get(_ENTITY_ETAG_ATTR)
+    if etag:
+        _set_entity_attr(entity, 'etag', etag)
 
     return entity
 
 
+def _iter_entities(xmlstr, select=None):
+    '''
+    Yields the entities of a table feed, or of a single entry, while the
+    response is being parsed. select is a $select string; the properties it
+    does not list are not converted.
+    '''
+    if select:
+        select = set(name.strip() for name in select.split(','))
+    else:
+        select = None
+    for entry in _iterparse_entries(xmlstr):
+        entity = _convert_element_to_entity(entry, select)
+        if entity is not None:
+            yield entity
+
+
+def _convert_response_to_entities(response, select=None):
+    ''' Converts a query response to a list of entities, with the
+    continuation headers in x_ms_continuation. '''
+    if response is None:
+        return None
+
+    entities = _list_of(Entity)
+    x_ms_continuation = _get_continuation(response)
+    if x_ms_continuation:
+        setattr(entities, 'x_ms_continuation', x_ms_continuation)
+    entities.extend(_iter_entities(response.body, select))
+    return entities
+
+
 def _set_entity_attr(entity, name, value):
     try:
         setattr(entity, name, value)
@@ -0,0 +1,277 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#--------------------------------------------------------------------------
+import os
+import sys
+import threading
+import time
+
+from azure import (
+    WindowsAzureConflictError,
+    WindowsAzureError,
+    WindowsAzureMissingResourceError,
+    )
+
+_ERROR_CHUNK_LENGTH = \
+    'Expected {0} bytes for the range starting at {1}, received {2}.'
+
+
+def _get_fileno(stream):
+    try:
+        return stream.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+def _is_seekable(stream):
+    mode = getattr(stream, 'mode', '')
+    if isinstance(mode, str) and 'a' in mode:
+        # writes to a file opened for append always land at the end
+        return False
+    if hasattr(stream, 'seekable'):
+        try:
+            return stream.seekable()
+        except (IOError, OSError, ValueError):
+            return False
+    try:
+        stream.tell()
+        return True
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+
+
+def _with_retries(func, max_retries, retry_wait):
+    '''
+    Calls func, retrying up to max_retries times. Missing resources and
+    conflicts are not transient and are raised straight away.
+    '''
+    retry = 0
+    while True:
+        try:
+            return func()
+        except (WindowsAzureConflictError, WindowsAzureMissingResourceError):
+            raise
+        except Exception:
+            if retry >= max_retries:
+                raise
+            retry += 1
+            time.sleep(retry_wait)
+
+
+def _run_chunks(process_chunk, chunks, max_connections):
+    '''
+    Calls process_chunk for each item of chunks on max_connections threads.
+    Items are taken from chunks under a lock, so a generator reading from a
+    stream is consumed in order. The first error stops the remaining work and
+    is raised once every thread has finished.
+    '''
+    chunks = iter(chunks)
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        while True:
+            with lock:
+                if errors:
+                    return
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                except Exception:
+                    errors.append(sys.exc_info()[1])
+                    return
+            try:
+                process_chunk(chunk)
+            except Exception:
+                with lock:
+                    errors.append(sys.exc_info()[1])
+                return
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max_connections)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+class _ChunkProgress(object):
+
+    def __init__(self, total, progress_callback):
+        self.total = total
+        self.current = 0
+        self.progress_callback = progress_callback
+        self.lock = threading.Lock()
+
+    def update(self, length):
+        if self.progress_callback is None:
+            return
+        with self.lock:
+            self.current += length
+            self.progress_callback(self.current, self.total)
+
+
+class _BlobChunkDownloader(object):
+
+    '''
+    Downloads disjoint ranges of a blob and writes each one at its offset in
+    the destination stream. With a real file on Python 3 the chunks go
+    through os.pwrite and never share the file position; otherwise writes
+    are serialized with seek/write under a lock.
+    '''
+
+    def __init__(self, blob_service, container_name, blob_name, blob_size,
+                 chunk_size, stream, snapshot, x_ms_lease_id, max_retries,
+                 retry_wait, progress_callback):
+        self.blob_service = blob_service
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.blob_size = blob_size
+        self.chunk_size = chunk_size
+        self.stream = stream
+        self.snapshot = snapshot
+        self.x_ms_lease_id = x_ms_lease_id
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.progress = _ChunkProgress(blob_size, progress_callback)
+        self.stream_start = stream.tell()
+        self.stream_lock = threading.Lock()
+        self.fd = None
+        if hasattr(os, 'pwrite'):
+            self.fd = _get_fileno(stream)
+
+    def get_chunk_offsets(self):
+        index = 0
+        while index < self.blob_size:
+            yield index
+            index += self.chunk_size
+
+    def preallocate(self):
+        if self.fd is None:
+            return
+        self.stream.flush()
+        self.stream.truncate(self.stream_start + self.blob_size)
+
+    def process_chunk(self, chunk_offset):
+        length = min(self.chunk_size, self.blob_size - chunk_offset)
+        data = _with_retries(
+            lambda: self._download_chunk(chunk_offset, length),
+            self.max_retries, self.retry_wait)
+        self._write_to_stream(data, chunk_offset)
+        self.progress.update(length)
+
+    def finish(self):
+        self.stream.seek(self.stream_start + self.blob_size)
+
+    def _download_chunk(self, chunk_offset, length):
+        chunk_range = 'bytes={0}-{1}'.format(chunk_offset,
+                                             chunk_offset + length - 1)
+        data = self.blob_service.get_blob(self.container_name,
+                                          self.blob_name,
+                                          self.snapshot,
+                                          x_ms_range=chunk_range,
+                                          x_ms_lease_id=self.x_ms_lease_id)
+        if len(data) != length:
+            raise WindowsAzureError(
+                _ERROR_CHUNK_LENGTH.format(length, chunk_offset, len(data)))
+        return data
+
+    def _write_to_stream(self, data, chunk_offset):
+        offset = self.stream_start + chunk_offset
+        if self.fd is not None:
+            written = 0
+            while written < len(data):
+                written += os.pwrite(self.fd, data[written:],
+                                     offset + written)
+        else:
+            with self.stream_lock:
+                self.stream.seek(offset)
+                self.stream.write(data)
+
+
+class _BlockBlobChunkUploader(object):
+
+    '''
+    Reads a stream in order and uploads each chunk as a block. Block ids
+    follow the read order so the final block list is the stream content.
+    '''
+
+    def __init__(self, blob_service, container_name, blob_name, blob_size,
+                 chunk_size, stream, x_ms_lease_id, max_retries, retry_wait,
+                 progress_callback):
+        self.blob_service = blob_service
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.blob_size = blob_size
+        self.chunk_size = chunk_size
+        self.stream = stream
+        self.x_ms_lease_id = x_ms_lease_id
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.progress = _ChunkProgress(blob_size, progress_callback)
+        self.block_ids = []
+
+    def get_chunks(self):
+        remain_bytes = self.blob_size
+        while remain_bytes is None or remain_bytes > 0:
+            read_size = self.chunk_size if remain_bytes is None else min(
+                remain_bytes, self.chunk_size)
+            data = self.stream.read(read_size)
+            if not data:
+                break
+            if remain_bytes is not None:
+                remain_bytes -= len(data)
+            block_id = '{0:08d}'.format(len(self.block_ids))
+            self.block_ids.append(block_id)
+            yield block_id, data
+
+    def process_chunk(self, chunk):
+        block_id, data = chunk
+        _with_retries(
+            lambda: self.blob_service.put_block(
+                self.container_name, self.blob_name, data, block_id,
+                x_ms_lease_id=self.x_ms_lease_id),
+            self.max_retries, self.retry_wait)
+        self.progress.update(len(data))
+
+
+def _download_blob_chunks(blob_service, container_name, blob_name, blob_size,
+                          chunk_size, stream, snapshot, x_ms_lease_id,
+                          max_connections, max_retries, retry_wait,
+                          progress_callback):
+    downloader = _BlobChunkDownloader(blob_service, container_name, blob_name,
+                                      blob_size, chunk_size, stream, snapshot,
+                                      x_ms_lease_id, max_retries, retry_wait,
+                                      progress_callback)
+    downloader.preallocate()
+    _run_chunks(downloader.process_chunk, downloader.get_chunk_offsets(),
+                max_connections)
+    downloader.finish()
+
+
+def _upload_blob_chunks(blob_service, container_name, blob_name, blob_size,
+                        chunk_size, stream, x_ms_lease_id, max_connections,
+                        max_retries, retry_wait, progress_callback):
+    uploader = _BlockBlobChunkUploader(blob_service, container_name, blob_name,
+                                       blob_size, chunk_size, stream,
+                                       x_ms_lease_id, max_retries, retry_wait,
+                                       progress_callback)
+    _run_chunks(uploader.process_chunk, uploader.get_chunks(),
+                max_connections)
+    return uploader.block_ids
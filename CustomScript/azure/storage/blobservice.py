@@ -52,6 +52,11 @@ from azure.storage import (
     _update_storage_blob_header,
     )
 from azure.storage.storageclient import _StorageClient
+from azure.storage._chunking import (
+    _download_blob_chunks,
+    _is_seekable,
+    _upload_blob_chunks,
+    )
 from os import path
 import sys
 if sys.version_info >= (3,):
@@ -701,7 +706,9 @@ class BlobService(_StorageClient):
                                  x_ms_blob_content_md5=None,
                                  x_ms_blob_cache_control=None,
                                  x_ms_meta_name_values=None,
-                                 x_ms_lease_id=None, progress_callback=None):
+                                 x_ms_lease_id=None, progress_callback=None,
+                                 max_connections=1, max_retries=5,
+                                 retry_wait=1.0):
         '''
         Creates a new block blob from a file path, or updates the content of an
         existing block blob, with automatic chunking and progress notifications.
@@ -736,6 +743,15 @@ class BlobService(_StorageClient):
             Callback for progress with signature function(current, total) where
             current is the number of bytes transfered so far, and total is the
             size of the blob, or None if the total size is unknown.
+        max_connections:
+            Maximum number of parallel connections to use when the blob size
+            exceeds 64MB. Blocks are read from the stream in order and
+            uploaded concurrently, then committed with a single block list.
+        max_retries:
+            Number of times to retry the upload of a block if the connection
+            fails.
+        retry_wait:
+            Sleep time in secs between retries.
         '''
         _validate_not_none('container_name', container_name)
         _validate_not_none('blob_name', blob_name)
@@ -758,7 +774,10 @@ class BlobService(_StorageClient):
                                           x_ms_blob_cache_control,
                                           x_ms_meta_name_values,
                                           x_ms_lease_id,
-                                          progress_callback)
+                                          progress_callback,
+                                          max_connections,
+                                          max_retries,
+                                          retry_wait)
 
     def put_block_blob_from_file(self, container_name, blob_name, stream,
                                  count=None, content_encoding=None,
@@ -770,7 +789,9 @@ class BlobService(_StorageClient):
                                  x_ms_blob_content_md5=None,
                                  x_ms_blob_cache_control=None,
                                  x_ms_meta_name_values=None,
-                                 x_ms_lease_id=None, progress_callback=None):
+                                 x_ms_lease_id=None, progress_callback=None,
+                                 max_connections=1, max_retries=5,
+                                 retry_wait=1.0):
         '''
         Creates a new block blob from a file/stream, or updates the content of
         an existing block blob, with automatic chunking and progress
@@ -809,6 +830,15 @@ class BlobService(_StorageClient):
             Callback for progress with signature function(current, total) where
             current is the number of bytes transfered so far, and total is the
             size of the blob, or None if the total size is unknown.
+        max_connections:
+            Maximum number of parallel connections to use when the blob size
+            exceeds 64MB. Blocks are read from the stream in order and
+            uploaded concurrently, then committed with a single block list.
+        max_retries:
+            Number of times to retry the upload of a block if the connection
+            fails.
+        retry_wait:
+            Sleep time in secs between retries.
         '''
         _validate_not_none('container_name', container_name)
         _validate_not_none('blob_name', blob_name)
@@ -857,30 +887,17 @@ class BlobService(_StorageClient):
                           x_ms_meta_name_values,
                           x_ms_lease_id)
 
-            remain_bytes = count
-            block_ids = []
-            block_index = 0
-            index = 0
-            while True:
-                request_count = self._BLOB_MAX_CHUNK_DATA_SIZE\
-                    if remain_bytes is None else min(
-                        remain_bytes,
-                        self._BLOB_MAX_CHUNK_DATA_SIZE)
-                data = stream.read(request_count)
-                if data:
-                    length = len(data)
-                    index += length
-                    remain_bytes = remain_bytes - \
-                        length if remain_bytes else None
-                    block_id = '{0:08d}'.format(block_index)
-                    self.put_block(container_name, blob_name,
-                                   data, block_id, x_ms_lease_id=x_ms_lease_id)
-                    block_ids.append(block_id)
-                    block_index += 1
-                    if progress_callback:
-                        progress_callback(index, count)
-                else:
-                    break
+            block_ids = _upload_blob_chunks(self,
+                                            container_name,
+                                            blob_name,
+                                            count,
+                                            self._BLOB_MAX_CHUNK_DATA_SIZE,
+                                            stream,
+                                            x_ms_lease_id,
+                                            max_connections,
+                                            max_retries,
+                                            retry_wait,
+                                            progress_callback)
 
             self.put_block_list(container_name, blob_name, block_ids,
                                 content_md5, x_ms_blob_cache_control,
@@ -1392,7 +1409,8 @@ class BlobService(_StorageClient):
 
     def get_blob_to_path(self, container_name, blob_name, file_path,
                          open_mode='wb', snapshot=None, x_ms_lease_id=None,
-                         progress_callback=None):
+                         progress_callback=None, max_connections=1,
+                         max_retries=5, retry_wait=1.0):
         '''
         Downloads a blob to a file path, with automatic chunking and progress
         notifications.
@@ -1409,6 +1427,15 @@ class BlobService(_StorageClient):
             Callback for progress with signature function(current, total) where
             current is the number of bytes transfered so far, and total is the
             size of the blob.
+        max_connections:
+            Maximum number of parallel connections to use when the blob size
+            exceeds 64MB. Each connection downloads a separate range and
+            writes it at its offset in the file, so open_mode must not append.
+        max_retries:
+            Number of times to retry the download of a range if the
+            connection fails.
+        retry_wait:
+            Sleep time in secs between retries.
         '''
         _validate_not_none('container_name', container_name)
         _validate_not_none('blob_name', blob_name)
@@ -1421,11 +1448,15 @@ class BlobService(_StorageClient):
                                   stream,
                                   snapshot,
                                   x_ms_lease_id,
-                                  progress_callback)
+                                  progress_callback,
+                                  max_connections,
+                                  max_retries,
+                                  retry_wait)
 
     def get_blob_to_file(self, container_name, blob_name, stream,
                          snapshot=None, x_ms_lease_id=None,
-                         progress_callback=None):
+                         progress_callback=None, max_connections=1,
+                         max_retries=5, retry_wait=1.0):
         '''
         Downloads a blob to a file/stream, with automatic chunking and progress
         notifications.
@@ -1441,6 +1472,16 @@ class BlobService(_StorageClient):
             Callback for progress with signature function(current, total) where
             current is the number of bytes transfered so far, and total is the
             size of the blob.
+        max_connections:
+            Maximum number of parallel connections to use when the blob size
+            exceeds 64MB. Each connection downloads a separate range and
+            writes it at its offset in the stream. Streams that cannot seek
+            are downloaded sequentially.
+        max_retries:
+            Number of times to retry the download of a range if the
+            connection fails.
+        retry_wait:
+            Sleep time in secs between retries.
         '''
         _validate_not_none('container_name', container_name)
         _validate_not_none('blob_name', blob_name)
@@ -1462,6 +1503,22 @@ class BlobService(_StorageClient):
 
             if progress_callback:
                 progress_callback(blob_size, blob_size)
+        elif max_connections > 1 and _is_seekable(stream):
+            if progress_callback:
+                progress_callback(0, blob_size)
+
+            _download_blob_chunks(self,
+                                  container_name,
+                                  blob_name,
+                                  blob_size,
+                                  self._BLOB_MAX_CHUNK_DATA_SIZE,
+                                  stream,
+                                  snapshot,
+                                  x_ms_lease_id,
+                                  max_connections,
+                                  max_retries,
+                                  retry_wait,
+                                  progress_callback)
         else:
             if progress_callback:
                 progress_callback(0, blob_size)
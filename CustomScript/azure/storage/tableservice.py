@@ -35,14 +35,54 @@ from azure.http.batchclient import _BatchClient
 from azure.storage import (
     StorageServiceProperties,
     _convert_entity_to_xml,
+    _convert_response_to_entities,
     _convert_response_to_entity,
     _convert_table_to_xml,
-    _convert_xml_to_entity,
     _convert_xml_to_table,
     _sign_storage_table_request,
     _update_storage_table_header,
     )
 from azure.storage.storageclient import _StorageClient
+import sys
+import threading
+
+
+def _get_next_keys(entities):
+    ''' Returns (next_partition_key, next_row_key) from the continuation of a
+    query result, or None on the last page. '''
+    x_ms_continuation = getattr(entities, 'x_ms_continuation', None)
+    if not x_ms_continuation:
+        return None
+    next_partition_key = x_ms_continuation.get('nextpartitionkey')
+    next_row_key = x_ms_continuation.get('nextrowkey')
+    if not next_partition_key and not next_row_key:
+        return None
+    return next_partition_key, next_row_key
+
+
+class _PrefetchThread(threading.Thread):
+
+    ''' Runs one query in the background; result() waits for it. '''
+
+    def __init__(self, query):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.query = query
+        self.entities = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.entities = self.query()
+        except Exception:
+            self.error = sys.exc_info()[1]
+
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.entities
 
 
 class TableService(_StorageClient):
@@ -267,7 +307,51 @@ class TableService(_StorageClient):
         request.headers = _update_storage_table_header(request)
         response = self._perform_request(request)
 
-        return _convert_response_to_feeds(response, _convert_xml_to_entity)
+        return _convert_response_to_entities(response, select)
+
+    def query_entities_iter(self, table_name, filter=None, select=None,
+                            top=None, prefetch=True):
+        '''
+        Generator over all the entities of a query. The continuation returned
+        with each page is followed until the last page, and at most two pages
+        are held in memory.
+
+        table_name: Table to query.
+        filter:
+            Optional. Filter as described at
+            http://msdn.microsoft.com/en-us/library/windowsazure/dd894031.aspx
+        select: Optional. Property names to select from the entities.
+        top: Optional. Maximum number of entities returned per page.
+        prefetch:
+            Optional. Requests the next page on a background thread while the
+            current one is being consumed. Do not start a batch on this
+            service while iterating with prefetch, the background request
+            would be added to it.
+        '''
+        _validate_not_none('table_name', table_name)
+
+        def query(next_keys):
+            return self.query_entities(table_name, filter, select, top,
+                                       next_keys[0], next_keys[1])
+
+        entities = self.query_entities(table_name, filter, select, top)
+        while True:
+            next_keys = _get_next_keys(entities)
+            next_page = None
+            if next_keys is not None and prefetch:
+                next_page = _PrefetchThread(lambda keys=next_keys: query(keys))
+
+            for entity in entities:
+                yield entity
+
+            if next_keys is None:
+                return
+            # drop the current page before the next one is collected
+            entities = None
+            if next_page is not None:
+                entities = next_page.result()
+            else:
+                entities = query(next_keys)
 
     def insert_entity(self, table_name, entity,
                       content_type='application/atom+xml'):
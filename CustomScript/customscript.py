@@ -16,12 +16,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import base64
+import hashlib
 import os
 import os.path
 import re
 import shutil
 import subprocess
 import sys
+import threading
 import time
 import traceback
 
@@ -35,15 +38,27 @@ import Utils.ScriptUtil as ScriptUtil
 if sys.version_info[0] == 3:
     import urllib.request as urllib
     from urllib.parse import urlparse
+    import queue as Queue
 
 elif sys.version_info[0] == 2:
     import urllib2 as urllib
     from urlparse import urlparse
+    import Queue
 
 ExtensionShortName = 'CustomScriptForLinux'
 
 # Global Variables
 DownloadDirectory = 'download'
+# Number of fileUris downloaded at the same time
+MaxDownloadConcurrency = 8
+# Ranged requests in flight for one blob larger than 64MB
+BlobDownloadConnections = 4
+# First delay between two tries of a file, doubled on every retry up to 'wait'
+DownloadInitialBackoff = 2
+# Read size for external file downloads
+DownloadBufferSize = 1024 * 1024
+# External files are written here first and renamed once complete
+PartialFileSuffix = '.partial'
 
 # CustomScript-specific Operation
 DownloadOp = "Download"
@@ -113,26 +128,25 @@ def download_files_with_retry(hutil, retry_count, wait):
     hutil.log(("Will try to download files, "
                "number of retries = {0}, "
                "wait SECONDS between retrievals = {1}s").format(retry_count, wait))
-    for download_retry_count in range(0, retry_count + 1):
-        try:
-            download_files(hutil)
-            break
-        except Exception as e:
-            error_msg = "{0}, retry = {1}, maxRetry = {2}.".format(e, download_retry_count, retry_count)
-            hutil.error(error_msg)
-            if download_retry_count < retry_count:
-                hutil.log("Sleep {0} seconds".format(wait))
-                time.sleep(wait)
-            else:
-                waagent.AddExtensionEvent(name=ExtensionShortName,
-                                          op=DownloadOp,
-                                          isSuccess=False,
-                                          version=hutil.get_extension_version(),
-                                          message="(01100)"+error_msg)
-                raise
+    try:
+        results = download_files(hutil, retry_count, wait)
+    except Exception as e:
+        error_msg = "{0}, maxRetry = {1}.".format(e, retry_count)
+        hutil.error(error_msg)
+        waagent.AddExtensionEvent(name=ExtensionShortName,
+                                  op=DownloadOp,
+                                  isSuccess=False,
+                                  version=hutil.get_extension_version(),
+                                  message="(01100)"+error_msg)
+        raise
 
+    download_retry_count = 0
+    for result in results:
+        download_retry_count = max(download_retry_count, result.retries)
     msg = ("Succeeded to download files, "
            "retry count = {0}").format(download_retry_count)
+    if results:
+        msg += ", " + "; ".join([str(result) for result in results])
     hutil.log(msg)
     waagent.AddExtensionEvent(name=ExtensionShortName,
                               op=DownloadOp,
@@ -179,7 +193,7 @@ def check_idns():
     return not ret
 
 
-def download_files(hutil):
+def download_files(hutil, retry_count=0, wait=0):
     public_settings = hutil.get_public_settings()
     if public_settings is None:
         raise ValueError("Public configuration couldn't be None.")
@@ -205,22 +219,25 @@ def download_files(hutil):
                                   isSuccess=False,
                                   version=hutil.get_extension_version(),
                                   message="(01001)"+error_msg)
-        return
+        return []
 
     hutil.do_status_report('Downloading','transitioning', '0',
                            'Downloading files...')
 
     if storage_account_name and storage_account_key:
         hutil.log("Downloading scripts from azure storage...")
-        download_blobs(storage_account_name,
-                       storage_account_key,
-                       blob_uris,
-                       cmd,
-                       hutil)
+        return download_blobs(storage_account_name,
+                              storage_account_key,
+                              blob_uris,
+                              cmd,
+                              hutil,
+                              retry_count,
+                              wait)
     elif not(storage_account_name or storage_account_key):
         hutil.log("No azure storage account and key specified in protected "
                   "settings. Downloading scripts from external links...")
-        download_external_files(blob_uris, cmd, hutil)
+        return download_external_files(blob_uris, cmd, hutil,
+                                       retry_count, wait)
     else:
         #Storage account and key should appear in pairs
         error_msg = "Azure storage account and key should appear in pairs."
@@ -305,14 +322,14 @@ def daemon(hutil):
 
 
 def download_blobs(storage_account_name, storage_account_key,
-                   blob_uris, command, hutil):
-    for blob_uri in blob_uris:
-        if blob_uri:
-            download_blob(storage_account_name,
-                          storage_account_key,
-                          blob_uri,
-                          command,
-                          hutil)
+                   blob_uris, command, hutil, retry_count=0, wait=0):
+    def download(blob_uri):
+        return download_blob(storage_account_name,
+                             storage_account_key,
+                             blob_uri,
+                             command,
+                             hutil)
+    return run_downloads(blob_uris, download, hutil, retry_count, wait)
 
 
 def download_blob(storage_account_name, storage_account_key,
@@ -329,6 +346,7 @@ def download_blob(storage_account_name, storage_account_key,
         preprocess_files(download_path, hutil)
         if command and blob_name in command:
             os.chmod(download_path, 0o100)
+        return download_path
     except Exception as e:
         error_msg = "Failed to download blob with uri: {0} with error {1}".format(blob_uri, e)
         raise Exception(error_msg)
@@ -354,40 +372,251 @@ def download_and_save_blob(storage_account_name,
     blob_service = BlobService(storage_account_name,
                                storage_account_key,
                                host_base=host_base)
-    blob_service.get_blob_to_path(container_name, blob_name, download_path)
+    blob_service.get_blob_to_path(container_name, blob_name, download_path,
+                                  max_connections=BlobDownloadConnections)
     return blob_name, container_name, host_base, download_path
 
 
-def download_external_files(uris, command, hutil):
-    for uri in uris:
-        if uri:
-            download_external_file(uri, command, hutil)
+def download_external_files(uris, command, hutil, retry_count=0, wait=0):
+    def download(uri):
+        return download_external_file(uri, command, hutil)
+    return run_downloads(uris, download, hutil, retry_count, wait)
 
 
-def download_external_file(uri, command, hutil):
+def download_external_file(uri, command, hutil, sha256=None):
     seqNo = hutil.get_seq_no()
     download_dir = prepare_download_dir(seqNo)
     path = get_path_from_uri(uri)
     file_name = path.split('/')[-1]
     file_path = os.path.join(download_dir, file_name)
     try:
-        download_and_save_file(uri, file_path)
+        download_and_save_file(uri, file_path, sha256=sha256)
         preprocess_files(file_path, hutil)
         if command and file_name in command:
             os.chmod(file_path, 0o100)
+        return file_path
     except Exception as e:
         error_msg = ("Failed to download external file with uri: {0} "
                      "with error {1}").format(uri, e)
         raise Exception(error_msg)
 
 
-def download_and_save_file(uri, file_path, timeout=30, buf_size=1024):
-    src = urllib.urlopen(uri, timeout=timeout)
-    with open(file_path, 'wb') as dest:
-        buf = src.read(buf_size)
-        while(buf):
-            dest.write(buf)
-            buf = src.read(buf_size)
+class DownloadResult(object):
+    def __init__(self, uri):
+        self.uri = uri
+        self.file_path = None
+        self.size = 0
+        self.duration = 0
+        self.retries = 0
+        self.error = None
+
+    def throughput(self):
+        """Bytes per second of the successful try"""
+        if self.duration <= 0:
+            return 0
+        return self.size / self.duration
+
+    def __str__(self):
+        return ("{0}: {1} bytes in {2:.2f}s ({3:.2f} MB/s), "
+                "retries = {4}").format(get_path_from_uri(self.uri).split('/')[-1],
+                                        self.size,
+                                        self.duration,
+                                        self.throughput() / 1024 / 1024,
+                                        self.retries)
+
+
+def get_retry_delay(retry, wait):
+    return min(wait, DownloadInitialBackoff * (2 ** retry))
+
+
+def download_with_retry(uri, download, hutil, retry_count, wait, stop):
+    """
+    Tries download(uri) up to retry_count + 1 times, backing off between
+    tries. Gives up early once stop is set because another file failed.
+    """
+    result = DownloadResult(uri)
+    for retry in range(0, retry_count + 1):
+        result.retries = retry
+        start_time = time.time()
+        try:
+            result.file_path = download(uri)
+            result.duration = time.time() - start_time
+            result.size = os.path.getsize(result.file_path)
+            result.error = None
+            return result
+        except Exception as e:
+            result.error = e
+            hutil.error("{0}, retry = {1}, maxRetry = {2}.".format(e, retry, retry_count))
+            if retry == retry_count or stop.is_set():
+                break
+            delay = get_retry_delay(retry, wait)
+            hutil.log("Sleep {0} seconds before retrying {1}".format(delay, uri))
+            stop.wait(delay)
+            if stop.is_set():
+                break
+    return result
+
+
+def run_downloads(uris, download, hutil, retry_count=0, wait=0,
+                  concurrency=MaxDownloadConcurrency):
+    """
+    Downloads the non empty uris on at most concurrency threads, each file
+    retried on its own. Uris saved to the same file name are downloaded one
+    after another in the given order, so the last one still wins.
+    Returns a DownloadResult per uri, raises on the first file that fails
+    all its tries.
+    """
+    groups = []
+    group_of_name = {}
+    for uri in uris:
+        if not uri:
+            continue
+        file_name = get_path_from_uri(uri).split('/')[-1]
+        if file_name in group_of_name:
+            group_of_name[file_name].append(uri)
+        else:
+            group_of_name[file_name] = [uri]
+            groups.append(group_of_name[file_name])
+    total = sum([len(group) for group in groups])
+    if total == 0:
+        return []
+
+    pending = Queue.Queue()
+    for group in groups:
+        pending.put(group)
+    done = Queue.Queue()
+    stop = threading.Event()
+
+    def worker():
+        while True:
+            try:
+                group = pending.get_nowait()
+            except Queue.Empty:
+                return
+            for uri in group:
+                if stop.is_set():
+                    result = DownloadResult(uri)
+                    result.error = Exception("Skipped {0}".format(uri))
+                else:
+                    result = download_with_retry(uri, download, hutil,
+                                                 retry_count, wait, stop)
+                done.put(result)
+
+    threads = []
+    for i in range(0, min(concurrency, len(groups))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    results = []
+    error = None
+    while len(results) < total:
+        result = done.get()
+        results.append(result)
+        if result.error is not None:
+            if error is None:
+                error = result.error
+                stop.set()
+            continue
+        hutil.log("Downloaded {0}".format(result))
+        hutil.do_status_report('Downloading', 'transitioning', '0',
+                               'Downloaded {0} of {1} files...'.format(
+                                   len(results), total))
+    for thread in threads:
+        thread.join()
+    if error is not None:
+        raise error
+    return results
+
+
+# Validator (ETag or Last-Modified) of the response each .partial file was
+# written from, a partial file is only resumed if the server still has the
+# same version of the file
+partial_file_validators = {}
+
+
+def download_and_save_file(uri, file_path, timeout=30,
+                           buf_size=DownloadBufferSize, sha256=None):
+    """
+    Streams uri into file_path + '.partial' and renames it to file_path once
+    complete and verified. If a previous try left a partial file, only the
+    missing bytes are requested with a Range header.
+    The file is checked against x-ms-blob-content-md5 or Content-MD5 when the
+    server sends one, and against sha256 (hex digest) when given.
+    """
+    partial_path = file_path + PartialFileSuffix
+    validator = partial_file_validators.pop(partial_path, None)
+    offset = 0
+    if validator is not None and os.path.isfile(partial_path):
+        offset = os.path.getsize(partial_path)
+
+    request = urllib.Request(uri)
+    if offset > 0:
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+        request.add_header('If-Range', validator)
+    src = urllib.urlopen(request, timeout=timeout)
+    try:
+        headers = src.info()
+        resumed = offset > 0 and src.getcode() == 206
+        if not resumed:
+            offset = 0
+        validator = headers.get('ETag') or headers.get('Last-Modified')
+        content_length = headers.get('Content-Length')
+        with open(partial_path, 'ab' if resumed else 'wb') as dest:
+            if validator is not None:
+                partial_file_validators[partial_path] = validator
+            shutil.copyfileobj(src, dest, buf_size)
+    finally:
+        src.close()
+
+    size = os.path.getsize(partial_path)
+    if content_length is not None and size != offset + int(content_length):
+        raise IOError(("Incomplete download of {0}, got {1} of {2} bytes"
+                       "").format(uri, size, offset + int(content_length)))
+
+    # Content-MD5 of a range response only covers the range
+    content_md5 = headers.get('x-ms-blob-content-md5')
+    if content_md5 is None and not resumed:
+        content_md5 = headers.get('Content-MD5')
+    try:
+        verify_file(partial_path, content_md5, sha256)
+    except Exception:
+        partial_file_validators.pop(partial_path, None)
+        os.remove(partial_path)
+        raise
+    partial_file_validators.pop(partial_path, None)
+    os.rename(partial_path, file_path)
+
+
+def verify_file(file_path, content_md5=None, sha256=None,
+                buf_size=DownloadBufferSize):
+    """
+    content_md5 is base64 encoded as sent in the Content-MD5 header, sha256 a
+    hex digest. Raises ValueError on mismatch.
+    """
+    if content_md5 is None and sha256 is None:
+        return
+    md5_hash = hashlib.md5()
+    sha256_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        buf = f.read(buf_size)
+        while buf:
+            if content_md5 is not None:
+                md5_hash.update(buf)
+            if sha256 is not None:
+                sha256_hash.update(buf)
+            buf = f.read(buf_size)
+    if content_md5 is not None:
+        actual = base64.b64encode(md5_hash.digest()).decode('ascii')
+        if actual != content_md5.strip():
+            raise ValueError(("Content-MD5 mismatch for {0}, expected {1}, "
+                              "got {2}").format(file_path, content_md5, actual))
+    if sha256 is not None:
+        actual = sha256_hash.hexdigest()
+        if actual != sha256.strip().lower():
+            raise ValueError(("SHA-256 mismatch for {0}, expected {1}, "
+                              "got {2}").format(file_path, sha256, actual))
 
 
 def preprocess_files(file_path, hutil):
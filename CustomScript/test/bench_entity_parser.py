@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Parses a synthetic table feed the way query_entities used to, a minidom
+# document plus one cloned and re-parsed document per entry, and with the
+# iterparse entity parser, with and without a $select projection. Finding
+# the namespaces of each cloned entry walks the whole document, so the old
+# path is quadratic in the number of entities and is only timed once.
+# Peak memory (Python 3 only) is reported for the minidom document alone,
+# which is a lower bound for the old path.
+#
+# python bench_entity_parser.py [entities] [rounds]
+
+import sys
+import time
+from xml.dom import minidom
+
+import env
+from azure import (
+    METADATA_NS,
+    _convert_response_to_feeds,
+    _get_child_nodes,
+    _get_child_nodesNS,
+    _get_entry_properties,
+    )
+from azure.http import HTTPResponse
+from azure.storage import (
+    Entity,
+    EntityProperty,
+    _ENTITY_TO_PYTHON_CONVERSIONS,
+    _convert_response_to_entities,
+    )
+from test_entity_parser import make_feed
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def minidomEntity(xmlstr):
+    # _convert_xml_to_entity before the iterparse parser
+    xmldoc = minidom.parseString(xmlstr)
+    xml_properties = None
+    for entry in _get_child_nodes(xmldoc, 'entry'):
+        for content in _get_child_nodes(entry, 'content'):
+            xml_properties = _get_child_nodesNS(
+                content, METADATA_NS, 'properties')
+    if not xml_properties:
+        return None
+    entity = Entity()
+    for xml_property in xml_properties[0].childNodes:
+        name = xml_property.nodeName.split(':')[-1]
+        if name in ['Timestamp']:
+            continue
+        value = xml_property.firstChild.nodeValue \
+            if xml_property.firstChild else ''
+        isnull = xml_property.getAttributeNS(METADATA_NS, 'null')
+        mtype = xml_property.getAttributeNS(METADATA_NS, 'type')
+        if not isnull and not mtype:
+            setattr(entity, name, value)
+        elif isnull != 'true':
+            conv = _ENTITY_TO_PYTHON_CONVERSIONS.get(mtype)
+            setattr(entity, name, conv(value) if conv is not None
+                    else EntityProperty(mtype, value))
+    for name, value in _get_entry_properties(xmlstr, True).items():
+        if name in ['etag']:
+            setattr(entity, name, value)
+    return entity
+
+def attributes(entity):
+    return dict((name, value.value if isinstance(value, EntityProperty)
+                 else value) for name, value in entity.__dict__.items())
+
+def measure(parse, response, rounds):
+    start = time.time()
+    for i in range(0, rounds):
+        result = parse(response)
+    return result, (time.time() - start) / rounds
+
+def peak_memory(parse, response):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    parse(response)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def report(label, elapsed, peak):
+    line = "{0:26}: {1:8.1f} ms".format(label, elapsed * 1000)
+    if peak is not None:
+        line += ", peak {0:.1f} MB".format(peak / 1024.0 / 1024.0)
+    print(line)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    response = HTTPResponse(200, 'OK', [], make_feed(count))
+
+    select = lambda r: _convert_response_to_entities(r, 'RowKey,TotalRequests')
+    old, before = measure(
+        lambda r: _convert_response_to_feeds(r, minidomEntity), response, 1)
+    new, after = measure(_convert_response_to_entities, response, rounds)
+    selected, projected = measure(select, response, rounds)
+
+    assert [attributes(e) for e in old] == [attributes(e) for e in new]
+    assert len(selected) == count
+
+    print("entities                  : {0} ({1} KB feed)".format(
+        count, len(response.body) // 1024))
+    report("minidom + clone per entry", before,
+           peak_memory(lambda r: minidom.parseString(r.body), response))
+    report("iterparse", after,
+           peak_memory(_convert_response_to_entities, response))
+    report("iterparse, $select 2", projected, peak_memory(select, response))
+    print("speedup                   : {0:.1f}x".format(before / after))
+
+if __name__ == '__main__':
+    main()
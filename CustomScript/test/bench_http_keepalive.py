@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Requests/sec of the vendored azure _HTTPClient against a local HTTP/1.1
+# stand-in, with a new connection per request versus kept alive connections.
+# This is plain HTTP on loopback, so it only shows the TCP setup; the TLS
+# handshake saved against a real storage endpoint is far more expensive.
+#
+# python bench_http_keepalive.py [requests]
+
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+import env
+from azure.http import HTTPRequest
+from azure.http.httpclient import _HTTPClient
+
+Body = b"<?xml version='1.0' encoding='utf-8'?><feed/>"
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(Body)))
+        self.end_headers()
+        self.wfile.write(Body)
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def run(host, count, keep_alive, method):
+    client = _HTTPClient(None, protocol='http')
+    client.keep_alive = keep_alive
+    start = time.time()
+    for i in range(0, count):
+        request = HTTPRequest()
+        request.method = method
+        request.host = host
+        request.path = '/table()'
+        if method == 'PUT':
+            request.body = Body
+            request.headers = [('Content-Length', str(len(Body)))]
+        client.perform_request(request)
+    elapsed = time.time() - start
+    client.close()
+    return count / elapsed
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    host = "127.0.0.1:{0}".format(server.server_port)
+
+    print("requests                  : {0}".format(count))
+    for method in ['GET', 'PUT']:
+        before = run(host, count, False, method)
+        after = run(host, count, True, method)
+        print("{0} new connection, req/s : {1:.0f}".format(method, before))
+        print("{0} keep alive, req/s     : {1:.0f}".format(method, after))
+        print("{0} speedup               : {1:.1f}x".format(method, after / before))
+    server.shutdown()
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+import env
+from azure import WindowsAzureError, WindowsAzureMissingResourceError
+from azure.storage import BlobService
+
+Content = os.urandom(1000)
+
+class FakeBlobService(BlobService):
+    '''
+    Keeps blobs in memory so the chunking can be tested without a storage
+    account. Chunks are 64 bytes and anything from 256 bytes up is chunked.
+    '''
+    def __init__(self, failures=0):
+        BlobService.__init__(self, 'account', 'a2V5')
+        self._BLOB_MAX_DATA_SIZE = 256
+        self._BLOB_MAX_CHUNK_DATA_SIZE = 64
+        self.lock = threading.Lock()
+        self.failures = failures
+        self.ranges = []
+        self.blocks = {}
+        self.block_list = None
+        self.active = 0
+        self.max_active = 0
+
+    def _call(self):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            fail = self.failures > 0
+            if fail:
+                self.failures -= 1
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        if fail:
+            raise WindowsAzureError("connection reset")
+
+    def get_blob_properties(self, container_name, blob_name,
+                            x_ms_lease_id=None):
+        return {'content-length': str(len(Content))}
+
+    def get_blob(self, container_name, blob_name, snapshot=None,
+                 x_ms_range=None, x_ms_lease_id=None,
+                 x_ms_range_get_content_md5=None):
+        self._call()
+        start, end = x_ms_range.split('=')[1].split('-')
+        with self.lock:
+            self.ranges.append(x_ms_range)
+        return Content[int(start):int(end) + 1]
+
+    def put_blob(self, *args, **kwargs):
+        pass
+
+    def put_block(self, container_name, blob_name, block, blockid,
+                  content_md5=None, x_ms_lease_id=None):
+        self._call()
+        with self.lock:
+            self.blocks[blockid] = block
+
+    def put_block_list(self, container_name, blob_name, block_list, *args):
+        self.block_list = block_list
+
+class TestBlobChunking(unittest.TestCase):
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.download_dir, "blob")
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir)
+
+    def test_parallel_download_to_path(self):
+        service = FakeBlobService()
+        progress = []
+        service.get_blob_to_path("c", "b", self.file_path,
+                                 progress_callback=lambda c, t: progress.append(c),
+                                 max_connections=4)
+        with open(self.file_path, 'rb') as f:
+            self.assertEqual(Content, f.read())
+        self.assertEqual(16, len(service.ranges))
+        self.assertEqual("bytes=960-999", sorted(service.ranges)[-1])
+        self.assertTrue(service.max_active > 1)
+        self.assertEqual(len(Content), progress[-1])
+
+    def test_parallel_download_to_stream(self):
+        service = FakeBlobService()
+        stream = BytesIO()
+        stream.write(b"header")
+        service.get_blob_to_file("c", "b", stream, max_connections=4)
+        self.assertEqual(b"header" + Content, stream.getvalue())
+        self.assertEqual(len(Content) + 6, stream.tell())
+
+    def test_download_retries_chunk(self):
+        service = FakeBlobService(failures=2)
+        service.get_blob_to_path("c", "b", self.file_path, max_connections=4,
+                                 retry_wait=0)
+        with open(self.file_path, 'rb') as f:
+            self.assertEqual(Content, f.read())
+        self.assertEqual(16, len(service.ranges))
+
+    def test_download_failure_after_retries(self):
+        service = FakeBlobService(failures=100)
+        self.assertRaises(WindowsAzureError, service.get_blob_to_path, "c",
+                          "b", self.file_path, max_connections=4,
+                          max_retries=1, retry_wait=0)
+        self.assertTrue(service.failures > 0)
+
+    def test_missing_blob_not_retried(self):
+        service = FakeBlobService()
+        calls = []
+        def get_blob(*args, **kwargs):
+            calls.append(args)
+            raise WindowsAzureMissingResourceError("not found")
+        service.get_blob = get_blob
+        self.assertRaises(WindowsAzureMissingResourceError,
+                          service.get_blob_to_path, "c", "b", self.file_path,
+                          max_connections=2, retry_wait=0)
+        self.assertTrue(len(calls) <= 2)
+
+    def test_parallel_upload(self):
+        service = FakeBlobService(failures=1)
+        service.put_block_blob_from_file("c", "b", BytesIO(Content),
+                                         len(Content), max_connections=4,
+                                         retry_wait=0)
+        self.assertEqual(['{0:08d}'.format(i) for i in range(0, 16)],
+                         service.block_list)
+        data = b"".join([service.blocks[i] for i in service.block_list])
+        self.assertEqual(Content, data)
+        self.assertTrue(service.max_active > 1)
+
+    def test_upload_unknown_size(self):
+        service = FakeBlobService()
+        service.put_block_blob_from_file("c", "b", BytesIO(Content))
+        data = b"".join([service.blocks[i] for i in service.block_list])
+        self.assertEqual(Content, data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from MockUtil import MockUtil
+import customscript as cs
+
+class TestDownloadScheduler(unittest.TestCase):
+    def setUp(self):
+        self.hutil = MockUtil(self)
+        self.download_dir = tempfile.mkdtemp()
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir)
+
+    def fake_download(self, delay=0, failures=None):
+        if failures is None:
+            failures = {}
+        def download(uri):
+            with self.lock:
+                self.calls.append(uri)
+                fail = failures.get(uri, 0) > 0
+                if fail:
+                    failures[uri] -= 1
+            time.sleep(delay)
+            if fail:
+                raise Exception("Failed to download {0}".format(uri))
+            file_path = os.path.join(self.download_dir, uri.split('/')[-1])
+            with open(file_path, 'w') as f:
+                f.write(uri)
+            return file_path
+        return download
+
+    def test_parallel_download(self):
+        uris = ["https://host/c/file{0}.sh".format(i) for i in range(0, 8)]
+        start_time = time.time()
+        results = cs.run_downloads(uris, self.fake_download(delay=0.5),
+                                   self.hutil, concurrency=8)
+        self.assertTrue(time.time() - start_time < 2)
+        self.assertEqual(8, len(results))
+        for result in results:
+            self.assertEqual(None, result.error)
+            self.assertEqual(len(result.uri), result.size)
+            self.assertTrue(result.duration > 0)
+            self.assertTrue(result.throughput() > 0)
+
+    def test_retry_per_file(self):
+        uris = ["https://host/c/a.sh", "https://host/c/b.sh", ""]
+        failures = {"https://host/c/b.sh": 2}
+        results = cs.run_downloads(uris, self.fake_download(failures=failures),
+                                   self.hutil, retry_count=3, wait=0)
+        self.assertEqual(2, len(results))
+        retries = dict([(result.uri, result.retries) for result in results])
+        self.assertEqual(0, retries["https://host/c/a.sh"])
+        self.assertEqual(2, retries["https://host/c/b.sh"])
+        self.assertEqual(1, self.calls.count("https://host/c/a.sh"))
+
+    def test_failure_after_retries(self):
+        uris = ["https://host/c/a.sh", "https://host/c/b.sh"]
+        failures = {"https://host/c/b.sh": 10}
+        self.assertRaises(Exception, cs.run_downloads, uris,
+                          self.fake_download(failures=failures),
+                          self.hutil, 2, 0)
+        self.assertEqual(3, self.calls.count("https://host/c/b.sh"))
+
+    def test_same_file_name_in_order(self):
+        uris = ["https://host/c1/a.sh", "https://host/c2/a.sh"]
+        cs.run_downloads(uris, self.fake_download(delay=0.1), self.hutil)
+        self.assertEqual(uris, self.calls)
+        with open(os.path.join(self.download_dir, "a.sh")) as f:
+            self.assertEqual(uris[1], f.read())
+
+    def test_retry_delay(self):
+        self.assertEqual(2, cs.get_retry_delay(0, 20))
+        self.assertEqual(16, cs.get_retry_delay(3, 20))
+        self.assertEqual(20, cs.get_retry_delay(4, 20))
+        self.assertEqual(0, cs.get_retry_delay(0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
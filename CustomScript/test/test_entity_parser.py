@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import re
+from datetime import datetime
+
+import env
+from azure.http import HTTPResponse
+from azure.storage import (
+    EntityProperty,
+    _convert_response_to_entities,
+    _convert_xml_to_entity,
+    _iter_entities,
+    )
+
+Entry = b"""<entry m:etag="W/&quot;datetime'2014-10-01T00%3A00%3A00Z'&quot;">
+  <id>https://account.table.core.windows.net/t(PartitionKey='p',RowKey='{0}')</id>
+  <title type="text" />
+  <updated>2014-10-01T00:00:00Z</updated>
+  <author><name /></author>
+  <content type="application/xml">
+    <m:properties>
+      <d:PartitionKey>p</d:PartitionKey>
+      <d:RowKey>{0}</d:RowKey>
+      <d:Timestamp m:type="Edm.DateTime">2014-10-01T00:00:00Z</d:Timestamp>
+      <d:TotalRequests m:type="Edm.Int64">{0}</d:TotalRequests>
+      <d:Availability m:type="Edm.Double">99.5</d:Availability>
+      <d:IsActive m:type="Edm.Boolean">true</d:IsActive>
+      <d:Since m:type="Edm.DateTime">2008-07-10T00:00:00</d:Since>
+      <d:Code m:type="Edm.Guid">c9da6455-213d-42c9-9a79-3e9149a57833</d:Code>
+      <d:Missing m:type="Edm.Binary" m:null="true" />
+      <d:Name>caf\xc3\xa9</d:Name>
+    </m:properties>
+  </content>
+</entry>"""
+# the service does not indent its responses
+Entry = re.sub(b">\\s+<", b"><", Entry)
+
+Namespaces = b"""xmlns:d="http://schemas.microsoft.com/ado/2007/08/dataservices" xmlns:m="http://schemas.microsoft.com/ado/2007/08/dataservices/metadata" xmlns="http://www.w3.org/2005/Atom\""""
+
+def make_feed(count):
+    entries = b"".join([Entry.replace(b"{0}", str(i).encode('ascii'))
+                        for i in range(0, count)])
+    return (b'<?xml version="1.0" encoding="utf-8" standalone="yes"?>' +
+            b'<feed ' + Namespaces + b'><title type="text">t</title>' +
+            entries + b'</feed>')
+
+class TestEntityParser(unittest.TestCase):
+    def test_single_entry(self):
+        xmlstr = Entry.replace(b"{0}", b"7").replace(
+            b"<entry ", b"<entry " + Namespaces + b" ", 1)
+        entity = _convert_xml_to_entity(xmlstr)
+        self.assertEqual('p', entity.PartitionKey)
+        self.assertEqual('7', entity.RowKey)
+        self.assertEqual(7, entity.TotalRequests)
+        self.assertEqual(99.5, entity.Availability)
+        self.assertEqual(True, entity.IsActive)
+        self.assertEqual(datetime(2008, 7, 10), entity.Since)
+        self.assertTrue(isinstance(entity.Code, EntityProperty))
+        self.assertEqual('Edm.Guid', entity.Code.type)
+        self.assertEqual(b"caf\xc3\xa9".decode('utf-8'), entity.Name)
+        self.assertEqual("W/\"datetime'2014-10-01T00%3A00%3A00Z'\"",
+                         entity.etag)
+        self.assertFalse(hasattr(entity, 'Timestamp'))
+        self.assertFalse(hasattr(entity, 'Missing'))
+
+    def test_feed(self):
+        headers = [('x-ms-continuation-nextpartitionkey', '1!8!cA--'),
+                   ('x-ms-continuation-nextrowkey', '1!4!Mw--')]
+        response = HTTPResponse(200, 'OK', headers, make_feed(3))
+        entities = _convert_response_to_entities(response)
+        self.assertEqual(['0', '1', '2'], [e.RowKey for e in entities])
+        self.assertEqual([0, 1, 2], [e.TotalRequests for e in entities])
+        self.assertEqual('1!8!cA--',
+                         entities.x_ms_continuation['NextPartitionKey'])
+        self.assertEqual('1!4!Mw--', entities.x_ms_continuation['NextRowKey'])
+
+    def test_select(self):
+        entities = list(_iter_entities(make_feed(2), "RowKey, TotalRequests"))
+        self.assertEqual(2, len(entities))
+        self.assertEqual('1', entities[1].RowKey)
+        self.assertEqual(1, entities[1].TotalRequests)
+        self.assertFalse(hasattr(entities[1], 'PartitionKey'))
+        self.assertFalse(hasattr(entities[1], 'Availability'))
+
+    def test_lazy(self):
+        entities = _iter_entities(make_feed(3))
+        self.assertEqual('0', next(entities).RowKey)
+        self.assertEqual('1', next(entities).RowKey)
+
+    def test_empty_feed(self):
+        response = HTTPResponse(200, 'OK', [], make_feed(0))
+        entities = _convert_response_to_entities(response)
+        self.assertEqual(0, len(entities))
+        self.assertFalse(hasattr(entities, 'x_ms_continuation'))
+
+if __name__ == '__main__':
+    unittest.main()
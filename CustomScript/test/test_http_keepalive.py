@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+import env
+from azure.http import HTTPError, HTTPRequest
+from azure.http.httpclient import _HTTPClient
+
+Body = b"x" * 1000
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    clients = []
+    posts = []
+
+    def do_GET(self):
+        KeepAliveHandler.clients.append(self.client_address)
+        status = 404 if self.path == '/missing' else 200
+        body = b"" if self.path == '/empty' else Body
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/drop':
+            # close without announcing it, like an idle timeout
+            self.close_connection = True
+
+    def do_POST(self):
+        KeepAliveHandler.clients.append(self.client_address)
+        length = int(self.headers['Content-Length'])
+        KeepAliveHandler.posts.append(self.rfile.read(length))
+        # the message is applied, the connection drops before the response
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class TestHTTPKeepAlive(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.host = "127.0.0.1:{0}".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        KeepAliveHandler.clients = []
+        KeepAliveHandler.posts = []
+        self.client = _HTTPClient(None, protocol='http')
+
+    def tearDown(self):
+        self.client.close()
+
+    def request(self, path, method='GET', body=None):
+        request = HTTPRequest()
+        request.method = method
+        request.host = self.host
+        request.path = path
+        if body is not None:
+            request.headers = [('Content-Length', str(len(body)))]
+            request.body = body
+        return self.client.perform_request(request)
+
+    def test_connection_reused(self):
+        for i in range(0, 5):
+            self.assertEqual(Body, self.request('/blob').body)
+        self.assertEqual(5, len(KeepAliveHandler.clients))
+        self.assertEqual(1, len(set(KeepAliveHandler.clients)))
+
+    def test_keep_alive_off(self):
+        self.client.keep_alive = False
+        for i in range(0, 3):
+            self.assertEqual(Body, self.request('/blob').body)
+        self.assertEqual(3, len(set(KeepAliveHandler.clients)))
+
+    def test_reconnect_after_server_close(self):
+        self.assertEqual(Body, self.request('/drop').body)
+        self.assertEqual(Body, self.request('/blob').body)
+        self.assertEqual(2, len(set(KeepAliveHandler.clients)))
+
+    def test_post_not_sent_twice(self):
+        self.assertEqual(Body, self.request('/blob').body)
+        # the POST goes out on the kept connection, the server applies it
+        # and drops the connection without answering
+        self.assertRaises(Exception, self.request, '/messages', 'POST', b'message')
+        self.assertEqual([b'message'], KeepAliveHandler.posts)
+
+    def test_connection_reused_after_error(self):
+        self.assertRaises(HTTPError, self.request, '/missing')
+        self.assertEqual(Body, self.request('/blob').body)
+        self.assertEqual(1, len(set(KeepAliveHandler.clients)))
+
+    def test_connection_reused_after_empty_body(self):
+        self.assertEqual(None, self.request('/empty').body)
+        self.assertEqual(Body, self.request('/blob').body)
+        self.assertEqual(1, len(set(KeepAliveHandler.clients)))
+
+if __name__ == '__main__':
+    unittest.main()
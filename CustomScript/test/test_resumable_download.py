@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import customscript as cs
+
+Content = b"#!/bin/bash\necho hello\n" * 5000
+ETag = '"0x8D1"'
+
+class RangeHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        headers = dict((k.lower(), v) for k, v in self.headers.items())
+        RangeHandler.requests.append(headers)
+        start = 0
+        if 'range' in headers and headers.get('if-range') == ETag:
+            start = int(headers['range'].split('=')[1].split('-')[0])
+        body = Content[start:]
+        self.send_response(206 if start > 0 else 200)
+        self.send_header('ETag', ETag)
+        self.send_header('Content-Length', str(len(body)))
+        if start == 0:
+            md5 = base64.b64encode(hashlib.md5(Content).digest())
+            self.send_header('Content-MD5', md5.decode('ascii'))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestResumableDownload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), RangeHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.uri = "http://127.0.0.1:{0}/script.sh".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.download_dir, "script.sh")
+        RangeHandler.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir)
+
+    def read_file(self):
+        with open(self.file_path, 'rb') as f:
+            return f.read()
+
+    def test_download(self):
+        cs.download_and_save_file(self.uri, self.file_path)
+        self.assertEqual(Content, self.read_file())
+        self.assertFalse(os.path.exists(self.file_path + ".partial"))
+
+    def test_resume(self):
+        partial_path = self.file_path + ".partial"
+        with open(partial_path, 'wb') as f:
+            f.write(Content[:1000])
+        cs.partial_file_validators[partial_path] = ETag
+        cs.download_and_save_file(self.uri, self.file_path)
+        self.assertEqual(Content, self.read_file())
+        self.assertEqual("bytes=1000-", RangeHandler.requests[0].get("range"))
+
+    def test_partial_without_validator_restarts(self):
+        partial_path = self.file_path + ".partial"
+        with open(partial_path, 'wb') as f:
+            f.write(b"stale content")
+        cs.download_and_save_file(self.uri, self.file_path)
+        self.assertEqual(Content, self.read_file())
+        self.assertEqual(None, RangeHandler.requests[0].get("range"))
+
+    def test_sha256(self):
+        sha256 = hashlib.sha256(Content).hexdigest()
+        cs.download_and_save_file(self.uri, self.file_path, sha256=sha256)
+        self.assertEqual(Content, self.read_file())
+
+        os.remove(self.file_path)
+        self.assertRaises(ValueError, cs.download_and_save_file, self.uri,
+                          self.file_path, sha256="0" * 64)
+        self.assertFalse(os.path.exists(self.file_path))
+        self.assertFalse(os.path.exists(self.file_path + ".partial"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+#CustomScript extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import threading
+import time
+
+import env
+from azure import HeaderDict, WindowsAzureError, _list_of
+from azure.storage import Entity, TableService
+
+class FakeTableService(TableService):
+    '''
+    Serves pages of three entities; every page but the last one carries the
+    continuation of the next.
+    '''
+    def __init__(self, pages, fail_page=None):
+        TableService.__init__(self, 'account', 'a2V5')
+        self.pages = pages
+        self.fail_page = fail_page
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def query_entities(self, table_name, filter=None, select=None, top=None,
+                       next_partition_key=None, next_row_key=None):
+        with self.lock:
+            self.calls.append((top, next_partition_key, next_row_key))
+        page = 0 if next_partition_key is None else int(next_partition_key)
+        if page == self.fail_page:
+            raise WindowsAzureError("server busy")
+        entities = _list_of(Entity)
+        for i in range(0, 3):
+            entity = Entity()
+            entity.RowKey = "{0}-{1}".format(page, i)
+            entities.append(entity)
+        if page + 1 < self.pages:
+            continuation = HeaderDict()
+            continuation['nextpartitionkey'] = str(page + 1)
+            continuation['nextrowkey'] = 'r'
+            entities.x_ms_continuation = continuation
+        return entities
+
+class TestTableQuery(unittest.TestCase):
+    def test_follows_continuation(self):
+        service = FakeTableService(3)
+        rows = [e.RowKey for e in service.query_entities_iter("t", top=3)]
+        self.assertEqual(["{0}-{1}".format(p, i) for p in range(0, 3)
+                          for i in range(0, 3)], rows)
+        self.assertEqual([(3, None, None), (3, '1', 'r'), (3, '2', 'r')],
+                         service.calls)
+
+    def test_prefetch(self):
+        service = FakeTableService(2)
+        entities = service.query_entities_iter("t")
+        next(entities)
+        # the second page is requested while the first one is consumed
+        for i in range(0, 100):
+            if len(service.calls) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(2, len(service.calls))
+        self.assertEqual(6, len(list(entities)) + 1)
+
+    def test_no_prefetch(self):
+        service = FakeTableService(2)
+        entities = service.query_entities_iter("t", prefetch=False)
+        next(entities)
+        self.assertEqual(1, len(service.calls))
+        self.assertEqual(5, len(list(entities)))
+
+    def test_single_page(self):
+        service = FakeTableService(1)
+        self.assertEqual(3, len(list(service.query_entities_iter("t"))))
+        self.assertEqual(1, len(service.calls))
+
+    def test_error_on_next_page(self):
+        service = FakeTableService(3, fail_page=1)
+        entities = service.query_entities_iter("t")
+        for i in range(0, 3):
+            next(entities)
+        self.assertRaises(WindowsAzureError, next, entities)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -54,6 +54,7 @@ try:
     import telegraf_utils.telegraf_config_handler as telhandler
     import metrics_ext_utils.metrics_ext_handler as me_handler
     import metrics_ext_utils.metrics_constants as metrics_constants
+    import metrics_ext_utils.metrics_common_utils as metrics_utils
 
 except Exception as e:
     print('A local import (e.g., waagent) failed. Exception: {0}\nStacktrace: {1}'.format(e, traceback.format_exc()))
@@ -780,7 +781,7 @@ def get_lad_pids():
 
     with open(g_lad_pids_filepath, "r") as f:
         for pid in f.readlines():
-            is_still_alive = RunGetOutput("cat /proc/" + pid.strip() + "/cmdline", should_log=False)[1]
+            is_still_alive = metrics_utils.get_process_cmdline(pid.strip())
             if is_still_alive.find('/waagent/') > 0:
                 lad_pids.append(pid.strip())
             else:
@@ -16,6 +16,7 @@
 # COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
 # OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import errno
 import os
 
 def is_systemd():
@@ -43,4 +44,123 @@ def get_arc_endpoint():
         data = f.read()
     endpoint = data.split("\"IMDS_ENDPOINT=")[1].split("\"\n")[0]
 
-    return endpoint
\ No newline at end of file
+    return endpoint
+
+
+def is_pid_alive(pid):
+    """
+    Check if a process with the given pid exists, without signaling it
+    """
+    try:
+        os.kill(int(pid), 0)
+    except OSError as e:
+        # EPERM means the process exists but belongs to another user
+        return e.errno == errno.EPERM
+    return True
+
+
+def get_process_stat(pid):
+    """
+    State (field 3) and start time in clock ticks after boot (field 22) of /proc/<pid>/stat.
+    Returns None if the process does not exist
+    """
+    try:
+        with open("/proc/{0}/stat".format(pid), "rb") as f:
+            stat = f.read()
+    except (IOError, OSError):
+        return None
+    # The command name (field 2) is in parentheses and may contain spaces and parentheses itself
+    fields = stat[stat.rindex(b")") + 2:].split()
+    return fields[0].decode("ascii"), int(fields[19])
+
+
+def get_process_start_time(pid):
+    """
+    Start time of the process in clock ticks after boot, field 22 of /proc/<pid>/stat.
+    Returns None if the process does not exist
+    """
+    stat = get_process_stat(pid)
+    return stat[1] if stat is not None else None
+
+
+def reap_child(pid):
+    """
+    Collect the exit status of pid if it is a child of this process that exited, so that it
+    does not stay a zombie. Returns True if the child was reaped
+    """
+    try:
+        reaped_pid, status = os.waitpid(int(pid), os.WNOHANG)
+    except OSError:
+        # ECHILD, pid is not a child of this process
+        return False
+    return reaped_pid != 0
+
+
+def get_process_cmdline(pid):
+    """
+    Command line of the process with its arguments separated by spaces, or an empty string
+    if the process does not exist
+    """
+    try:
+        with open("/proc/{0}/cmdline".format(pid), "rb") as f:
+            cmdline = f.read()
+    except (IOError, OSError):
+        return ""
+    return cmdline.replace(b"\0", b" ").decode("utf-8", "ignore")
+
+
+def find_pids(binary):
+    """
+    Find the pids of all processes that have binary in their command line, like ps aux | grep would
+    """
+    pids = []
+    for pid in os.listdir("/proc"):
+        if pid.isdigit() and int(pid) != os.getpid() and binary in get_process_cmdline(pid):
+            pids.append(int(pid))
+    return pids
+
+
+class ProcessRegistry(object):
+    """
+    Remembers the processes found running a binary, with their start time, so that checking
+    whether they are still alive takes an os.kill(pid, 0) and a read of /proc/<pid>/stat
+    instead of running ps. The start time tells a process apart from a later one that
+    reused its pid. /proc is only searched again once none of the known processes is alive.
+    """
+    def __init__(self):
+        self.processes = {}
+
+    def register(self, binary, pid):
+        """
+        Track a process known to run binary, e.g. one that was just started
+        """
+        start_time = get_process_start_time(pid)
+        if start_time is not None:
+            self.processes.setdefault(binary, []).append((int(pid), start_time))
+
+    def is_alive(self, pid, start_time):
+        """
+        A zombie still answers os.kill(pid, 0) with its start time unchanged, so it is checked
+        for explicitly. The processes started by the extension are its own children and nobody
+        else waits for them, so they are reaped here when they exited
+        """
+        if reap_child(pid) or not is_pid_alive(pid):
+            return False
+        stat = get_process_stat(pid)
+        return stat is not None and stat[0] != "Z" and stat[1] == start_time
+
+    def is_running(self, binary):
+        """
+        Check if a process with binary in its command line is running
+        """
+        processes = [p for p in self.processes.get(binary, []) if self.is_alive(*p)]
+        if not processes:
+            for pid in find_pids(binary):
+                start_time = get_process_start_time(pid)
+                if start_time is not None:
+                    processes.append((pid, start_time))
+        self.processes[binary] = processes
+        return len(processes) > 0
+
+
+process_registry = ProcessRegistry()
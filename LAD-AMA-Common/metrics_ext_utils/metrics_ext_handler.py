@@ -65,12 +65,7 @@ def is_running(is_lad):
     else:
         metrics_bin = metrics_constants.ama_metrics_extension_bin
 
-    proc = subprocess.Popen(["ps  aux | grep MetricsExtension | grep -v grep"], stdout=subprocess.PIPE, shell=True)
-    output = proc.communicate()[0]
-    if metrics_bin in output.decode('utf-8', 'ignore'):
-        return True
-    else:
-        return False
+    return metrics_utils.process_registry.is_running(metrics_bin)
 
 
 def stop_metrics_service(is_lad):
@@ -376,6 +371,7 @@ def start_metrics(is_lad):
 
         if p is None: #Process is running successfully
             metrics_pid = proc.pid
+            metrics_utils.process_registry.register(metrics_ext_bin, metrics_pid)
 
             #write this pid to a file for future use
             with open(metrics_pid_path, "w+") as f:
@@ -484,12 +484,7 @@ def is_running(is_lad):
     else:
         telegraf_bin = metrics_constants.ama_telegraf_bin
 
-    proc = subprocess.Popen(["ps  aux | grep telegraf | grep -v grep"], stdout=subprocess.PIPE, shell=True)
-    output = proc.communicate()[0]
-    if telegraf_bin in output.decode('utf-8', 'ignore'):
-        return True
-    else:
-        return False
+    return metrics_utils.process_registry.is_running(telegraf_bin)
 
 def stop_telegraf_service(is_lad):
     """
@@ -651,6 +646,7 @@ def start_telegraf(is_lad):
         # Process is running successfully
         if p is None:
             telegraf_pid = proc.pid
+            metrics_utils.process_registry.register(telegraf_bin, telegraf_pid)
 
             # Write this pid to a file for future use
             try:
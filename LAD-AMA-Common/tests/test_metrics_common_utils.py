@@ -0,0 +1,65 @@
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+import metrics_ext_utils.metrics_common_utils as metrics_utils
+
+
+class ProcessRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics_utils.ProcessRegistry()
+        # an argument no other process uses, so that the /proc search finds this child only
+        self.binary = "sleep 31.25"
+        self.proc = subprocess.Popen(["sleep", "31.25"])
+        self.registry.register(self.binary, self.proc.pid)
+
+    def tearDown(self):
+        if self.proc.returncode is None:
+            try:
+                self.proc.kill()
+                self.proc.wait()
+            except OSError:
+                pass
+
+    def _wait_for_zombie(self):
+        for i in range(100):
+            stat = metrics_utils.get_process_stat(self.proc.pid)
+            if stat is not None and stat[0] == "Z":
+                return
+            time.sleep(0.01)
+        self.fail("the child did not become a zombie")
+
+    def test_running_child(self):
+        self.assertTrue(self.registry.is_running(self.binary))
+
+    def test_crashed_child_is_reaped(self):
+        os.kill(self.proc.pid, signal.SIGKILL)
+        self._wait_for_zombie()
+        self.assertTrue(metrics_utils.is_pid_alive(self.proc.pid))
+        self.assertFalse(self.registry.is_running(self.binary))
+        self.assertIsNone(metrics_utils.get_process_stat(self.proc.pid))
+        self.proc.returncode = -signal.SIGKILL
+
+    def test_zombie_is_not_alive(self):
+        os.kill(self.proc.pid, signal.SIGKILL)
+        self._wait_for_zombie()
+        start_time = metrics_utils.get_process_start_time(self.proc.pid)
+        # as if the zombie was the child of another process
+        reap_child = metrics_utils.reap_child
+        metrics_utils.reap_child = lambda pid: False
+        try:
+            self.assertFalse(self.registry.is_alive(self.proc.pid, start_time))
+        finally:
+            metrics_utils.reap_child = reap_child
+
+    def test_reused_pid_is_not_alive(self):
+        start_time = metrics_utils.get_process_start_time(self.proc.pid)
+        self.assertTrue(self.registry.is_alive(self.proc.pid, start_time))
+        self.assertFalse(self.registry.is_alive(self.proc.pid, start_time + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,8 +30,13 @@ else:
     _strtype = str
 
 from datetime import datetime
+from io import BytesIO
 from xml.dom import minidom
 from xml.sax.saxutils import escape as xml_escape
+try:
+    from xml.etree import cElementTree as ETree
+except ImportError:
+    from xml.etree import ElementTree as ETree
 
 #--------------------------------------------------------------------------
 # constants
@@ -98,6 +103,7 @@ _ERROR_PAGE_BLOB_SIZE_ALIGNMENT = \
 _USER_AGENT_STRING = 'pyazure/' + __version__
 
 METADATA_NS = 'http://schemas.microsoft.com/ado/2007/08/dataservices/metadata'
+ATOM_NS = 'http://www.w3.org/2005/Atom'
 
 
 class WindowsAzureData(object):
@@ -419,16 +425,42 @@ def _clone_node_with_namespaces(node_to_clone, original_doc):
     return clone
 
 
+def _get_continuation(response):
+    ''' Returns the x-ms-continuation-* headers of a feed response. '''
+    x_ms_continuation = HeaderDict()
+    for name, value in response.headers:
+        if 'x-ms-continuation' in name:
+            x_ms_continuation[name[len('x-ms-continuation') + 1:]] = value
+    return x_ms_continuation
+
+
+def _iterparse_entries(xmlstr):
+    '''
+    Yields the Atom entry elements of a feed, or of a single entry, as soon
+    as each one has been parsed. An entry is dropped from the tree after it
+    has been handed out, so the whole feed is never held in memory.
+    '''
+    if isinstance(xmlstr, _unicode_type):
+        xmlstr = xmlstr.encode('utf-8')
+    entry_tag = '{' + ATOM_NS + '}entry'
+    root = None
+    for event, element in ETree.iterparse(BytesIO(xmlstr), ('start', 'end')):
+        if root is None:
+            root = element
+        if event == 'end' and element.tag == entry_tag:
+            yield element
+            element.clear()
+            if element is not root:
+                root.clear()
+
+
 def _convert_response_to_feeds(response, convert_callback):
     if response is None:
         return None
 
     feeds = _list_of(Feed)
 
-    x_ms_continuation = HeaderDict()
-    for name, value in response.headers:
-        if 'x-ms-continuation' in name:
-            x_ms_continuation[name[len('x-ms-continuation') + 1:]] = value
+    x_ms_continuation = _get_continuation(response)
     if x_ms_continuation:
         setattr(feeds, 'x_ms_continuation', x_ms_continuation)
 
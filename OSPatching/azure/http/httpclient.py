@@ -13,13 +13,18 @@
 # limitations under the License.
 #--------------------------------------------------------------------------
 import base64
+import errno
 import os
+import socket
 import sys
+import threading
 
 if sys.version_info < (3,):
     from httplib import (
         HTTPSConnection,
         HTTPConnection,
+        HTTPException,
+        BadStatusLine,
         HTTP_PORT,
         HTTPS_PORT,
         )
@@ -28,6 +33,8 @@ else:
     from http.client import (
         HTTPSConnection,
         HTTPConnection,
+        HTTPException,
+        BadStatusLine,
         HTTP_PORT,
         HTTPS_PORT,
         )
@@ -36,6 +43,25 @@ else:
 from azure.http import HTTPError, HTTPResponse
 from azure import _USER_AGENT_STRING, _update_request_uri_query
 
+# Idle connections kept per (protocol, host, proxy) when keep_alive is on
+_MAX_IDLE_CONNECTIONS = 8
+
+# Raised when a cached connection was closed by the server while idle, e.g.
+# BadStatusLine, RemoteDisconnected, ECONNRESET or EPIPE
+_STALE_CONNECTION_ERRORS = (HTTPException, socket.error)
+
+# Methods that may be sent again when the server closed a cached connection
+# without answering; the server may have applied the request already
+_IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+def _is_dropped_connection(error):
+    ''' Whether a reused connection failed because the server closed it. '''
+    if isinstance(error, BadStatusLine):
+        return True
+    return (isinstance(error, socket.error) and
+            getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE))
+
 
 class _HTTPClient(object):
 
@@ -67,6 +93,9 @@ class _HTTPClient(object):
         self.proxy_user = None
         self.proxy_password = None
         self.use_httplib = self.should_use_httplib()
+        self.keep_alive = True
+        self._idle_connections = {}
+        self._connections_lock = threading.Lock()
 
     def should_use_httplib(self):
         if sys.platform.lower().startswith('win') and self.cert_file:
@@ -104,6 +133,16 @@ class _HTTPClient(object):
         self.proxy_port = port
         self.proxy_user = user
         self.proxy_password = password
+        self.close()
+
+    def close(self):
+        ''' Closes the connections kept alive for later requests. '''
+        with self._connections_lock:
+            idle_connections = self._idle_connections
+            self._idle_connections = {}
+        for connections in idle_connections.values():
+            for connection in connections:
+                connection.close()
 
     def get_uri(self, request):
         ''' Return the target uri for the request.'''
@@ -153,6 +192,64 @@ class _HTTPClient(object):
 
         return connection
 
+    def get_connection_key(self, request):
+        ''' The requests that may share a kept alive connection. '''
+        protocol = request.protocol_override \
+            if request.protocol_override else self.protocol
+        # request.host carries the port when it is not the default one
+        return (protocol, request.host, self.proxy_host, self.proxy_port)
+
+    def acquire_connection(self, request):
+        '''
+        Returns (connection, reused), reusing an idle connection to the same
+        endpoint when keep_alive is on.
+        '''
+        if self.keep_alive and self.use_httplib:
+            key = self.get_connection_key(request)
+            with self._connections_lock:
+                connections = self._idle_connections.get(key)
+                if connections:
+                    return connections.pop(), True
+        return self.get_connection(request), False
+
+    def release_connection(self, request, connection, resp):
+        '''
+        Keeps the connection for the next request if the response was read
+        to the end and the server did not ask to close it.
+        '''
+        if (self.keep_alive and self.use_httplib and
+                not getattr(resp, 'will_close', True)):
+            key = self.get_connection_key(request)
+            with self._connections_lock:
+                connections = self._idle_connections.setdefault(key, [])
+                if len(connections) < _MAX_IDLE_CONNECTIONS:
+                    connections.append(connection)
+                    return
+        connection.close()
+
+    def send_request(self, connection, request):
+        ''' Sends the request on the connection and waits for the response. '''
+        self.write_request(connection, request)
+        return connection.getresponse()
+
+    def write_request(self, connection, request):
+        ''' Sends the request on the connection. '''
+        if self.use_httplib and connection.sock is None:
+            # headers and body are separate writes; with Nagle's algorithm
+            # the body of a request on a kept alive connection waits for the
+            # delayed ACK of the headers
+            connection.connect()
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.putrequest(request.method, request.path)
+
+        if not self.use_httplib:
+            if self.proxy_host and self.proxy_user:
+                connection.set_proxy_credentials(
+                    self.proxy_user, self.proxy_password)
+
+        self.send_request_headers(connection, request.headers)
+        self.send_request_body(connection, request.body)
+
     def send_request_headers(self, connection, request_headers):
         if self.use_httplib:
             if self.proxy_host:
@@ -180,19 +277,35 @@ class _HTTPClient(object):
 
     def perform_request(self, request):
         ''' Sends request to cloud service server and return the response. '''
-        connection = self.get_connection(request)
+        connection, reused = self.acquire_connection(request)
+        drained = False
         try:
-            connection.putrequest(request.method, request.path)
-
-            if not self.use_httplib:
-                if self.proxy_host and self.proxy_user:
-                    connection.set_proxy_credentials(
-                        self.proxy_user, self.proxy_password)
+            # a request on a reused connection that the server dropped is
+            # sent again on a new one, but only when the server cannot have
+            # applied it: the connection was reset while the request was
+            # written, or an idempotent request got no status line. A POST
+            # is never sent twice, it may have been applied before the drop.
+            retry = False
+            try:
+                self.write_request(connection, request)
+            except _STALE_CONNECTION_ERRORS as e:
+                if (not reused or request.method == 'POST' or
+                        not _is_dropped_connection(e)):
+                    raise
+                retry = True
+            if not retry:
+                try:
+                    resp = connection.getresponse()
+                except BadStatusLine:
+                    if (not reused or
+                            request.method not in _IDEMPOTENT_METHODS):
+                        raise
+                    retry = True
+            if retry:
+                connection.close()
+                connection = self.get_connection(request)
+                resp = self.send_request(connection, request)
 
-            self.send_request_headers(connection, request.headers)
-            self.send_request_body(connection, request.body)
-
-            resp = connection.getresponse()
             self.status = int(resp.status)
             self.message = resp.reason
             self.respheader = headers = resp.getheaders()
@@ -201,24 +314,33 @@ class _HTTPClient(object):
             for i, value in enumerate(headers):
                 headers[i] = (value[0].lower(), value[1])
 
+            # read the body to the end so that the connection can be reused
             respbody = None
             if resp.length is None:
                 respbody = resp.read()
             elif resp.length > 0:
                 respbody = resp.read(resp.length)
+            else:
+                # an empty body must still be read for the response to close
+                resp.read()
+            drained = True
 
-            response = HTTPResponse(
-                int(resp.status), resp.reason, headers, respbody)
-            if self.status == 307:
+            # the client may be shared by several threads, so check this
+            # response rather than self.status
+            status = int(resp.status)
+            response = HTTPResponse(status, resp.reason, headers, respbody)
+            if status == 307:
                 new_url = urlparse(dict(headers)['location'])
                 request.host = new_url.hostname
                 request.path = new_url.path
                 request.path, request.query = _update_request_uri_query(request)
                 return self.perform_request(request)
-            if self.status >= 300:
-                raise HTTPError(self.status, self.message,
-                                self.respheader, respbody)
+            if status >= 300:
+                raise HTTPError(status, resp.reason, headers, respbody)
 
             return response
         finally:
-            connection.close()
+            if drained:
+                self.release_connection(request, connection, resp)
+            else:
+                connection.close()
@@ -18,27 +18,66 @@
 import os
 import os.path
 import string
-import sys
 
 OutputSize = 4 * 1024
 
 
+# bytes outside string.printable, removed with translate instead of testing
+# every character
+NonPrintable = bytes(bytearray([c for c in range(256) if chr(c) not in string.printable]))
+
+
+def filter_printable(buf):
+    return buf.translate(None, NonPrintable).decode("ascii")
+
+
 def tail(log_file, output_size = OutputSize):
     pos = min(output_size, os.path.getsize(log_file))
-    with open(log_file, "r") as log:
-        log.seek(0, os.SEEK_END)
-        log.seek(log.tell() - pos, os.SEEK_SET)
-        buf = log.read(output_size)
-        buf = filter(lambda x: x in string.printable, buf)
-
-        # encoding works different for between interpreter version, we are keeping separate implementation to ensure
-        # backward compatibility
-        if sys.version_info[0] == 3:
-            buf = ''.join(list(buf)).encode('ascii', 'ignore').decode("ascii", "ignore")
-        elif sys.version_info[0] == 2:
-            buf = buf.decode("ascii", "ignore")
-
-        return buf
+    with open(log_file, "rb") as log:
+        log.seek(-pos, os.SEEK_END)
+        return filter_printable(log.read(output_size))
+
+
+class IncrementalTail(object):
+    """
+    Tail of a file that is still being written, e.g. the output of a running
+    command. Remembers how far the file was read so that every update only
+    reads the bytes appended since the previous one.
+    """
+    def __init__(self, log_file, output_size = OutputSize):
+        self.log_file = log_file
+        self.output_size = output_size
+        self.offset = 0
+        self.buf = b""
+        self.output = u""
+
+    def update(self):
+        """
+        Read what was appended to the file, return True if the tail changed.
+        """
+        try:
+            size = os.path.getsize(self.log_file)
+        except OSError:
+            size = 0
+        if size < self.offset:
+            # truncated, start over
+            self.offset = 0
+            self.buf = b""
+            self.output = u""
+        if size == self.offset:
+            return False
+
+        # only the last output_size bytes can end up in the tail
+        start = max(self.offset, size - self.output_size)
+        with open(self.log_file, "rb") as log:
+            log.seek(start, os.SEEK_SET)
+            data = log.read(size - start)
+        if start > self.offset:
+            self.buf = b""
+        self.offset = start + len(data)
+        self.buf = (self.buf + data)[-self.output_size:]
+        self.output = filter_printable(self.buf)
+        return len(data) > 0
 
 
 def get_formatted_log(summary, stdout, stderr):
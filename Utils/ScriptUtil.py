@@ -15,8 +15,11 @@
 # limitations under the License.
 
 
+import errno
 import os
 import os.path
+import select
+import threading
 import time
 import subprocess
 import traceback
@@ -29,6 +32,63 @@ from Utils.WAAgentUtil import waagent
 
 DefaultStdoutFile = "stdout"
 DefaultErroutFile = "errout"
+FirstReportDelay = 1
+
+
+class ChildSupervisor(object):
+    """
+    Waits for a child process to exit without polling it. Selects on a pidfd
+    where the kernel and interpreter provide one; otherwise a thread blocks
+    in child.wait() and closes the write end of a pipe when the child exits.
+    """
+    def __init__(self, child):
+        self.child = child
+        self.fd = None
+        self.thread = None
+        pidfd_open = getattr(os, "pidfd_open", None)
+        if pidfd_open is not None:
+            try:
+                self.fd = pidfd_open(child.pid)
+            except OSError:
+                pass
+        if self.fd is None:
+            self.fd, write_fd = os.pipe()
+            self.thread = threading.Thread(target=self._wait, args=(write_fd,))
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _wait(self, write_fd):
+        try:
+            self.child.wait()
+        finally:
+            os.close(write_fd)
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds, return True once the child has exited.
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                readable = select.select([self.fd], [], [], remaining)[0]
+            except (select.error, OSError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            if readable:
+                if self.thread is not None:
+                    self.thread.join()
+                # reaps the child in the pidfd case, returns at once otherwise
+                self.child.wait()
+                return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
 
 
 def run_command(hutil, args, cwd, operation, extension_short_name, version, exit_after_run=True, interval=30,
@@ -37,6 +97,7 @@ def run_command(hutil, args, cwd, operation, extension_short_name, version, exit
     err_out_file = os.path.join(cwd, std_err_file_name)
     std_out = None
     err_out = None
+    supervisor = None
     try:
         std_out = open(std_out_file, "w")
         err_out = open(err_out_file, "w")
@@ -45,21 +106,35 @@ def run_command(hutil, args, cwd, operation, extension_short_name, version, exit
                                  cwd=cwd,
                                  stdout=std_out,
                                  stderr=err_out)
-        time.sleep(1)
-        while child.poll() is None:
-            msg = "Command is running..."
-            msg_with_cmd_output = LogUtil.get_formatted_log(msg, LogUtil.tail(std_out_file), LogUtil.tail(err_out_file))
-            msg_without_cmd_output = msg + " Stdout/Stderr omitted from output."
-
-            hutil.log_to_file(msg_with_cmd_output)
-            hutil.log_to_console(msg_without_cmd_output)
-            hutil.do_status_report(operation, 'transitioning', '0', msg_without_cmd_output)
-            time.sleep(interval)
+        std_out_tail = LogUtil.IncrementalTail(std_out_file)
+        err_out_tail = LogUtil.IncrementalTail(err_out_file)
+        supervisor = ChildSupervisor(child)
+        reported = False
+        # completion is noticed as soon as the child exits, the progress
+        # report is still sent every interval seconds while it runs
+        next_report = time.time() + FirstReportDelay
+        while not supervisor.wait(next_report - time.time()):
+            # both updates have to run, they move the offsets forward
+            advanced = std_out_tail.update()
+            advanced = err_out_tail.update() or advanced
+            if advanced or not reported:
+                msg = "Command is running..."
+                msg_with_cmd_output = LogUtil.get_formatted_log(msg, std_out_tail.output, err_out_tail.output)
+                msg_without_cmd_output = msg + " Stdout/Stderr omitted from output."
+
+                hutil.log_to_file(msg_with_cmd_output)
+                hutil.log_to_console(msg_without_cmd_output)
+                hutil.do_status_report(operation, 'transitioning', '0', msg_without_cmd_output)
+                reported = True
+            next_report = max(next_report + interval, time.time())
+
+        std_out_tail.update()
+        err_out_tail.update()
 
         exit_code = child.returncode
         if child.returncode and child.returncode != 0:
             msg = "Command returned an error."
-            msg_with_cmd_output = LogUtil.get_formatted_log(msg, LogUtil.tail(std_out_file), LogUtil.tail(err_out_file))
+            msg_with_cmd_output = LogUtil.get_formatted_log(msg, std_out_tail.output, err_out_tail.output)
             msg_without_cmd_output = msg + " Stdout/Stderr omitted from output."
 
             hutil.error(msg_without_cmd_output)
@@ -70,7 +145,7 @@ def run_command(hutil, args, cwd, operation, extension_short_name, version, exit
                                       message="(01302)" + msg_without_cmd_output)
         else:
             msg = "Command is finished."
-            msg_with_cmd_output = LogUtil.get_formatted_log(msg, LogUtil.tail(std_out_file), LogUtil.tail(err_out_file))
+            msg_with_cmd_output = LogUtil.get_formatted_log(msg, std_out_tail.output, err_out_tail.output)
             msg_without_cmd_output = msg + " Stdout/Stderr omitted from output."
 
             hutil.log_to_file(msg_with_cmd_output)
@@ -103,6 +178,8 @@ def run_command(hutil, args, cwd, operation, extension_short_name, version, exit
 
         log_or_exit(hutil, exit_after_run, exit_code, operation, msg)
     finally:
+        if supervisor:
+            supervisor.close()
         if std_out:
             std_out.close()
         if err_out:
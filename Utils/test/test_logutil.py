@@ -28,5 +28,30 @@ class TestLogUtil(unittest.TestCase):
         tail = lu.tail("/tmp/testtail")
         self.assertEquals("abcdefghijklmnopqrstuvwxyz", tail)
 
+    def test_incremental_tail(self):
+        with open("/tmp/testtail", "wb") as F:
+            F.write(b"abc\x00\x01")
+        tail = lu.IncrementalTail("/tmp/testtail", 6)
+        self.assertTrue(tail.update())
+        self.assertEquals("abc", tail.output)
+        self.assertFalse(tail.update())
+
+        with open("/tmp/testtail", "ab") as F:
+            F.write(u"de\u6211f".encode("utf-8"))
+        self.assertTrue(tail.update())
+        self.assertEquals("def", tail.output)
+        self.assertEquals(lu.tail("/tmp/testtail", 6), tail.output)
+        self.assertEquals(11, tail.offset)
+
+        with open("/tmp/testtail", "wb") as F:
+            F.write(b"xy")
+        self.assertTrue(tail.update())
+        self.assertEquals("xy", tail.output)
+
+    def test_incremental_tail_missing_file(self):
+        tail = lu.IncrementalTail("/tmp/testtail-missing")
+        self.assertFalse(tail.update())
+        self.assertEquals("", tail.output)
+
 if __name__ == '__main__':
     unittest.main()
@@ -16,6 +16,8 @@
 
 import os
 import os.path
+import subprocess
+import time
 import env
 import ScriptUtil as su
 import unittest
@@ -41,6 +43,18 @@ class TestScriptUtil(unittest.TestCase):
         self.assertEquals(75, exit_code)
         self.assertEquals("do_status_report", hutil.last)
     
+    def test_child_supervisor(self):
+        child = subprocess.Popen(["sh", "-c", "sleep 0.2; exit 3"])
+        supervisor = su.ChildSupervisor(child)
+        try:
+            self.assertFalse(supervisor.wait(0.05))
+            start = time.time()
+            self.assertTrue(supervisor.wait(30))
+            self.assertTrue(time.time() - start < 5)
+            self.assertEquals(3, child.returncode)
+        finally:
+            supervisor.close()
+
     def test_log_or_exit(self):        
         hutil = MockUtil(self)
         su.log_or_exit(hutil, True, 0, 'LogOrExit-0', 'Message1')
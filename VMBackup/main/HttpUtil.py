@@ -30,11 +30,14 @@ from common import CommonVariables
 from subprocess import *
 from Utils.WAAgentUtil import waagent
 import Utils.HandlerUtil
+from Utils.HttpConnectionPool import HttpConnectionPool
 import sys
 
 class HttpUtil(object):
     """description of class"""
     __instance = None
+    # shared by all callers/threads, snapshot PUTs, page writes and host calls of one run mostly hit the same one or two hosts
+    connection_pool = HttpConnectionPool()
     """Singleton class initialization"""
     def __new__(cls, hutil):
         if(cls.__instance is None):
@@ -113,7 +116,7 @@ class HttpUtil(object):
             else:
                 return CommonVariables.error_http_failure
 
-    def HttpCallGetResponse(self, method, sasuri_obj, data, headers , responseBodyRequired = False, isHostCall = False):
+    def HttpCallGetResponse(self, method, sasuri_obj, data, headers , responseBodyRequired = False, isHostCall = False, timeout = None):
         result = CommonVariables.error_http_failure
         resp = None
         responeBody = ""
@@ -124,24 +127,19 @@ class HttpUtil(object):
             self.logger.log("Entered HttpCallGetResponse, isHostCall: " + str(isHostCall))
 
             if(isHostCall or self.proxyHost == None or self.proxyPort != None):
+                self.logger.log("Details of sas uri object  hostname: " + str(sasuri_obj.hostname) + " path: " + str(sasuri_obj.path))
                 if(isHostCall):
-                    connection = httplibs.HTTPConnection(sasuri_obj.hostname, timeout = 40) # making call with port 80 to make it http call
+                    # making call with port 80 to make it http call
+                    resp = HttpUtil.connection_pool.request('http', sasuri_obj.hostname, 80, method, (sasuri_obj.path + '?' + sasuri_obj.query), data, headers, timeout or 40)
                 else:
-                    connection = httplibs.HTTPSConnection(sasuri_obj.hostname, timeout = 10)
-                self.logger.log("Details of sas uri object  hostname: " + str(sasuri_obj.hostname) + " path: " + str(sasuri_obj.path))
-                connection.request(method=method, url=(sasuri_obj.path + '?' + sasuri_obj.query), body=data, headers = headers)
-                resp = connection.getresponse()
+                    resp = HttpUtil.connection_pool.request('https', sasuri_obj.hostname, 443, method, (sasuri_obj.path + '?' + sasuri_obj.query), data, headers, timeout or 10)
                 if(responseBodyRequired):
                     responeBody = resp.read().decode('utf-8-sig')
-                connection.close()
             else:
-                connection = httplibs.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = 10)
-                connection.set_tunnel(sasuri_obj.hostname, 443)
                 # If proxy is used, full url is needed.
                 path = "https://{0}:{1}{2}".format(sasuri_obj.hostname, 443, (sasuri_obj.path + '?' + sasuri_obj.query))
-                connection.request(method=method, url=(path), body=data, headers=headers)
-                resp = connection.getresponse()
-                connection.close()
+                resp = HttpUtil.connection_pool.request('https', sasuri_obj.hostname, 443, method, path, data, headers, timeout or 10, self.proxyHost, self.proxyPort)
+            Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.httpConnectionsReused, str(HttpUtil.connection_pool.reused_count))
             result = CommonVariables.success
         except Exception as e:
             errorMsg = str(datetime.datetime.utcnow()) +  " Failed to call http with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
@@ -8,6 +8,7 @@ try:
 except ImportError:
     import configparser as ConfigParsers
 from common import CommonVariables
+from Utils.ConfigCache import ConfigCache
 from pwd import getpwuid
 from stat import *
 import traceback
@@ -114,8 +115,7 @@ class PluginHost(object):
 
         try:
             self.logger.log('config file: '+str(self.configLocation),True,'Info')
-            config = ConfigParsers.ConfigParser()
-            config.read(self.configLocation)
+            config = ConfigCache.get_instance(self.configLocation).get_config()
             if (config.has_option('pre_post', 'timeoutInSeconds')):
                 self.timeoutInSeconds = min(int(config.get('pre_post','timeoutInSeconds')),self.timeoutInSeconds)
             if (config.has_option('pre_post', 'numberOfPlugins')):
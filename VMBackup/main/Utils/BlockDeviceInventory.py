@@ -0,0 +1,285 @@
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import sys
+import time
+import traceback
+from Utils.ThreadPool import ThreadPool
+
+SysClassBlock = '/sys/class/block'
+SysClassScsiDisk = '/sys/class/scsi_disk'
+SysDevBlock = '/sys/dev/block'
+ProcMountInfo = '/proc/self/mountinfo'
+
+# file systems df leaves out of its default listing
+DummyFsTypes = ['autofs', 'proc', 'subfs', 'debugfs', 'devpts', 'fusectl', 'mqueue', 'rpc_pipefs', 'sysfs', 'devfs', 'kernfs', 'ignore', 'none', 'cgroup', 'cgroup2', 'pstore', 'bpf', 'tracefs', 'securityfs', 'configfs', 'hugetlbfs', 'binfmt_misc', 'efivarfs', 'selinuxfs', 'nsfs']
+
+class BlockDevice(object):
+    def __init__(self, name):
+        self.name = name
+        self.path = '/dev/' + name
+        self.devno = None
+        self.parent = None
+        self.slaves = []
+        self.dm_name = None
+        self.dm_uuid = None
+        self.lun = None
+
+    def is_partition(self):
+        return self.parent is not None
+
+    def __str__(self):
+        return 'name: ' + str(self.name) + ' devno: ' + str(self.devno) + ' parent: ' + str(self.parent) + ' slaves: ' + str(self.slaves) + ' dm_name: ' + str(self.dm_name) + ' lun: ' + str(self.lun)
+
+class MountEntry(object):
+    def __init__(self, source, fstype, mount_point, devno):
+        self.source = source
+        self.fstype = fstype
+        self.mount_point = mount_point
+        self.devno = devno
+        self.size_kb = None
+        self.used_kb = None
+        self.available_kb = None
+        self.usage_read = False
+
+    def is_remote(self):
+        # same rule df -l uses to tell network mounts apart
+        return ':' in self.source or self.source.startswith('//') or self.source.startswith('\\\\') or self.fstype in ['afs', 'auristorfs', 'smb3', 'smbfs', 'cifs', 'nfs', 'nfs4', 'ncpfs']
+
+    def __str__(self):
+        return 'source: ' + str(self.source) + ' fstype: ' + str(self.fstype) + ' mount_point: ' + str(self.mount_point) + ' used_kb: ' + str(self.used_kb)
+
+class BlockDeviceInventory(object):
+    """
+    Snapshot of the block devices and mounts of the VM, read once from sysfs,
+    /proc/self/mountinfo and statvfs instead of lsscsi, lsblk, pvs, mount and df.
+    The usage of the mounts is only read by df_entries(), and for local mounts
+    only when only local file systems are asked for, like df -kl, so that a hung
+    network share cannot hold callers which do not need it.
+    Indexes built on load():
+        lun_to_disk         lun -> '/dev/sdc'
+        disk_partitions     '/dev/sdc' -> ['/dev/sdc1', ...]
+        mounts              MountEntry per mount point, in mount order
+        mount_by_point      mount point -> MountEntry
+        volume_group_pvs    lvm volume group -> [pv device path, ...]
+    A single instance is shared for the duration of a backup command, call
+    refresh() to read the system again.
+    """
+    __instance__ = None
+    statvfs_workers = 8
+    statvfs_timeout = 300
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.loaded = False
+        self.devices = {}
+        self.devno_to_name = {}
+        self.lun_to_disk = {}
+        self.disk_partitions = {}
+        self.mounts = []
+        self.mount_by_point = {}
+        self.volume_group_pvs = {}
+        self.timed_out_mounts = []
+
+    @staticmethod
+    def get_instance(logger):
+        if BlockDeviceInventory.__instance__ is None:
+            BlockDeviceInventory.__instance__ = BlockDeviceInventory(logger)
+        inventory = BlockDeviceInventory.__instance__
+        if not inventory.loaded:
+            inventory.load()
+        return inventory
+
+    def refresh(self):
+        self.__init__(self.logger)
+        self.load()
+
+    def load(self):
+        start_time = time.time()
+        try:
+            self._read_block_devices()
+        except Exception as e:
+            self.logger.log("BlockDeviceInventory: failed to read " + SysClassBlock + ", error: %s, stack trace: %s" % (str(e), traceback.format_exc()), True, 'Error')
+        try:
+            self._read_scsi_luns()
+        except Exception as e:
+            self.logger.log("BlockDeviceInventory: failed to read " + SysClassScsiDisk + ", error: %s, stack trace: %s" % (str(e), traceback.format_exc()), True, 'Error')
+        try:
+            self._read_mounts()
+        except Exception as e:
+            self.logger.log("BlockDeviceInventory: failed to read " + ProcMountInfo + ", error: %s, stack trace: %s" % (str(e), traceback.format_exc()), True, 'Error')
+        self.loaded = True
+        self.logger.log("BlockDeviceInventory: {0} block devices, {1} luns, {2} mounts, loaded in {3:.3f} seconds".format(len(self.devices), len(self.lun_to_disk), len(self.mounts), time.time() - start_time), True)
+
+    def _read_block_devices(self):
+        for name in os.listdir(SysClassBlock):
+            device = BlockDevice(name)
+            sys_path = os.path.join(SysClassBlock, name)
+            device.devno = self._read_sys_file(os.path.join(sys_path, 'dev'))
+            if os.path.exists(os.path.join(sys_path, 'partition')):
+                device.parent = os.path.basename(os.path.dirname(os.path.realpath(sys_path)))
+            slaves_path = os.path.join(sys_path, 'slaves')
+            if os.path.isdir(slaves_path):
+                device.slaves = os.listdir(slaves_path)
+            device.dm_name = self._read_sys_file(os.path.join(sys_path, 'dm', 'name'))
+            device.dm_uuid = self._read_sys_file(os.path.join(sys_path, 'dm', 'uuid'))
+            if device.dm_name is not None:
+                device.path = '/dev/mapper/' + device.dm_name
+            self.devices[name] = device
+            if device.devno is not None:
+                self.devno_to_name[device.devno] = name
+        for name, device in self.devices.items():
+            if device.parent is not None:
+                self.disk_partitions.setdefault('/dev/' + device.parent, []).append(device.path)
+            if device.dm_uuid is not None and device.dm_uuid.startswith('LVM-'):
+                # dm names are <vg>-<lv>, matched the same way the billing code matches df devices
+                volume_group = device.dm_name.split('-')[0]
+                pvs = self.volume_group_pvs.setdefault(volume_group, [])
+                for slave in device.slaves:
+                    if slave in self.devices and self.devices[slave].path not in pvs:
+                        pvs.append(self.devices[slave].path)
+        for partitions in self.disk_partitions.values():
+            partitions.sort()
+
+    def _read_scsi_luns(self):
+        if not os.path.isdir(SysClassScsiDisk):
+            return
+        for hctl in os.listdir(SysClassScsiDisk):
+            block_path = os.path.join(SysClassScsiDisk, hctl, 'device', 'block')
+            if not os.path.isdir(block_path):
+                continue
+            lun = int(hctl.split(':')[-1])
+            for name in os.listdir(block_path):
+                self.lun_to_disk[lun] = '/dev/' + name
+                if name in self.devices:
+                    self.devices[name].lun = lun
+
+    def _read_mounts(self):
+        with open(ProcMountInfo, 'rb') as f:
+            data = f.read()
+        if sys.version_info > (3,):
+            data = data.decode('utf-8', 'surrogateescape')
+        for line in data.splitlines():
+            fields = line.split(' - ', 1)
+            if len(fields) != 2:
+                continue
+            mount_fields = fields[0].split()
+            fs_fields = fields[1].split()
+            if len(mount_fields) < 5 or len(fs_fields) < 2:
+                continue
+            entry = MountEntry(self._unescape(fs_fields[1]), fs_fields[0], self._unescape(mount_fields[4]), mount_fields[2])
+            # a later mount on the same mount point hides the earlier one
+            if entry.mount_point in self.mount_by_point:
+                self.mounts.remove(self.mount_by_point[entry.mount_point])
+            self.mounts.append(entry)
+            self.mount_by_point[entry.mount_point] = entry
+
+    def _read_usage(self, only_local = False):
+        # a mount is stat'ed at most once, one that timed out keeps its worker thread
+        mounts = [mount for mount in self.mounts if mount.fstype not in DummyFsTypes and not mount.usage_read and not (only_local and mount.is_remote())]
+        if len(mounts) == 0:
+            return
+        for mount in mounts:
+            mount.usage_read = True
+        deadline = time.time() + self.statvfs_timeout
+        # statvfs on a hung network share blocks, so run them on the pool under a deadline like the df call had
+        results = ThreadPool(self.statvfs_workers).run(os.statvfs, [(mount.mount_point,) for mount in mounts], deadline)
+        for mount, task_result in zip(mounts, results):
+            if not task_result.completed:
+                self.timed_out_mounts.append(mount)
+                self.logger.log("BlockDeviceInventory: statvfs did not complete for " + str(mount.mount_point), True, 'Warning')
+            elif task_result.error is not None:
+                self.logger.log("BlockDeviceInventory: statvfs failed for " + str(mount.mount_point) + ", error: " + str(task_result.error), True, 'Warning')
+            else:
+                st = task_result.result
+                frsize = st.f_frsize or st.f_bsize
+                mount.size_kb = self._to_kb(st.f_blocks * frsize)
+                mount.used_kb = self._to_kb((st.f_blocks - st.f_bfree) * frsize)
+                mount.available_kb = self._to_kb(st.f_bavail * frsize)
+
+    def df_entries(self, only_local = False):
+        """
+        Mounts as df -k (or df -kl) would list them: real file systems with a
+        size, one entry per device, keeping the shortest mount point.
+        """
+        self._read_usage(only_local)
+        entries = []
+        by_devno = {}
+        for mount in self.mounts:
+            if mount.size_kb is None or mount.size_kb == 0:
+                continue
+            if only_local and mount.is_remote():
+                continue
+            if mount.devno in by_devno:
+                index = by_devno[mount.devno]
+                if len(mount.mount_point) < len(entries[index].mount_point):
+                    entries[index] = mount
+                continue
+            by_devno[mount.devno] = len(entries)
+            entries.append(mount)
+        return entries
+
+    def file_systems_info(self):
+        # same (device, fstype, mount point) tuples DiskUtil.get_mount_file_systems returns
+        return [(mount.source, mount.fstype, mount.mount_point) for mount in self.mounts]
+
+    def device_of_mount(self, mount):
+        name = self.devno_to_name.get(mount.devno)
+        if name is None:
+            return None
+        return self.devices[name]
+
+    def base_disks(self, name, seen = None):
+        """
+        Kernel names of the whole disks a block device lives on, following
+        partitions to their disk and device mapper devices to their slaves.
+        """
+        if seen is None:
+            seen = set()
+        if name in seen or name not in self.devices:
+            return set()
+        seen.add(name)
+        device = self.devices[name]
+        if device.parent is not None:
+            return self.base_disks(device.parent, seen)
+        if len(device.slaves) > 0:
+            disks = set()
+            for slave in device.slaves:
+                disks.update(self.base_disks(slave, seen))
+            return disks
+        return set([name])
+
+    def base_disk_paths(self, path):
+        name = os.path.basename(path)
+        for device_name, device in self.devices.items():
+            if device.path == path:
+                name = device_name
+                break
+        return set('/dev/' + disk for disk in self.base_disks(name))
+
+    def _read_sys_file(self, path):
+        try:
+            with open(path, 'r') as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def _unescape(self, value):
+        return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), value)
+
+    def _to_kb(self, size_bytes):
+        return int((size_bytes + 1023) // 1024)
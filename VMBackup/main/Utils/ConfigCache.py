@@ -0,0 +1,133 @@
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+try:
+    import ConfigParser as ConfigParsers
+except ImportError:
+    import configparser as ConfigParsers
+
+VMBackupConfigFile = '/etc/azure/vmbackup.conf'
+SnapshotThreadSection = 'SnapshotThread'
+
+class ConfigCache(object):
+    """
+    Process-wide parsed view of an ini style config file such as /etc/azure/vmbackup.conf.
+    The file is parsed once and only parsed again when its inode, size or mtime changes,
+    so the per lookup cost is a single stat call instead of a full ConfigParser read.
+    """
+    __instances__ = {}
+    __instances_lock__ = threading.Lock()
+
+    _true_values = ['1', 'yes', 'true', 'on']
+    _false_values = ['0', 'no', 'false', 'off']
+
+    def __init__(self, configfile):
+        self.configfile = configfile
+        self._lock = threading.Lock()
+        # (signature, parsed config, parse error) swapped as one tuple so that
+        # readers on other threads never see a half updated cache
+        self._state = (None, None, None)
+        self.load_count = 0
+
+    @staticmethod
+    def get_instance(configfile = VMBackupConfigFile):
+        instance = ConfigCache.__instances__.get(configfile)
+        if instance is None:
+            with ConfigCache.__instances_lock__:
+                instance = ConfigCache.__instances__.get(configfile)
+                if instance is None:
+                    instance = ConfigCache(configfile)
+                    ConfigCache.__instances__[configfile] = instance
+        return instance
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.configfile)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def invalidate(self):
+        with self._lock:
+            self._state = (None, None, None)
+
+    def get_config(self):
+        """
+        Returns the cached ConfigParser, reloading it if the file changed on disk.
+        Returns None when the file does not exist and re-raises the parse error
+        of the current file contents, without parsing again, if it is malformed.
+        """
+        signature = self._file_signature()
+        state = self._state
+        if signature != state[0]:
+            with self._lock:
+                state = self._state
+                if signature != state[0]:
+                    config = None
+                    error = None
+                    if signature is not None:
+                        config = ConfigParsers.ConfigParser()
+                        try:
+                            config.read(self.configfile)
+                        except Exception as e:
+                            config = None
+                            error = e
+                        self.load_count += 1
+                    state = (signature, config, error)
+                    self._state = state
+        if state[2] is not None:
+            raise state[2]
+        return state[1]
+
+    def get(self, key, default = None, section = SnapshotThreadSection):
+        value = None
+        try:
+            config = self.get_config()
+            if config is not None and config.has_option(section, key):
+                value = config.get(section, key)
+        except Exception:
+            value = None
+        if value is None or value == '':
+            return default
+        return value
+
+    def get_str(self, key, default = None, section = SnapshotThreadSection):
+        value = self.get(key, default, section)
+        if value is None:
+            return value
+        try:
+            return str(value)
+        except ValueError:
+            return default
+
+    def get_int(self, key, default = 0, section = SnapshotThreadSection):
+        value = self.get(key, default, section)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, key, default = False, section = SnapshotThreadSection):
+        value = self.get(key, None, section)
+        if value is None:
+            return default
+        value = str(value).strip().lower()
+        if value in ConfigCache._true_values:
+            return True
+        if value in ConfigCache._false_values:
+            return False
+        return default
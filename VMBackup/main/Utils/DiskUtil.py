@@ -27,6 +27,7 @@ import uuid
 import glob
 from common import DeviceItem
 import Utils.HandlerUtil
+from Utils.ConfigCache import ConfigCache
 import traceback
 try:
         import ConfigParser as ConfigParsers
@@ -166,17 +167,14 @@ class DiskUtil(object):
         alternate_user = False
 
         try :
-            if os.path.exists(configfile):
-                config = ConfigParsers.ConfigParser()
-                config.read(configfile)
-                if config.has_option('lsblkUser','username'):
-                    lsblk_user = config.get('lsblkUser','username')
-                    command_user = "su - " + lsblk_user + " -c"
-                    if (dev_path is None):
-                        command_user = command_user + ' \'' + 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE' + '\''
-                    else:
-                        command_user = command_user + ' \'' + 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE' + ' ' + dev_path + '\''
-                    alternate_user = True
+            lsblk_user = ConfigCache.get_instance(configfile).get('username', section = 'lsblkUser')
+            if lsblk_user is not None:
+                command_user = "su - " + lsblk_user + " -c"
+                if (dev_path is None):
+                    command_user = command_user + ' \'' + 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE' + '\''
+                else:
+                    command_user = command_user + ' \'' + 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE' + ' ' + dev_path + '\''
+                alternate_user = True
         except Exception as e:
             pass
 
@@ -78,9 +78,13 @@ import platform
 import subprocess
 import datetime
 import Utils.Status
+from Utils.ConfigCache import ConfigCache
+from Utils.LogBuffer import LogBuffer
+from Utils.LogFileWriter import LogFileWriter
 from MachineIdentity import MachineIdentity
 import ExtensionErrorCodeHelper
 import traceback
+import atexit
 
 DateTimeFormat = "%Y-%m-%dT%H:%M:%SZ"
 
@@ -99,13 +103,15 @@ class HandlerUtility:
     def __init__(self, log, error, short_name):
         self._log = log
         self._error = error
-        self.log_message = ""
+        self.log_message = LogBuffer(ConfigCache.get_instance().get_int(CommonVariables.LogBufferMaxBytes, CommonVariables.log_buffer_max_bytes))
         self._short_name = short_name
         self.patching = None
         self.storageDetailsObj = None
         self.partitioncount = 0
         self.logging_file = None
+        self.log_file_writer = None
         self.pre_post_enabled = False
+        atexit.register(self.flush_log)
 
     def _get_log_prefix(self):
         return '[%s-%s]' % (self._context._name, self._context._version)
@@ -146,9 +152,9 @@ class HandlerUtility:
             self.update_settings_file()
             sys.exit(0)
 
-    def log(self, message,level='Info'):
+    def log(self, message,level='Info', chunks=None):
         try:
-            self.log_with_no_try_except(message, level)
+            self.log_with_no_try_except(message, level, chunks)
         except IOError:
             pass
         except Exception as e:
@@ -158,9 +164,11 @@ class HandlerUtility:
             except Exception as e:
                 pass
 
-    def log_with_no_try_except(self, message, level='Info'):
-        WriteLog = self.get_strvalue_from_configfile('WriteLog','True')
-        if (WriteLog == None or WriteLog == 'True'):
+    def log_with_no_try_except(self, message, level='Info', chunks=None):
+        # chunks are the (text, pinned) chunks of message when it comes from a LogBuffer,
+        # they are kept as they are so that its pinned chunks stay pinned in log_message
+        prefix = suffix = ""
+        if self.get_boolvalue_from_configfile('WriteLog', True):
             if sys.version_info > (3,):
                 if self.logging_file is not None:
                     self.log_py3(message)
@@ -168,24 +176,45 @@ class HandlerUtility:
                     pass
             else:
                 self._log(self._get_log_prefix() + message)
-            message = "{0}  {1}  {2} \n".format(str(datetime.datetime.utcnow()) , level , message)
-        self.log_message = self.log_message + message
+            prefix = "{0}  {1}  ".format(str(datetime.datetime.utcnow()) , level)
+            suffix = " \n"
+        if chunks is None:
+            self.log_message.append(prefix + message + suffix)
+        else:
+            self.log_message.append(prefix)
+            self.log_message.extend(chunks)
+            self.log_message.append(suffix)
 
     def log_py3(self, msg):
         if type(msg) is not str:
             msg = str(msg, errors="backslashreplace")
         msg = str(datetime.datetime.utcnow()) + " " + str(self._get_log_prefix()) + msg + "\n"
         try:
-            with open(self.logging_file, "a+") as C :
-                C.write(msg)
+            if self.log_file_writer is None or self.log_file_writer.path != self.logging_file:
+                self.flush_log()
+                self.log_file_writer = LogFileWriter(self.logging_file, "a+")
+            self.log_file_writer.write(msg)
         except IOError:
             pass
 
+    def flush_log(self):
+        if self.log_file_writer is not None:
+            self.log_file_writer.flush()
+
+    def hold_log(self):
+        if self.log_file_writer is not None:
+            self.log_file_writer.flush()
+            self.log_file_writer.hold()
+
+    def release_log(self):
+        if self.log_file_writer is not None:
+            self.log_file_writer.release()
+
     def error(self, message):
         self._error(self._get_log_prefix() + message)
 
     def fetch_log_message(self):
-        return self.log_message
+        return self.log_message.getvalue()
 
     def _parse_config(self, ctxt):
         config = None
@@ -339,48 +368,23 @@ class HandlerUtility:
     '''
 
     def get_value_from_configfile(self, key):
-        global backup_logger
-        value = None
-        configfile = '/etc/azure/vmbackup.conf'
-        try :
-            if os.path.exists(configfile):
-                config = ConfigParsers.ConfigParser()
-                config.read(configfile)
-                if config.has_option('SnapshotThread',key):
-                    value = config.get('SnapshotThread',key)  
-        except Exception as e:
-            pass
-
-        return value
+        return ConfigCache.get_instance().get(key)
 
     def get_strvalue_from_configfile(self, key, default):
-        value = self.get_value_from_configfile(key)
-        
-        if value == None or value == '':
-            value = default
-
-        try :
-            value_str = str(value)
-        except ValueError :
-            self.log('Not able to parse the read value as string, falling back to default value', 'Warning')
-            value = default
-
-        return value
+        return ConfigCache.get_instance().get_str(key, default)
 
     def get_intvalue_from_configfile(self, key, default):
-        value = default
-        value = self.get_value_from_configfile(key)
-        
-        if value == None or value == '':
-            value = default
-
+        value = ConfigCache.get_instance().get(key, default)
         try :
             value_int = int(value)
         except ValueError :
             self.log('Not able to parse the read value as int, falling back to default value', 'Warning')
-            value = default
+            value_int = int(default)
+
+        return value_int
 
-        return int(value)
+    def get_boolvalue_from_configfile(self, key, default):
+        return ConfigCache.get_instance().get_bool(key, default)
  
     def set_value_to_configfile(self, key, value):
         configfile = '/etc/azure/vmbackup.conf'
@@ -401,6 +405,7 @@ class HandlerUtility:
             config.set('SnapshotThread', key, value)
             with open(configfile, 'w') as config_file:
                 config.write(config_file)
+            ConfigCache.get_instance(configfile).invalidate()
         except Exception as e:
             errorMsg = " Unable to set config file.key is "+ key +"with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
             self.log(errorMsg, 'Warning')
@@ -636,6 +641,7 @@ class HandlerUtility:
         # status file.
         # because the wala choose the status file with the highest sequence
         # number to report.
+        self.flush_log()
         return stat_rept, stat_rept_file
 
     def write_to_status_file(self, stat_rept_file):
@@ -685,6 +691,7 @@ class HandlerUtility:
             self.do_status_report(operation, status,code,message)
         except Exception as e:
             self.log("Can't update status: " + str(e))
+        self.flush_log()
         sys.exit(exit_code)
 
     def get_handler_settings(self):
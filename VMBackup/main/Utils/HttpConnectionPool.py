@@ -0,0 +1,173 @@
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import socket
+import threading
+import time
+try:
+    import httplib as httplibs
+except ImportError:
+    import http.client as httplibs
+
+class PooledResponse(object):
+    """
+    Fully read http response, so that the connection it came from can go back to
+    the pool. Exposes the parts of HTTPResponse the extension uses.
+    """
+    def __init__(self, resp, body):
+        self.status = resp.status
+        self.reason = resp.reason
+        self._headers = resp.getheaders()
+        self._body = body
+        self._read = False
+
+    def getheaders(self):
+        return self._headers
+
+    def getheader(self, name, default = None):
+        name = name.lower()
+        for key, value in self._headers:
+            if key.lower() == name:
+                return value
+        return default
+
+    def read(self, amt = None):
+        if self._read:
+            return self._body[:0]
+        self._read = True
+        return self._body
+
+class HttpConnectionPool(object):
+    """
+    Keep-alive connections per (scheme, host, port, proxy). A connection is
+    checked out for exactly one request/response and returned once the response
+    body has been read. Idle connections older than idle_timeout are closed on
+    the next checkout. A request on a reused connection which the server closed in
+    the meantime (reset while sending, or closed without a status line) is sent
+    once more on a fresh one, unless it is a POST. Requests which timed out or
+    failed while their response was read are never retried.
+    """
+    def __init__(self, max_idle_per_key = 8, idle_timeout = 30):
+        self.max_idle_per_key = max_idle_per_key
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self.created_count = 0
+        self.reused_count = 0
+
+    def request(self, scheme, host, port, method, url, body, headers, timeout, proxy_host = None, proxy_port = None):
+        key = (scheme, host, port, proxy_host, proxy_port)
+        attempt = 0
+        while True:
+            connection, reused = self._checkout(key, timeout)
+            try:
+                connection.request(method = method, url = url, body = body, headers = headers)
+            except Exception as e:
+                self._close(connection)
+                if reused and attempt == 0 and method != 'POST' and self._is_dropped_connection(e):
+                    attempt = attempt + 1
+                    continue
+                raise
+            try:
+                resp = connection.getresponse()
+            except Exception as e:
+                self._close(connection)
+                # the request went out, it is only sent again when the server closed the
+                # connection without answering anything, a timeout is never retried
+                if reused and attempt == 0 and method != 'POST' and isinstance(e, httplibs.BadStatusLine):
+                    attempt = attempt + 1
+                    continue
+                raise
+            try:
+                # httplib knows a HEAD response has no body, reading it only closes the
+                # response, so property lookups sent as HEAD do not download the blob
+                resp_body = resp.read()
+            except Exception:
+                self._close(connection)
+                raise
+            pooled_resp = PooledResponse(resp, resp_body)
+            if resp.will_close:
+                self._close(connection)
+            else:
+                self._checkin(key, connection)
+            return pooled_resp
+
+    def _is_dropped_connection(self, e):
+        """
+        whether sending on a reused connection failed because the server had closed it
+        """
+        if isinstance(e, httplibs.BadStatusLine):
+            return True
+        return isinstance(e, socket.error) and getattr(e, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+    def close_all(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.values():
+            for connection, last_used in connections:
+                self._close(connection)
+
+    def _checkout(self, key, timeout):
+        now = time.time()
+        stale = []
+        connection = None
+        with self._lock:
+            connections = self._idle.get(key, [])
+            while len(connections) > 0:
+                candidate, last_used = connections.pop()
+                if now - last_used > self.idle_timeout:
+                    stale.append(candidate)
+                else:
+                    connection = candidate
+                    break
+            if connection is not None:
+                self.reused_count += 1
+            else:
+                self.created_count += 1
+        for candidate in stale:
+            self._close(candidate)
+        if connection is not None:
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            return connection, True
+        return self._create(key, timeout), False
+
+    def _create(self, key, timeout):
+        scheme, host, port, proxy_host, proxy_port = key
+        if proxy_host is not None:
+            connection = httplibs.HTTPSConnection(proxy_host, proxy_port, timeout = timeout)
+            connection.set_tunnel(host, port)
+        elif scheme == 'http':
+            connection = httplibs.HTTPConnection(host, port, timeout = timeout)
+        else:
+            connection = httplibs.HTTPSConnection(host, port, timeout = timeout)
+        return connection
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_key:
+                connections.append((connection, time.time()))
+                return
+        self._close(connection)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -0,0 +1,88 @@
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+from common import CommonVariables
+
+class LogBuffer(object):
+    """
+    Bounded accumulator for the log text that is uploaded to the log blob.
+    Lines are kept as a deque of chunks and joined once in getvalue(), oldest
+    chunks are dropped first once max_bytes is exceeded. Pinned chunks (the
+    freeze start/end markers) are never dropped.
+    """
+    def __init__(self, max_bytes = CommonVariables.log_buffer_max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._chunks = collections.deque()
+            self._pinned_head = []
+            self._size = 0
+            self.dropped_bytes = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, text, pinned = False):
+        if not text:
+            return
+        with self._lock:
+            if not pinned and len(text) > self.max_bytes:
+                self.dropped_bytes += len(text) - self.max_bytes
+                text = text[-self.max_bytes:]
+            self._chunks.append((text, pinned))
+            self._size += len(text)
+            self._evict()
+
+    def prepend(self, text):
+        if not text:
+            return
+        with self._lock:
+            self._pinned_head.insert(0, text)
+            self._size += len(text)
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._chunks) > 0:
+            text, pinned = self._chunks.popleft()
+            if pinned:
+                # older lines around the marker are gone, keep the marker itself in order
+                self._pinned_head.append(text)
+            else:
+                self._size -= len(text)
+                self.dropped_bytes += len(text)
+
+    def extend(self, chunks):
+        for text, pinned in chunks:
+            self.append(text, pinned)
+
+    def get_chunks(self):
+        """
+        The (text, pinned) chunks of getvalue(), so that they can be carried into another
+        buffer without losing their pinning
+        """
+        with self._lock:
+            chunks = [(text, True) for text in self._pinned_head]
+            if self.dropped_bytes > 0:
+                chunks.append(("================== {0} bytes of older logs dropped ==============\n".format(self.dropped_bytes), False))
+            chunks.extend(self._chunks)
+            return chunks
+
+    def getvalue(self):
+        return "".join(text for text, pinned in self.get_chunks())
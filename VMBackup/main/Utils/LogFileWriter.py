@@ -0,0 +1,106 @@
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+
+class LogFileWriter(object):
+    """
+    Long-lived handle for a log file (extension.log, /dev/console) that keeps the
+    file open across log calls and buffers complete lines in memory.
+    Pending lines are written out when the buffer grows past buffer_limit, when
+    they are older than flush_interval seconds, or on an explicit flush().
+    While held (freeze window) nothing is written until release() is called.
+    On flush the path is compared with the open descriptor and the file is
+    reopened if it was rotated or removed.
+    """
+    def __init__(self, path, mode = 'a', flush_interval = 1.0, buffer_limit = 65536):
+        self.path = path
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.buffer_limit = buffer_limit
+        self._lock = threading.RLock()
+        self._file = None
+        self._pending = []
+        self._pending_size = 0
+        self._last_flush = time.time()
+        self._held = False
+
+    def write(self, msg):
+        with self._lock:
+            self._pending.append(msg)
+            self._pending_size += len(msg)
+            if self._held:
+                return
+            if self._pending_size >= self.buffer_limit or time.time() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def hold(self):
+        with self._lock:
+            self._held = True
+
+    def release(self):
+        with self._lock:
+            self._held = False
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            try:
+                self._flush()
+            finally:
+                self._close_file()
+
+    def _flush(self):
+        self._last_flush = time.time()
+        if len(self._pending) == 0:
+            return
+        data = "".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        try:
+            self._ensure_open()
+            self._file.write(data)
+            self._file.flush()
+        except (IOError, OSError):
+            # same as the open/write/close per message it replaces, drop the lines and retry the open next time
+            self._close_file()
+
+    def _ensure_open(self):
+        if self._file is not None and self._is_rotated():
+            self._close_file()
+        if self._file is None:
+            self._file = open(self.path, self.mode)
+
+    def _is_rotated(self):
+        try:
+            path_stat = os.stat(self.path)
+            file_stat = os.fstat(self._file.fileno())
+        except (IOError, OSError):
+            return True
+        return path_stat.st_ino != file_stat.st_ino or path_stat.st_dev != file_stat.st_dev
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except (IOError, OSError):
+                pass
+            self._file = None
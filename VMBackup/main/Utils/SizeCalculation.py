@@ -13,7 +13,7 @@ import base64
 import json
 import tempfile
 import time
-from Utils.DiskUtil import DiskUtil
+from Utils.BlockDeviceInventory import BlockDeviceInventory
 from Utils.ResourceDiskUtil import ResourceDiskUtil
 import Utils.HandlerUtil
 import traceback
@@ -57,7 +57,7 @@ class SizeCalculation(object):
         self.isAnyDiskExcluded = False
         self.LunListEmpty = False
         self.logicalVolume_to_bill = []
-        self.sudo_off = 0 # run the commands using sudo
+        self.inventory = None
         if(para_parser.includedDisks != None and para_parser.includedDisks != '' and CommonVariables.isAnyDiskExcluded in para_parser.includedDisks.keys() and para_parser.includedDisks[CommonVariables.isAnyDiskExcluded] != None ):
             self.isAnyDiskExcluded = para_parser.includedDisks[CommonVariables.isAnyDiskExcluded]
             self.logger.log("isAnyDiskExcluded {0}".format(self.isAnyDiskExcluded))
@@ -68,43 +68,14 @@ class SizeCalculation(object):
             self.LunListEmpty = True
             self.logger.log("As the LunList is empty including all disks")
     
-    def get_lsscsi_list(self):
-        command = "lsscsi"
-        if (self.sudo_off == 0):
-            command = "sudo " + command
-        try:
-            self.logger.log("executing command  {0}".format(command))
-            self.lsscsi_list = (os.popen(command).read()).splitlines()
-        except Exception as e:
-            error_msg = "Failed to execute the command \"%s\" because of error %s , stack trace: %s" % (command, str(e), traceback.format_exc())
-            self.logger.log(error_msg, True ,'Error')
-            self.lsscsi_list = []
-
-    def get_lsblk_list(self):
-        try:
-            self.output_lsblk = os.popen("lsblk -n --list --output name,mountpoint").read().strip().splitlines()
-        except Exception as e:
-            error_msg = "Failed to execute the command lsblk -n --list --output name,mountpoint because of error %s , stack trace: %s" % (str(e), traceback.format_exc())
-            self.logger.log(error_msg, True ,'Error')
-            self.output_lsblk = []
-
-    def get_pvs_list(self):
-        try:
-            command = "pvs"
-            if (self.sudo_off == 0):
-                command = "sudo " + command
-            self.pvs_output = os.popen(command).read().strip().split("\n")
-            self.pvs_output = self.pvs_output[1:]
-        except Exception as e:
-            error_msg = "Failed to execute the command \"%s\" because of error %s , stack trace: %s" % (command, str(e), traceback.format_exc())
-            self.logger.log(error_msg, True ,'Error')
-            self.pvs_output = []
+    def get_inventory(self):
+        if self.inventory is None:
+            self.inventory = BlockDeviceInventory.get_instance(self.logger)
+        return self.inventory
 
     def get_loop_devices(self):
-        global disk_util
-        disk_util = DiskUtil.get_instance(patching = self.patching,logger = self.logger)
         if len(self.file_systems_info) == 0 :
-            self.file_systems_info = disk_util.get_mount_file_systems()
+            self.file_systems_info = self.get_inventory().file_systems_info()
         self.logger.log("file_systems list : ",True)
         self.logger.log(str(self.file_systems_info),True)
         disk_loop_devices_file_systems = []
@@ -114,20 +85,13 @@ class SizeCalculation(object):
         return disk_loop_devices_file_systems
   
     def disk_list_for_billing(self):
-        if(len(self.lsscsi_list) != 0):
-            for item in self.lsscsi_list:
-                idxOfColon = item.rindex(':',0,item.index(']'))# to get the index of last ':'
-                idxOfColon += 1
-                lunNumber = int(item[idxOfColon:item.index(']')])
-                # item_split is the list of elements present in the one row of the cmd sudo lsscsi
-                self.item_split = item.split()
-                #storing the corresponding device name from the list
-                device_name = self.item_split[len(self.item_split)-1]
-
-                for device in self.root_devices :
-                    if device_name in device :
-                        lunNumber = -1
-                        # Changing the Lun# of OS Disk to -1
+        lun_to_disk = self.get_inventory().lun_to_disk
+        if(len(lun_to_disk) != 0):
+            for lunNumber in sorted(lun_to_disk.keys()):
+                device_name = lun_to_disk[lunNumber]
+                if device_name in self.root_devices :
+                    lunNumber = -1
+                    # Changing the Lun# of OS Disk to -1
 
                 if lunNumber in self.includedLunList :
                     self.disksToBeIncluded.append(device_name)
@@ -135,31 +99,17 @@ class SizeCalculation(object):
             self.logger.log("Disks to be included {0}".format(self.disksToBeIncluded))
         else:
             self.size_calc_failed = True
-            self.logger.log("There is some glitch in executing the command 'lsscsi' and therefore size calculation is marked as failed.")
+            self.logger.log("No scsi disks found under /sys/class/scsi_disk and therefore size calculation is marked as failed.")
 
     def get_logicalVolumes_for_billing(self):
-        try:
-            self.pvs_dict = {}
-            for pvs_item in self.pvs_output:
-                pvs_item_split  = pvs_item.strip().split()
-                if(len(pvs_item_split) > 2):
-                    physicalVolume = pvs_item_split[0]
-                    logicalVolumeGroup = pvs_item_split[1]
-                    if(logicalVolumeGroup in self.pvs_dict.keys()):
-                        self.pvs_dict.get(logicalVolumeGroup).append(physicalVolume)
-                    else:
-                        self.pvs_dict[logicalVolumeGroup] = []
-                        self.pvs_dict.get(logicalVolumeGroup).append(physicalVolume)
-            self.logger.log("The pvs_dict contains {0}".format(str(self.pvs_dict)))
-        except Exception as e:
-            errMsg = 'Failed to serialize pvs_output with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
-            self.logger.log(errMsg, True, 'Error') 
+        inventory = self.get_inventory()
+        self.pvs_dict = inventory.volume_group_pvs
+        self.logger.log("The pvs_dict contains {0}".format(str(self.pvs_dict)))
         for lvg in self.pvs_dict.keys():
             count = 0
-            for disk in self.disksToBeIncluded:
-                for pv in self.pvs_dict[lvg]:
-                    if(disk in pv):
-                        count = count+1
+            for pv in self.pvs_dict[lvg]:
+                if len(inventory.base_disk_paths(pv).intersection(self.disksToBeIncluded)) > 0:
+                    count = count+1
             if(count == len(self.pvs_dict[lvg])):
                 lvg = "/dev/mapper/" + lvg
                 self.logicalVolume_to_bill.append(lvg)
@@ -169,89 +119,51 @@ class SizeCalculation(object):
 
     def device_list_for_billing(self):
         self.logger.log("In device_list_for_billing",True)
+        inventory = self.get_inventory()
         devices_to_bill = [] #list to store device names to be billed
-        device_items = disk_util.get_device_items(None)
-        for device_item in device_items :
-            if str(device_item.name).startswith("sd"):
-                devices_to_bill.append("/dev/{0}".format(str(device_item.name)))
+        for mount in inventory.mounts:
+            device = inventory.device_of_mount(mount)
+            if device is None:
+                continue
+            if device.name.startswith("sd"):
+                if device.path not in devices_to_bill:
+                    devices_to_bill.append(device.path)
             else:
-                self.logger.log("Not adding device {0} as it does not start with sd".format(str(device_item.name)))
+                self.logger.log("Not adding device {0} as it does not start with sd".format(device.name))
         self.logger.log("Initial billing items {0}".format(devices_to_bill))
-        
-        '''
-            Sample output for file_systems_info
-            [('sysfs', 'sysfs', '/sys'), ('proc', 'proc', '/proc'), ('udev', 'devtmpfs', '/dev'),..]
-            Since root devices are at mount points '/' and '/boot/efi' we use file_system_info to find the root_devices based on the mount points.
-        '''
-
-        # check if user off the sudo usage in commands
-        self.sudo_off = self.hutil.get_intvalue_from_configfile("sudo_off", self.sudo_off)
-        self.logger.log("sudo flag is {0}".format(self.sudo_off))
-
-        # The command lsscsi is used for mapping the LUN numbers to the disk_names
-        self.get_lsscsi_list() #populates self.lsscsi_list 
-        self.get_lsblk_list() #populates self.lsblk_list
-        self.get_pvs_list()#populates pvs list
-
-        for file_system in self.file_systems_info:
-            if(file_system[2] in self.root_mount_points):
-                self.root_devices.append(file_system[0])
+
+        for mount_point in self.root_mount_points:
+            mount = inventory.mount_by_point.get(mount_point)
+            device = None
+            if mount is not None:
+                device = inventory.device_of_mount(mount)
+            if device is not None:
+                for disk in inventory.base_disks(device.name):
+                    if '/dev/' + disk not in self.root_devices:
+                        self.root_devices.append('/dev/' + disk)
         self.logger.log("root_devices {0}".format(str(self.root_devices)))
-        self.logger.log("lsscsi_list {0}".format(self.lsscsi_list))
-        '''
-            Sample output of the lsscsi command 
-            [1:0:0:15]   disk    Msft     Virtual Disk     1.0   /dev/sda
-            [1:0:0:18]   disk    Msft     Virtual Disk     1.0   /dev/sdc
-        '''
+        self.logger.log("lun_to_disk {0}".format(inventory.lun_to_disk))
 
         self.disk_list_for_billing() 
         self.get_logicalVolumes_for_billing()
-        self.logger.log("lsblk o/p {0}".format(self.output_lsblk))
         self.logger.log("lvm {0}".format(self.logicalVolume_to_bill))
-        ''' 
-                NAME          MOUNTPOINT
-                sda
-                sda1          /boot/efi
-                sda2          /boot
-                sda3
-                sda4
-                rootvg-tmplv  /tmp
-                rootvg-usrlv  /usr
-                rootvg-optlv  /opt
-                rootvg-homelv /home
-                rootvg-varlv  /var
-                rootvg-rootlv /
-                sdb
-                sdb1          /mnt/resource
-
-                sdc
-                sdc1          /mnt/sdc1
-                sdc2          /mnt/sdc2
-                sdc3
-                sde
-                sde1          /mnt/sde1
-                sdf
-                sdg
-	'''
-        if(len(self.output_lsblk) == 0):
+
+        if(len(inventory.mounts) == 0):
             self.size_calc_failed = True
-            self.logger.log("There is some glitch in executing the command 'lsblk -n --list --output name,mountpoint' and therefore size calculation is marked as failed.")
-        
-        for item in self.output_lsblk: 
-            item_split = item.split()
-            if(len(item_split)==2):
-                device = item_split[0]
-                mount_point = item_split[1]
-            else:
-                mount_point = ""
-                device = ""
-            if device != '' and mount_point != '':
-                device = '/dev/' + device
-                for disk in self.disksToBeIncluded :
-                    if disk in device and device not in self.devicesToInclude:
-                        self.devicesToInclude.append(device)
-                        self.device_mount_points.append(mount_point)
-                        break              
+            self.logger.log("No mounts found in /proc/self/mountinfo and therefore size calculation is marked as failed.")
+
+        for mount in inventory.mounts:
+            device = inventory.device_of_mount(mount)
+            # partitions and whole disks only, logical volumes are billed per volume group above
+            if device is None or len(device.slaves) > 0:
+                continue
+            for disk in inventory.base_disks(device.name):
+                if '/dev/' + disk in self.disksToBeIncluded:
+                    if device.path not in self.devicesToInclude:
+                        self.devicesToInclude.append(device.path)
+                    if mount.mount_point not in self.device_mount_points:
+                        self.device_mount_points.append(mount.mount_point)
+                    break
         self.logger.log("devices_to_bill: {0}".format(str(self.devicesToInclude)),True) 
         self.logger.log("The mountpoints of devices to bill: {0}".format(str(self.device_mount_points)), True)
         self.logger.log("exiting device_list_for_billing",True)
@@ -261,48 +173,15 @@ class SizeCalculation(object):
         try:
             self.size_calc_failed = False
 
-            onlyLocalFilesystems = self.hutil.get_strvalue_from_configfile(CommonVariables.onlyLocalFilesystems, "False") 
-            # df command gives the information of all the devices which have mount points
-            if onlyLocalFilesystems in ['True', 'true']:  
-                df = subprocess.Popen(["df" , "-kl"], stdout=subprocess.PIPE)
-            else:
-                df = subprocess.Popen(["df" , "-k"], stdout=subprocess.PIPE)
-
-            '''
-            Sample output of the df command
-            Filesystem                                              Type     1K-blocks    Used    Avail Use% Mounted on
-            /dev/sda2                                               xfs       52155392 3487652 48667740   7% /
-            devtmpfs                                                devtmpfs   7170976       0  7170976   0% /dev
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /dev/shm
-            tmpfs                                                   tmpfs      7180624  760496  6420128  11% /run
-            tmpfs                                                   tmpfs      7180624       0  7180624   0% /sys/fs/cgroup
-            /dev/sda1                                               ext4        245679  151545    76931  67% /boot
-            /dev/sdb1                                               ext4      28767204 2142240 25140628   8% /mnt/resource
-            /dev/mapper/mygroup-thinv1                              xfs        1041644   33520  1008124   4% /bricks/brick1
-            /dev/mapper/mygroup-85197c258a54493da7880206251f5e37_0  xfs        1041644   33520  1008124   4% /run/gluster/snaps/85197c258a54493da7880206251f5e37/brick2
-            /dev/mapper/mygroup2-thinv2                             xfs       15717376 5276944 10440432  34% /tmp/test
-            /dev/mapper/mygroup2-63a858543baf4e40a3480a38a2f232a0_0 xfs       15717376 5276944 10440432  34% /run/gluster/snaps/63a858543baf4e40a3480a38a2f232a0/brick2
-            tmpfs                                                   tmpfs      1436128       0  1436128   0% /run/user/1000
-            //Centos72test/cifs_test                                cifs      52155392 4884620 47270772  10% /mnt/cifs_test2
-            '''
-            output = ""
-            process_wait_time = 300
-            while(df is not None and process_wait_time >0 and df.poll() is None):
-                time.sleep(1)
-                process_wait_time -= 1
-            self.logger.log("df command executed for process wait time value" + str(process_wait_time), True)
-            if(df is not None and df.poll() is not None):
-                self.logger.log("df return code "+str(df.returncode), True)
-                output = df.stdout.read().decode()
-            if sys.version_info > (3,):
-                try:
-                    output = str(output, encoding='utf-8', errors="backslashreplace")
-                except:
-                    output = str(output)
-            else:
-                output = str(output)
-            output = output.strip().split("\n")
-            self.logger.log("output of df : {0}".format(str(output)),True)
+            onlyLocalFilesystems = self.hutil.get_boolvalue_from_configfile(CommonVariables.onlyLocalFilesystems, False)
+            # statvfs of every mount, listed the way df -k (or df -kl) shows them
+            inventory = self.get_inventory()
+            df_entries = inventory.df_entries(onlyLocalFilesystems)
+            self.logger.log("mounts listed for size calculation : {0}".format(len(df_entries)),True)
+            for mount in inventory.timed_out_mounts:
+                if not mount.is_remote():
+                    self.logger.log("statvfs did not complete for local mount {0} and therefore size calculation is marked as failed.".format(mount.mount_point),True)
+                    self.size_calc_failed = True
             disk_loop_devices_file_systems = self.get_loop_devices()
             self.logger.log("outside loop device", True)
             total_used = 0
@@ -320,11 +199,6 @@ class SizeCalculation(object):
             totalSpaceUsed = 0
             device_list = []
       
-            if len(self.file_systems_info) == 0 :
-                self.file_systems_info = disk_util.get_mount_file_systems()
-
-            output_length = len(output)
-            index = 1
             self.resource_disk = ResourceDiskUtil(patching = self.patching, logger = self.logger)
             resource_disk_device = self.resource_disk.get_resource_disk_mount_point(0)
             self.logger.log("resource_disk_device: {0}".format(resource_disk_device),True)
@@ -334,18 +208,13 @@ class SizeCalculation(object):
             if(self.LunListEmpty != True and self.isAnyDiskExcluded == True):
                 device_list = self.device_list_for_billing() #new logic: calculate the disk size for billing
 
-            while index < output_length:
-                if(len(Utils.HandlerUtil.HandlerUtility.split(self.logger, output[index])) < 6 ): #when a row is divided in 2 lines
-                    index = index+1
-                    if(index < output_length and len(Utils.HandlerUtil.HandlerUtility.split(self.logger, output[index-1])) + len(Utils.HandlerUtil.HandlerUtility.split(self.logger, output[index])) == 6):
-                        output[index] = output[index-1] + output[index]
-                    else:
-                        self.logger.log("Output of df command is not in desired format",True)
-                        total_used = 0
-                        self.size_calc_failed = True
-                        break
-                device, size, used, available, percent, mountpoint =Utils.HandlerUtil.HandlerUtility.split(self.logger, output[index])
-                fstype = ''
+            for index, mount in enumerate(df_entries, 1):
+                device = mount.source
+                size = mount.size_kb
+                used = mount.used_kb
+                available = mount.available_kb
+                mountpoint = mount.mount_point
+                fstype = mount.fstype
                 isNetworkFs = False
                 isKnownFs = False
 
@@ -354,9 +223,6 @@ class SizeCalculation(object):
                     self.size_calc_failed = True
                     return 0,self.size_calc_failed
 
-                for file_system_info in self.file_systems_info:
-                    if device == file_system_info[0] and mountpoint == file_system_info[2]:
-                        fstype = file_system_info[1]
                 self.logger.log("index :{0} Device name : {1} fstype : {2} size : {3} used space in KB : {4} available space : {5} mountpoint : {6}".format(index,device,fstype,size,used,available,mountpoint),True)
 
                 for nonPhysicaFsType in self.non_physical_file_systems:
@@ -459,8 +325,6 @@ class SizeCalculation(object):
                     if not (isKnownFs or fstype == '' or fstype == None):
                         total_used_unknown_fs = total_used_unknown_fs + int(used)
 
-                index = index + 1
-
             if not len(unknown_fs_types) == 0:
                 Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("unknownFSTypeInDf",str(unknown_fs_types))
                 Utils.HandlerUtil.HandlerUtility.add_to_telemetery_data("totalUsedunknownFS",str(total_used_unknown_fs))
@@ -0,0 +1,92 @@
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import traceback
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+class TaskResult(object):
+    def __init__(self, index):
+        self.index = index
+        self.completed = False
+        self.result = None
+        self.error = None
+        self.elapsed = None
+    def __str__(self):
+        return 'index: ' + str(self.index) + ' completed: ' + str(self.completed) + ' elapsed: ' + str(self.elapsed) + ' error: ' + str(self.error)
+
+class ThreadPool(object):
+    """
+    Minimal bounded worker pool usable on the python 2.6+ interpreters the
+    extension supports, where concurrent.futures is not available.
+    run() calls func(*args) for every args tuple in work_items on at most
+    max_workers daemon threads and returns one TaskResult per item, in order.
+    Items still running when the deadline (absolute time.time() value) passes
+    are left as completed = False and their threads are abandoned.
+    """
+    def __init__(self, max_workers):
+        self.max_workers = max(1, int(max_workers))
+
+    def run(self, func, work_items, deadline = None):
+        results = [TaskResult(index) for index in range(len(work_items))]
+        if len(work_items) == 0:
+            return results
+        pending = queue.Queue()
+        for index, args in enumerate(work_items):
+            pending.put((index, args))
+        done = threading.Event()
+        lock = threading.Lock()
+        remaining = [len(work_items)]
+
+        def worker():
+            while True:
+                try:
+                    index, args = pending.get_nowait()
+                except queue.Empty:
+                    return
+                task_result = TaskResult(index)
+                start_time = time.time()
+                try:
+                    task_result.result = func(*args)
+                except Exception as e:
+                    task_result.error = "%s, stack trace: %s" % (str(e), traceback.format_exc())
+                task_result.elapsed = time.time() - start_time
+                task_result.completed = True
+                with lock:
+                    results[index] = task_result
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        done.set()
+
+        for i in range(min(self.max_workers, len(work_items))):
+            thread = threading.Thread(target = worker)
+            thread.daemon = True
+            thread.start()
+
+        if deadline is None:
+            while not done.is_set():
+                done.wait(1)
+        else:
+            while not done.is_set():
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                done.wait(min(timeout, 1))
+        with lock:
+            return list(results)
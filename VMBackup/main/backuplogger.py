@@ -22,13 +22,19 @@ import string
 import time
 import traceback
 from blobwriter import BlobWriter
+from common import CommonVariables
 from Utils.WAAgentUtil import waagent
+from Utils.LogBuffer import LogBuffer
+from Utils.LogFileWriter import LogFileWriter
+import atexit
 import sys
 
 class Backuplogger(object):
     def __init__(self, hutil):
-        self.msg = ''
+        self.msg = LogBuffer(hutil.get_intvalue_from_configfile(CommonVariables.LogBufferMaxBytes, CommonVariables.log_buffer_max_bytes))
         self.con_path = '/dev/console'
+        self.con_writer = LogFileWriter(self.con_path, "w")
+        atexit.register(self.flush)
         self.enforced_local_flag_value = True
         self.hutil = hutil
         self.prev_log = ''
@@ -43,18 +49,22 @@ class Backuplogger(object):
         if (self.enforced_local_flag_value != False and enforced_local == False and self.logging_off == True):
             pass
         elif (self.enforced_local_flag_value != False and enforced_local == False):
-            self.msg = self.msg + "================== Logs during Freeze Start ==============" + "\n"
+            # get everything on disk before the file systems are frozen, then keep the log files untouched until thaw
+            self.con_writer.flush()
+            self.hutil.hold_log()
+            self.msg.append("================== Logs during Freeze Start ==============" + "\n", pinned = True)
         elif (self.enforced_local_flag_value == False and enforced_local == True):
-            self.msg = self.msg + "================== Logs during Freeze End ==============" + "\n"
+            self.msg.append("================== Logs during Freeze End ==============" + "\n", pinned = True)
+            self.hutil.release_log()
             self.commit_to_local()
+            self.flush()
         self.enforced_local_flag_value = enforced_local
 
     """description of class"""
     def log(self, msg, local=False, level='Info'):
         if(self.enforced_local_flag_value == False and self.logging_off == True):
             return
-        WriteLog = self.hutil.get_strvalue_from_configfile('WriteLog','True')
-        if (WriteLog == None or WriteLog == 'True'):
+        if self.hutil.get_boolvalue_from_configfile('WriteLog', True):
             log_msg = ""
             if sys.version_info > (3,):
                 log_msg = self.log_to_con_py3(msg, level)
@@ -63,7 +73,7 @@ class Backuplogger(object):
                 if(self.enforced_local_flag_value != False):
                     self.log_to_con(log_msg)
             if(self.enforced_local_flag_value == False):
-                self.msg += log_msg
+                self.msg.append(log_msg)
             else:
                 self.hutil.log(str(msg),level)
 
@@ -87,19 +97,21 @@ class Backuplogger(object):
             log_msg= str(log_msg.encode('ascii', "backslashreplace"), 
                          encoding="ascii")
             if(self.enforced_local_flag_value != False):
-                with open(self.con_path, "w") as C :
-                    C.write(log_msg)
+                self.con_writer.write(log_msg)
         except IOError:
             pass
         except Exception as e:
             log_msg = "###### Exception in log_to_con_py3"
         return log_msg
 
+    def flush(self):
+        self.con_writer.flush()
+        self.hutil.flush_log()
+
     def commit(self, logbloburi):
         #commit to local file system first, then commit to the network.
         try:
-            self.hutil.log(self.msg)
-            self.msg = ''
+            self.commit_to_local()
         except Exception as e:
             pass 
         try:
@@ -108,12 +120,13 @@ class Backuplogger(object):
             self.hutil.log('commit to blob failed')
 
     def commit_to_local(self):
-        self.hutil.log(self.msg)
-        self.msg = ''
+        # the freeze start/end markers stay pinned in the log uploaded to the blob
+        chunks = self.msg.get_chunks()
+        self.hutil.log("".join(text for text, pinned in chunks), chunks = chunks)
+        self.msg.clear()
 
     def commit_to_blob(self, logbloburi):
-        UploadStatusAndLog = self.hutil.get_strvalue_from_configfile('UploadStatusAndLog','True')
-        if (UploadStatusAndLog == None or UploadStatusAndLog == 'True'):
+        if self.hutil.get_boolvalue_from_configfile('UploadStatusAndLog', True):
             log_to_blob = ""
             blobWriter = BlobWriter(self.hutil)
             # append the wala log at the end.
@@ -125,8 +138,8 @@ class Backuplogger(object):
                         distro_str = self.hutil.patching.distro_info[0] + " " + self.hutil.patching.distro_info[1]
                     else:
                         distro_str = self.hutil.patching.distro_info[0]
-                    self.msg = "Distro Info:" + distro_str + "\n" + self.msg
-                self.msg = "Guest Agent Version is :" + waagent.GuestAgentVersion + "\n" + self.msg
+                    self.msg.prepend("Distro Info:" + distro_str + "\n")
+                self.msg.prepend("Guest Agent Version is :" + waagent.GuestAgentVersion + "\n")
                 log_to_blob = str(self.hutil.fetch_log_message()) + "Tail of shell script log:" + str(self.hutil.get_shell_script_log())
             except Exception as e:
                 errMsg = 'Failed to get the waagent log with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
@@ -19,6 +19,7 @@
 import time
 import datetime
 import traceback
+import hashlib
 try:
     import urlparse
 except ImportError:
@@ -26,6 +27,7 @@ except ImportError:
 from common import CommonVariables
 from HttpUtil import HttpUtil
 from Utils import HandlerUtil
+from Utils.ThreadPool import ThreadPool
 
 class BlobProperties():
     def __init__(self, blobType, contentLength):
@@ -34,8 +36,15 @@ class BlobProperties():
     def __str__(self):
         return ' blobType: ' + str(self.blobType) + ' contentLength: ' + str(self.contentLength)
 
+class PageHashes():
+    def __init__(self, hashes, msgLen, blobContentLength):
+        self.hashes = hashes
+        self.msgLen = msgLen
+        self.blobContentLength = blobContentLength
+
 class BlobWriter(object):
     blobEmptyDetails = {}
+    pageHashes = {}
     """description of class"""
     def __init__(self, hutil):
         self.hutil = hutil
@@ -56,8 +65,10 @@ class BlobWriter(object):
                     blobType = blobProperties.blobType
 
                 if (str(blobType).lower() == "pageblob"):
-                    # Clear Page-Blob Contents
-                    self.ClearPageBlob(blobUri, blobProperties)
+                    # Clear Page-Blob Contents, unless this process wrote it before and only the changed pages need to be rewritten
+                    if (self.can_write_incrementally(blobUri, blobProperties) == False):
+                        BlobWriter.pageHashes.pop(blobUri, None)
+                        self.ClearPageBlob(blobUri, blobProperties)
                     # Write to Page-Blob
                     self.WritePageBlob(msg, blobUri, blobProperties)
                 else:
@@ -102,10 +113,7 @@ class BlobWriter(object):
                 msg = message
                 try:
                     PAGE_SIZE_BYTES = 512
-                    PAGE_UPLOAD_LIMIT_BYTES = 4194304 # 4 MB
-                    STATUS_BLOB_LIMIT_BYTES = 10485760 # 10 MB
-                    http_util = HttpUtil(self.hutil)
-                    sasuri_obj = urlparse.urlparse(blobUri + '&comp=page')
+                    STATUS_BLOB_LIMIT_BYTES = CommonVariables.status_blob_limit_bytes
                     # Get Blob-properties to know content-length
                     blobContentLength = int(blobProperties.contentLength)
                     self.hutil.log("WritePageBlob: contentLength:"+str(blobContentLength))
@@ -137,23 +145,7 @@ class BlobWriter(object):
                         msgLen = len(msg)
                         self.hutil.log("WritePageBlob: msg length after aligning to blobContentLength:"+str(msgLen))
                     # Write Pages
-                    result = CommonVariables.error
-                    bytes_sent = 0
-                    while (bytes_sent < msgLen):
-                        bytes_remaining = msgLen - bytes_sent
-                        pageContent = None
-                        if(bytes_remaining > PAGE_UPLOAD_LIMIT_BYTES): # more than 4 MB
-                            pageContent = msg[bytes_sent:bytes_sent+PAGE_UPLOAD_LIMIT_BYTES]
-                        else:
-                            pageContent = msg[bytes_sent:msgLen]
-                        self.hutil.log("WritePageBlob: pageContentLen:"+str(len(pageContent)))
-                        result = self.put_page_update(pageContent, blobUri, bytes_sent)
-                        if(result == CommonVariables.success):
-                            self.hutil.log("WritePageBlob: page written succesfully")
-                        else:
-                            self.hutil.log("WritePageBlob: page failed to write")
-                            break
-                        bytes_sent = bytes_sent + len(pageContent)                      
+                    result = self.write_pages(msg, blobUri, blobContentLength)
                     if(result == CommonVariables.success):
                         self.hutil.log("WritePageBlob: page-blob written succesfully")
                         retry_times = 0
@@ -168,6 +160,82 @@ class BlobWriter(object):
         else:
             self.hutil.log("WritePageBlob: bloburi is None")
 
+    def write_pages(self, msg, blobUri, blobContentLength):
+        """
+        Uploads the page aligned msg as page ranges of at most 4 MB, several at a time.
+        Pages whose hash matches what the previous write of the same blob in this
+        process committed are skipped, only ranges that failed are retried, and the
+        pages the previous message used beyond the new end are cleared.
+        """
+        PAGE_SIZE_BYTES = 512
+        PAGE_UPLOAD_LIMIT_BYTES = 4194304 # 4 MB
+        msgLen = len(msg)
+        page_hashes = []
+        for offset in range(0, msgLen, PAGE_SIZE_BYTES):
+            page_hashes.append(self.page_hash(msg[offset:offset + PAGE_SIZE_BYTES]))
+
+        previous = BlobWriter.pageHashes.get(blobUri)
+        if previous is not None and previous.blobContentLength != blobContentLength:
+            previous = None
+        # until this write completes nothing is known about the pages, but whatever the previous message used still has to be cleared
+        written_len = msgLen
+        if previous is not None:
+            written_len = max(msgLen, previous.msgLen)
+        BlobWriter.pageHashes[blobUri] = PageHashes([], written_len, blobContentLength)
+        ranges = []
+        range_start = None
+        for page_index in range(len(page_hashes)):
+            offset = page_index * PAGE_SIZE_BYTES
+            unchanged = previous is not None and page_index < len(previous.hashes) and previous.hashes[page_index] == page_hashes[page_index]
+            if unchanged or (range_start is not None and offset - range_start >= PAGE_UPLOAD_LIMIT_BYTES):
+                if range_start is not None:
+                    ranges.append((range_start, offset))
+                range_start = None
+            if not unchanged and range_start is None:
+                range_start = offset
+        if range_start is not None:
+            ranges.append((range_start, msgLen))
+        self.hutil.log("WritePageBlob: pages:" + str(len(page_hashes)) + ", ranges to write:" + str(len(ranges)) + ", incremental:" + str(previous is not None))
+
+        concurrency = self.hutil.get_intvalue_from_configfile(CommonVariables.PageUploadConcurrency, CommonVariables.page_upload_concurrency_default)
+        retry_times = 3
+        while len(ranges) > 0 and retry_times > 0:
+            work_items = [(msg[start:end], blobUri, start) for start, end in ranges]
+            task_results = ThreadPool(concurrency).run(self.put_page_update, work_items)
+            failed_ranges = []
+            for task_result in task_results:
+                if(task_result.completed and task_result.error is None and task_result.result == CommonVariables.success):
+                    self.hutil.log("WritePageBlob: page written succesfully, offset:" + str(ranges[task_result.index][0]) + ", pageContentLen:" + str(ranges[task_result.index][1] - ranges[task_result.index][0]))
+                else:
+                    self.hutil.log("WritePageBlob: page failed to write, offset:" + str(ranges[task_result.index][0]) + ", error:" + str(task_result.error))
+                    failed_ranges.append(ranges[task_result.index])
+            ranges = failed_ranges
+            retry_times = retry_times - 1
+        if len(ranges) > 0:
+            return CommonVariables.error
+
+        if previous is not None and previous.msgLen > msgLen:
+            result = self.put_page_clear(blobUri, msgLen, previous.msgLen - msgLen)
+            if(result != CommonVariables.success):
+                self.hutil.log("WritePageBlob: failed to clear the pages after the message end")
+                return result
+        BlobWriter.pageHashes[blobUri] = PageHashes(page_hashes, msgLen, blobContentLength)
+        return CommonVariables.success
+
+    def page_hash(self, page):
+        if not isinstance(page, bytes):
+            page = page.encode('utf-8', 'backslashreplace')
+        return hashlib.sha256(page).digest()
+
+    def can_write_incrementally(self, blobUri, blobProperties):
+        previous = BlobWriter.pageHashes.get(blobUri)
+        if previous is None or blobProperties is None:
+            return False
+        try:
+            return previous.blobContentLength == int(blobProperties.contentLength)
+        except (TypeError, ValueError):
+            return False
+
     def ClearPageBlob(self, blobUri, blobProperties):
         if(blobUri is not None):
             retry_times = 3
@@ -214,7 +282,7 @@ class BlobWriter(object):
                     http_util = HttpUtil(self.hutil)
                     sasuri_obj = urlparse.urlparse(blobUri)
                     headers = {}
-                    result, httpResp, errMsg = http_util.HttpCallGetResponse('GET', sasuri_obj, None, headers = headers)
+                    result, httpResp, errMsg = http_util.HttpCallGetResponse('HEAD', sasuri_obj, None, headers = headers)
                     self.hutil.log("GetBlobProperties: HttpCallGetResponse : result :" + str(result) + ", errMsg :" + str(errMsg))
                     blobProperties = self.httpresponse_get_blob_properties(httpResp)
                     self.hutil.log("GetBlobProperties: blobProperties :" + str(blobProperties))
@@ -48,6 +48,16 @@ class CommonVariables:
     key = 'Key'
     value = 'Value'
     snapshotTtlHeader = 'x-ms-snapshot-ttl-expiry-hours'
+    LogBufferMaxBytes = 'LogBufferMaxBytes'
+    SnapshotConcurrency = 'SnapshotConcurrency'
+    PageUploadConcurrency = 'PageUploadConcurrency'
+    snapshotLatenciesInMs = 'snapshotLatenciesInMs'
+    httpConnectionsReused = 'httpConnectionsReused'
+
+    status_blob_limit_bytes = 10485760 # 10 MB, WritePageBlob never uploads more than this
+    log_buffer_max_bytes = status_blob_limit_bytes
+    snapshot_concurrency_default = 32
+    page_upload_concurrency_default = 4
 
     snapshotTaskToken = 'snapshotTaskToken'
     snapshotCreator = 'snapshotCreator'
@@ -27,13 +27,14 @@ try:
     import ConfigParser as ConfigParsers
 except ImportError:
     import configparser as ConfigParsers
-import multiprocessing as mp
+import time
 from common import CommonVariables
 from HttpUtil import HttpUtil
 from Utils import Status
 from Utils import HandlerUtil
 from fsfreezer import FsFreezer
 from Utils import HostSnapshotObjects
+from Utils.ThreadPool import ThreadPool
 
 class SnapshotInfoIndexerObj():
     def __init__(self, index, isSuccessful, snapshotTs, errorMessage):
@@ -69,7 +70,7 @@ class GuestSnapshotter(object):
         self.configfile='/etc/azure/vmbackup.conf'
         self.hutil = hutil
 
-    def snapshot(self, sasuri, sasuri_index, settings, meta_data, snapshot_result_error, snapshot_info_indexer_queue, global_logger, global_error_logger):
+    def snapshot(self, sasuri, sasuri_index, settings, meta_data, deadline = None):
         temp_logger=''
         error_logger=''
         snapshot_error = SnapshotError()
@@ -99,9 +100,13 @@ class GuestSnapshotter(object):
                 temp_logger = temp_logger + str(headers)
                 http_util = HttpUtil(self.logger)
                 sasuri_obj = urlparser.urlparse(sasuri + '&comp=snapshot')
+                # the request must not outlive the freeze window, but keep the usual 10 secs socket timeout when there is time left
+                request_timeout = None
+                if(deadline is not None):
+                    request_timeout = max(1, min(10, deadline - time.time()))
                 temp_logger = temp_logger + str(datetime.datetime.utcnow()) + ' start calling the snapshot rest api. '
                 # initiate http call for blob-snapshot and get http response
-                result, httpResp, errMsg, responseBody  = http_util.HttpCallGetResponse('PUT', sasuri_obj, body_content, headers = headers, responseBodyRequired = True)
+                result, httpResp, errMsg, responseBody  = http_util.HttpCallGetResponse('PUT', sasuri_obj, body_content, headers = headers, responseBodyRequired = True, timeout = request_timeout)
                 temp_logger = temp_logger + str("responseBody: " + responseBody)
                 if(result == CommonVariables.success and httpResp != None):
                     # retrieve snapshot information from http response
@@ -122,10 +127,7 @@ class GuestSnapshotter(object):
             snapshot_error.errorcode = CommonVariables.error
             snapshot_error.sasuri = sasuri
         temp_logger=temp_logger + str(datetime.datetime.utcnow()) + ' snapshot ends..'
-        global_logger.put(temp_logger)
-        global_error_logger.put(error_logger)
-        snapshot_result_error.put(snapshot_error)
-        snapshot_info_indexer_queue.put(snapshot_info_indexer)
+        return snapshot_error, snapshot_info_indexer, temp_logger, error_logger
 
     def snapshot_seq(self, sasuri, sasuri_index, settings, meta_data):
         result = None
@@ -186,49 +188,27 @@ class GuestSnapshotter(object):
         thaw_done_local = thaw_done
         unable_to_sleep = False
         all_snapshots_failed = False
-        set_next_backup_to_seq = False
         try:
-            self.logger.log("before start of multiprocessing queues..")
-            mp_jobs = []
-            queue_creation_starttime = datetime.datetime.now()
-            global_logger = mp.Queue()
-            global_error_logger = mp.Queue()
-            snapshot_result_error = mp.Queue()
-            snapshot_info_indexer_queue = mp.Queue()
-            time_before_snapshot_start = datetime.datetime.utcnow()
             blobs = paras.blobs
 
             if blobs is not None:
                 # initialize blob_snapshot_info_array
-                mp_jobs = []
+                work_items = []
                 blob_index = 0
+                # a snapshot PUT that has not returned once the freeze could time out is of no use
+                freeze_timeout = self.hutil.get_intvalue_from_configfile('timeout', 60)
+                deadline = time.time() + freeze_timeout
+                concurrency = self.hutil.get_intvalue_from_configfile(CommonVariables.SnapshotConcurrency, CommonVariables.snapshot_concurrency_default)
+                self.logger.log("snapshot concurrency: " + str(concurrency) + " deadline in secs: " + str(freeze_timeout))
                 self.logger.log('****** 5. Snaphotting (Guest-parallel) Started')
                 for blob in blobs:
                     blobUri = blob.split("?")[0]
                     self.logger.log("index: " + str(blob_index) + " blobUri: " + str(blobUri))
                     blob_snapshot_info_array.append(HostSnapshotObjects.BlobSnapshotInfo(False, blobUri, None, 500))
-                    try:
-                        mp_jobs.append(mp.Process(target=self.snapshot,args=(blob, blob_index, paras.wellKnownSettingFlags, paras.backup_metadata, snapshot_result_error, snapshot_info_indexer_queue, global_logger, global_error_logger)))
-                    except Exception as e:
-                        self.logger.log("multiprocess queue creation failed")
-                        all_snapshots_failed = True
-                        raise Exception("Exception while creating multiprocess queue")
-
+                    work_items.append((blob, blob_index, paras.wellKnownSettingFlags, paras.backup_metadata, deadline))
                     blob_index = blob_index + 1
 
-                counter = 0
-                for job in mp_jobs:
-                    job.start()
-                    if(counter == 0):
-                        queue_creation_endtime = datetime.datetime.now()
-                        timediff = queue_creation_endtime - queue_creation_starttime
-                        if(timediff.seconds >= 10):
-                            self.logger.log("mp queue creation took more than 10 secs. Setting next backup to sequential")
-                            set_next_backup_to_seq = True
-                    counter = counter + 1
-
-                for job in mp_jobs:
-                    job.join()
+                task_results = ThreadPool(concurrency).run(self.snapshot, work_items, deadline)
                 self.logger.log('****** 6. Snaphotting (Guest-parallel) Completed')
                 thaw_result = None
                 if g_fsfreeze_on and thaw_done_local == False:
@@ -237,35 +217,45 @@ class GuestSnapshotter(object):
                     time_after_thaw = datetime.datetime.now()
                     HandlerUtil.HandlerUtility.add_to_telemetery_data("ThawTime", str(time_after_thaw-time_before_thaw))
                     thaw_done_local = True
-                    if(set_next_backup_to_seq == True):
-                        self.logger.log("Setting to sequential snapshot")
-                        self.hutil.set_value_to_configfile('seqsnapshot', '1')
                     self.logger.log('T:S thaw result ' + str(thaw_result))
                     if(thaw_result is not None and len(thaw_result.errors) > 0  and (snapshot_result is None or len(snapshot_result.errors) == 0)):
                         is_inconsistent = True
                         snapshot_result.errors.append(thaw_result.errors)
                         return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
                 self.logger.log('end of snapshot process')
-                logging = [global_logger.get() for job in mp_jobs]
-                self.logger.log(str(logging))
-                error_logging = [global_error_logger.get() for job in mp_jobs]
-                self.logger.log(str(error_logging),False,'Error')
-                if not snapshot_result_error.empty():
-                    results = [snapshot_result_error.get() for job in mp_jobs]
-                    for result in results:
-                        if(result.errorcode != CommonVariables.success):
-                            snapshot_result.errors.append(result)
-                if not snapshot_info_indexer_queue.empty():
-                    snapshot_info_indexers = [snapshot_info_indexer_queue.get() for job in mp_jobs]
-                    for snapshot_info_indexer in snapshot_info_indexers:
-                        # update blob_snapshot_info_array element properties from snapshot_info_indexer object
-                        self.get_snapshot_info(snapshot_info_indexer, blob_snapshot_info_array[snapshot_info_indexer.index])
-                        if (blob_snapshot_info_array[snapshot_info_indexer.index].isSuccessful == True):
-                            all_failed = False
-                        self.logger.log("index: " + str(snapshot_info_indexer.index) + " blobSnapshotUri: " + str(blob_snapshot_info_array[snapshot_info_indexer.index].snapshotUri))
+                snapshot_latencies = []
+                for task_result in task_results:
+                    if(task_result.completed == False):
+                        self.logger.log("index: " + str(task_result.index) + " snapshot did not complete before the deadline", False, 'Error')
+                        snapshot_error = SnapshotError()
+                        snapshot_error.errorcode = CommonVariables.error
+                        snapshot_error.sasuri = blobs[task_result.index]
+                        snapshot_result.errors.append(snapshot_error)
+                        snapshot_latencies.append(str(task_result.index) + ":timeout")
+                        continue
+                    snapshot_latencies.append(str(task_result.index) + ":" + str(int(task_result.elapsed * 1000)))
+                    if(task_result.error is not None):
+                        self.logger.log("index: " + str(task_result.index) + " snapshot failed with error: " + str(task_result.error), False, 'Error')
+                        snapshot_error = SnapshotError()
+                        snapshot_error.errorcode = CommonVariables.error
+                        snapshot_error.sasuri = blobs[task_result.index]
+                        snapshot_result.errors.append(snapshot_error)
+                        continue
+                    snapshot_error, snapshot_info_indexer, temp_logger, error_logger = task_result.result
+                    self.logger.log(temp_logger)
+                    if(error_logger != ''):
+                        self.logger.log(error_logger, False, 'Error')
+                    if(snapshot_error.errorcode != CommonVariables.success):
+                        snapshot_result.errors.append(snapshot_error)
+                    # update blob_snapshot_info_array element properties from snapshot_info_indexer object
+                    self.get_snapshot_info(snapshot_info_indexer, blob_snapshot_info_array[snapshot_info_indexer.index])
+                    if (blob_snapshot_info_array[snapshot_info_indexer.index].isSuccessful == True):
+                        all_failed = False
+                    self.logger.log("index: " + str(snapshot_info_indexer.index) + " blobSnapshotUri: " + str(blob_snapshot_info_array[snapshot_info_indexer.index].snapshotUri))
 
-                    all_snapshots_failed = all_failed
-                    self.logger.log("Setting all_snapshots_failed to " + str(all_snapshots_failed))
+                HandlerUtil.HandlerUtility.add_to_telemetery_data(CommonVariables.snapshotLatenciesInMs, ",".join(snapshot_latencies))
+                all_snapshots_failed = all_failed
+                self.logger.log("Setting all_snapshots_failed to " + str(all_snapshots_failed))
 
                 return snapshot_result, blob_snapshot_info_array, all_failed, exceptOccurred, is_inconsistent, thaw_done_local, unable_to_sleep, all_snapshots_failed
             else:
@@ -46,6 +46,7 @@ from parameterparser import ParameterParser
 from Utils import HandlerUtil
 from Utils import SizeCalculation
 from Utils import Status
+from Utils.ConfigCache import ConfigCache
 from freezesnapshotter import FreezeSnapshotter
 from backuplogger import Backuplogger
 from blobwriter import BlobWriter
@@ -109,8 +110,7 @@ def status_report_to_file(file_report_msg):
 
 def status_report_to_blob(blob_report_msg):
     global backup_logger,hutil,para_parser
-    UploadStatusAndLog = hutil.get_strvalue_from_configfile('UploadStatusAndLog','True')        
-    if(UploadStatusAndLog == None or UploadStatusAndLog == 'True'):
+    if hutil.get_boolvalue_from_configfile('UploadStatusAndLog', True):
         try:
             if(para_parser is not None and para_parser.statusBlobUri is not None and para_parser.statusBlobUri != ""):
                 blobWriter = BlobWriter(hutil)
@@ -289,14 +289,10 @@ def daemon():
         if(freezer.mounts is not None):
             hutil.partitioncount = len(freezer.mounts.mounts)
         backup_logger.log(" configfile " + str(configfile), True)
-        config = ConfigParsers.ConfigParser()
-        config.read(configfile)
-        if config.has_option('SnapshotThread','timeout'):
-            thread_timeout= config.get('SnapshotThread','timeout')      
-        if config.has_option('SnapshotThread','OnAppFailureDoFsFreeze'):
-            OnAppFailureDoFsFreeze= config.get('SnapshotThread','OnAppFailureDoFsFreeze')
-        if config.has_option('SnapshotThread','OnAppSuccessDoFsFreeze'):
-            OnAppSuccessDoFsFreeze= config.get('SnapshotThread','OnAppSuccessDoFsFreeze')
+        config = ConfigCache.get_instance(configfile)
+        thread_timeout = config.get_str('timeout', thread_timeout)
+        OnAppFailureDoFsFreeze = config.get_bool('OnAppFailureDoFsFreeze', OnAppFailureDoFsFreeze)
+        OnAppSuccessDoFsFreeze = config.get_bool('OnAppSuccessDoFsFreeze', OnAppSuccessDoFsFreeze)
     except Exception as e:
         errMsg='cannot read config file or file not present'
         backup_logger.log(errMsg, True, 'Warning')
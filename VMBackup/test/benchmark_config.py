@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the vmbackup.conf lookup done on every HandlerUtility.log call,
+# before (new ConfigParser per call) and after (ConfigCache).
+#
+# python test/benchmark_config.py [iterations]
+
+import os
+import sys
+import tempfile
+import timeit
+try:
+    import ConfigParser as ConfigParsers
+except ImportError:
+    import configparser as ConfigParsers
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+from Utils.ConfigCache import ConfigCache
+
+sample_config = """[SnapshotThread]
+seqsnapshot = 1
+isanysnapshotfailed = False
+UploadStatusAndLog = True
+WriteLog = True
+onlyLocalFilesystems = True
+timeout = 60
+"""
+
+def uncached_lookup(configfile, key):
+    value = None
+    if os.path.exists(configfile):
+        config = ConfigParsers.ConfigParser()
+        config.read(configfile)
+        if config.has_option('SnapshotThread', key):
+            value = config.get('SnapshotThread', key)
+    return value
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    configfile = os.path.join(tempfile.mkdtemp(), 'vmbackup.conf')
+    with open(configfile, 'w') as f:
+        f.write(sample_config)
+    cache = ConfigCache.get_instance(configfile)
+
+    before = timeit.timeit(lambda: uncached_lookup(configfile, 'WriteLog'), number = iterations)
+    after = timeit.timeit(lambda: cache.get_bool('WriteLog', True), number = iterations)
+
+    print("iterations            : {0}".format(iterations))
+    print("per call, uncached    : {0:.2f} us".format(before * 1e6 / iterations))
+    print("per call, ConfigCache : {0:.2f} us".format(after * 1e6 / iterations))
+    print("speedup               : {0:.1f}x".format(before / after))
+    print("config file parses    : {0}".format(cache.load_count))
+    os.remove(configfile)
+
+if __name__ == '__main__':
+    main()
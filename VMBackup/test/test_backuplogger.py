@@ -0,0 +1,66 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+import backuplogger
+from Utils.HandlerUtil import HandlerContext, HandlerUtility
+from Utils.LogBuffer import LogBuffer
+
+
+class FakeConsoleWriter(object):
+    def write(self, msg):
+        pass
+
+    def flush(self):
+        pass
+
+
+class BackuploggerTest(unittest.TestCase):
+    """ the freeze markers must survive in the log uploaded to the log blob """
+    buffer_size = 4096
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.hutil = HandlerUtility(lambda msg: None, lambda msg: None, 'VMSnapshotLinux')
+        self.hutil._context = HandlerContext('VMSnapshotLinux')
+        self.hutil._context._shell_log_file = os.path.join(self.directory, 'shell.log')
+        self.hutil.logging_file = os.path.join(self.directory, 'extension.log')
+        self.hutil.log_message = LogBuffer(self.buffer_size)
+        self.logger = backuplogger.Backuplogger(self.hutil)
+        self.logger.con_writer = FakeConsoleWriter()
+        self.logger.msg = LogBuffer(self.buffer_size)
+        self.uploaded = []
+        self.write_blob = backuplogger.BlobWriter.WriteBlob
+        backuplogger.BlobWriter.WriteBlob = lambda blob_writer, msg, blob_uri: self.uploaded.append(msg)
+
+    def tearDown(self):
+        backuplogger.BlobWriter.WriteBlob = self.write_blob
+        self.hutil.flush_log()
+        shutil.rmtree(self.directory)
+
+    def test_freeze_markers_survive_overflow(self):
+        self.logger.log('before freeze')
+        self.logger.enforce_local_flag(False)
+        for i in range(200):
+            self.logger.log('while frozen {0}'.format(i))
+        self.logger.enforce_local_flag(True)
+        for i in range(200):
+            self.logger.log('after thaw {0}'.format(i))
+        self.logger.commit('https://account.blob.core.windows.net/container/log?sas')
+
+        self.assertEqual(1, len(self.uploaded))
+        log = self.uploaded[0]
+        start = log.find('Logs during Freeze Start')
+        end = log.find('Logs during Freeze End')
+        self.assertTrue(0 <= start < end)
+        self.assertFalse('before freeze' in log)
+        self.assertTrue('after thaw 199' in log)
+        self.assertTrue('bytes of older logs dropped' in log)
+
+
+if __name__ == '__main__':
+    unittest.main()
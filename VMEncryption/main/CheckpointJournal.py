@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import os.path
+import struct
+import zlib
+
+from SliceCopier import fsync_directory
+
+
+class CheckpointJournal(object):
+    """
+    Append only journal of the progress of a TransactionalCopyTask.
+    Every record is (slice_index, pending_count): the slices before slice_index are
+    copied, and when pending_count is not zero the next pending_count slices are being
+    copied, so their backup file may be the only intact copy of them.
+    Records are fixed size and carry a crc32, a torn record at the end is ignored.
+    The header identifies the copy the journal belongs to, a journal left behind by
+    another copy is ignored. Once the journal holds compact_records records it is
+    rewritten with the last one.
+    """
+    Magic = b'ADEJ'
+    Version = 1
+    Header = struct.Struct('<4sII')
+    Record = struct.Struct('<QQI')
+    RecordData = struct.Struct('<QQ')
+
+    def __init__(self, path, identity, compact_records=4096):
+        self.path = path
+        self.identity = zlib.crc32(identity.encode('utf-8')) & 0xffffffff
+        self.compact_records = compact_records
+        self.fd = None
+        self.records = 0
+
+    def load(self):
+        """
+        returns the last (slice_index, pending_count) of this copy, or None.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if len(data) < self.Header.size:
+            return None
+        magic, version, identity = self.Header.unpack_from(data, 0)
+        if magic != self.Magic or version != self.Version or identity != self.identity:
+            return None
+        last = None
+        offset = self.Header.size
+        while offset + self.Record.size <= len(data):
+            slice_index, pending_count, crc = self.Record.unpack_from(data, offset)
+            if crc != self._crc(slice_index, pending_count):
+                break
+            last = (slice_index, pending_count)
+            offset += self.Record.size
+        return last
+
+    def append(self, slice_index, pending_count):
+        if self.fd is None or self.records >= self.compact_records:
+            self._rewrite(slice_index, pending_count)
+            return
+        os.write(self.fd, self._pack(slice_index, pending_count))
+        self._sync()
+        self.records += 1
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+            fsync_directory(os.path.dirname(self.path))
+
+    def _rewrite(self, slice_index, pending_count):
+        """
+        start a new journal with a single record, it replaces the old one atomically.
+        """
+        self.close()
+        temp_path = self.path + '.tmp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, self.Header.pack(self.Magic, self.Version, self.identity) +
+                     self._pack(slice_index, pending_count))
+            os.fsync(fd)
+        except:
+            os.close(fd)
+            raise
+        os.rename(temp_path, self.path)
+        fsync_directory(os.path.dirname(self.path))
+        self.fd = fd
+        self.records = 1
+
+    def _sync(self):
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self.fd)
+        else:
+            os.fsync(self.fd)
+
+    def _crc(self, slice_index, pending_count):
+        return zlib.crc32(self.RecordData.pack(slice_index, pending_count)) & 0xffffffff
+
+    def _pack(self, slice_index, pending_count):
+        return self.Record.pack(slice_index, pending_count, self._crc(slice_index, pending_count))
@@ -19,21 +19,155 @@
 # Requires Python 2.7+
 #
 
+import collections
+import errno
+import heapq
+import itertools
 import os
 import os.path
+import select
 import shlex
 import sys
+import threading
+import time
 
 from subprocess import *
-from threading import Timer
 
 class ProcessCommunicator(object):
     def __init__(self):
         self.stdout = None
         self.stderr = None
 
+class OutputRingBuffer(object):
+    """
+    Keeps the last max_size bytes written to it, the older ones are dropped.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.chunks = collections.deque()
+        self.size = 0
+        self.dropped = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size > self.max_size:
+            excess = self.size - self.max_size
+            head = self.chunks[0]
+            if len(head) <= excess:
+                self.chunks.popleft()
+                dropped = len(head)
+            else:
+                self.chunks[0] = head[excess:]
+                dropped = excess
+            self.size -= dropped
+            self.dropped += dropped
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+class TimeoutScheduler(object):
+    """
+    Runs the timeouts of all the commands on a single daemon thread, which is started
+    with the first timeout. The pending deadlines are kept in a heap, a cancelled
+    timeout is dropped when it reaches the top.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.deadlines = []
+        self.cancelled = set()
+        self.counter = itertools.count()
+        self.thread = None
+
+    def schedule(self, delay, callback):
+        with self.condition:
+            handle = next(self.counter)
+            heapq.heappush(self.deadlines, (time.time() + delay, handle, callback))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='CommandTimeouts')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        return handle
+
+    def cancel(self, handle):
+        with self.condition:
+            if any(pending == handle for deadline, pending, callback in self.deadlines):
+                self.cancelled.add(handle)
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    while self.deadlines and self.deadlines[0][1] in self.cancelled:
+                        self.cancelled.discard(heapq.heappop(self.deadlines)[1])
+                    if not self.deadlines:
+                        self.condition.wait()
+                        continue
+                    delay = self.deadlines[0][0] - time.time()
+                    if delay <= 0:
+                        deadline, handle, callback = heapq.heappop(self.deadlines)
+                        break
+                    self.condition.wait(delay)
+            try:
+                callback()
+            except Exception:
+                pass
+
+class CommandTimingLedger(object):
+    """
+    Number of runs, failures, wall and cpu time of the external commands, per tool.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def record(self, tool, wall_time, cpu_time, return_code):
+        with self.lock:
+            entry = self.entries.setdefault(tool, {'count': 0,
+                                                   'failures': 0,
+                                                   'wall_time': 0.0,
+                                                   'max_wall_time': 0.0,
+                                                   'cpu_time': 0.0})
+            entry['count'] += 1
+            if return_code != 0:
+                entry['failures'] += 1
+            entry['wall_time'] += wall_time
+            entry['max_wall_time'] = max(entry['max_wall_time'], wall_time)
+            entry['cpu_time'] += cpu_time
+
+    def get_entry(self, tool):
+        with self.lock:
+            entry = self.entries.get(tool)
+            return dict(entry) if entry is not None else None
+
+    def summary(self, max_tools=10):
+        """
+        the tools which took the most wall time, like
+        "cryptsetup: 4 runs, 0 failed, wall 12.31s (max 9.02s), cpu 3.10s; ..."
+        """
+        with self.lock:
+            entries = sorted(self.entries.items(), key=lambda item: item[1]['wall_time'], reverse=True)
+        return '; '.join("{0}: {1} runs, {2} failed, wall {3:.2f}s (max {4:.2f}s), cpu {5:.2f}s".format(
+            tool, entry['count'], entry['failures'], entry['wall_time'], entry['max_wall_time'], entry['cpu_time'])
+            for tool, entry in entries[:max_tools])
+
+    def reset(self):
+        with self.lock:
+            self.entries = {}
+
 class CommandExecutor(object):
-    """description of class"""
+    """
+    Runs external commands. Their output is streamed into ring buffers of output_buffer_size
+    bytes, so a chatty command keeps the tail of its output only, and every run is recorded
+    into the timing_ledger shared by all the executors.
+    """
+    output_buffer_size = 1024 * 1024
+    read_size = 65536
+    timeouts = TimeoutScheduler()
+    timing_ledger = CommandTimingLedger()
+
     def __init__(self, logger):
         self.logger = logger
 
@@ -44,13 +178,17 @@ class CommandExecutor(object):
         if not suppress_logging:
             self.logger.log("Executing: {0}".format(command_to_execute))
         args = shlex.split(command_to_execute)
+        tool = self.get_tool_name(args)
         proc = None
         timer = None
         return_code = None
+        cpu_time = 0.0
+        start_time = time.time()
 
         try:
             proc = Popen(args, stdout=PIPE, stderr=PIPE, stdin=PIPE, close_fds=True)
         except Exception as e:
+            CommandExecutor.timing_ledger.record(tool, time.time() - start_time, 0.0, -1)
             if raise_exception_on_failure:
                 raise
             else:
@@ -58,25 +196,43 @@ class CommandExecutor(object):
                     self.logger.log("Process creation failed: " + str(e))
                 return -1
 
+        # the process must not be killed once it is reaped, its pid may be reused.
+        # wait_process reaps it and sets reaped while holding reaped_lock
+        reaped = [False]
+        reaped_lock = threading.Lock()
+
         def timeout_process():
-            proc.kill()
+            with reaped_lock:
+                if reaped[0]:
+                    return
+                proc.kill()
             self.logger.log("Command {0} didn't finish in {1} seconds. Timing it out".format(command_to_execute, timeout))
 
         try:
             if timeout>0:
-                timer = Timer(timeout, timeout_process)
-                timer.start()
-            stdout, stderr = proc.communicate(input=input)
+                timer = CommandExecutor.timeouts.schedule(timeout, timeout_process)
+            stdout_buffer, stderr_buffer = self.stream_output(proc, input)
+            return_code, cpu_time = self.wait_process(proc, reaped, reaped_lock)
         finally:
             if timer is not None:
-                timer.cancel()
-            return_code = proc.returncode
+                CommandExecutor.timeouts.cancel(timer)
+            if return_code is None:
+                return_code = proc.returncode
+
+        wall_time = time.time() - start_time
+        CommandExecutor.timing_ledger.record(tool, wall_time, cpu_time, return_code)
+
+        stdout, stderr = stdout_buffer.getvalue(), stderr_buffer.getvalue()
+        for name, output_buffer in (('stdout', stdout_buffer), ('stderr', stderr_buffer)):
+            if output_buffer.dropped and not suppress_logging:
+                self.logger.log("Command {0} wrote more than {1} bytes to {2}, the first {3} bytes were dropped".format(
+                    command_to_execute, output_buffer.max_size, name, output_buffer.dropped))
 
         if isinstance(communicator, ProcessCommunicator):
             communicator.stdout, communicator.stderr = stdout, stderr
 
         if int(return_code) != 0:
-            msg = "Command {0} failed with return code {1}".format(command_to_execute, return_code)
+            msg = "Command {0} failed with return code {1} after {2:.2f} seconds".format(command_to_execute, return_code, wall_time)
             msg += "\nstdout:\n" + stdout
             msg += "\nstderr:\n" + stderr
 
@@ -87,7 +243,104 @@ class CommandExecutor(object):
                 raise Exception(msg)
 
         return return_code
-    
+
+    def stream_output(self, proc, input):
+        """
+        writes input to the process and reads its stdout and stderr until both are closed.
+        """
+        stdout_buffer = OutputRingBuffer(self.output_buffer_size)
+        stderr_buffer = OutputRingBuffer(self.output_buffer_size)
+        buffers = {proc.stdout.fileno(): stdout_buffer,
+                   proc.stderr.fileno(): stderr_buffer}
+        poller = select.poll()
+        for fd in buffers:
+            poller.register(fd, select.POLLIN | select.POLLPRI)
+        open_fds = set(buffers)
+
+        stdin_fd = proc.stdin.fileno()
+        pending_input = input or b''
+        if pending_input:
+            poller.register(stdin_fd, select.POLLOUT)
+        else:
+            proc.stdin.close()
+
+        while open_fds or pending_input:
+            try:
+                events = poller.poll()
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                if fd == stdin_fd:
+                    try:
+                        written = os.write(fd, pending_input[:select.PIPE_BUF])
+                    except OSError as e:
+                        if e.errno != errno.EPIPE:
+                            raise
+                        # the process does not read its input anymore
+                        written = len(pending_input)
+                    pending_input = pending_input[written:]
+                    if not pending_input:
+                        poller.unregister(fd)
+                        proc.stdin.close()
+                else:
+                    data = os.read(fd, self.read_size)
+                    if data:
+                        buffers[fd].write(data)
+                    else:
+                        poller.unregister(fd)
+                        open_fds.discard(fd)
+
+        proc.stdout.close()
+        proc.stderr.close()
+        return stdout_buffer, stderr_buffer
+
+    def wait_process(self, proc, reaped, reaped_lock):
+        """
+        reaps the process, returns its return code like Popen does and the cpu time it used.
+        a blocking wait would reap the process before reaped can be set, and python 2 has no
+        waitid(WNOWAIT), so the process is polled and reaped without blocking under reaped_lock.
+        it usually exits as soon as it closed its output, the first poll finds it.
+        """
+        delay = 0.001
+        while True:
+            try:
+                with reaped_lock:
+                    pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+                    if pid != 0:
+                        reaped[0] = True
+                        break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        return proc.returncode, rusage.ru_utime + rusage.ru_stime
+
+    @staticmethod
+    def get_tool_name(args):
+        """
+        the name the run is recorded under in the timing ledger, the first command of the script
+        for a bash -c run.
+        """
+        if not args:
+            return ''
+        tool = os.path.basename(args[0])
+        if tool in ('bash', 'sh') and len(args) > 2 and args[1] == '-c':
+            script = args[2]
+            if script.startswith('set -e; '):
+                script = script[len('set -e; '):]
+            words = script.split()
+            if words:
+                tool = os.path.basename(words[0])
+        return tool
+
     def ExecuteInBash(self, command_to_execute, raise_exception_on_failure=False, communicator=None, input=None, suppress_logging=False):
         command_to_execute = 'bash -c "{0}{1}"'.format('set -e; ' if raise_exception_on_failure else '',
                                                       command_to_execute)
@@ -33,6 +33,11 @@ class CommonVariables:
     sector_size = 512
     luks_header_size = 4096 * 512
     default_block_size = 52428800
+    copy_buffer_max_size = 268435456
+    copy_batch_target_seconds = 5
+    copy_commit_interval = 60
+    copy_status_report_interval = 60
+    inplace_encryption_max_concurrency = 4
     min_filesystem_size_support = 52428800 * 3
     #TODO for the sles 11, we should use the ext3
     default_file_system = 'ext4'
@@ -71,6 +76,12 @@ class CommonVariables:
     SecretUriKey = 'SecretUri'
     SecretSeqNum = 'SecretSeqNum'
 
+    """
+    devices encrypted in place at the same time, and their combined bandwidth limit in MB/s, 0 for no limit
+    """
+    InPlaceEncryptionMaxConcurrencyKey = 'InPlaceEncryptionMaxConcurrency'
+    InPlaceEncryptionBandwidthLimitKey = 'InPlaceEncryptionBandwidthLimitMBps'
+
     VolumeTypeOS = 'OS'
     VolumeTypeData = 'Data'
     VolumeTypeAll = 'All'
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class DiskTopology(object):
+    """
+    Snapshot of the block devices and the mounts of the machine with O(1) lookups by name,
+    mount point, uuid, maj:min and azure scsi id.
+    DiskUtil builds it once from a single lsblk and lvs run, sysfs and the udev symlinks,
+    and drops it after every operation which changes the devices or the mounts.
+    """
+    def __init__(self, device_items, parents, mount_items, lvm_items, scsi_ids):
+        """
+        parents maps the maj:min of a device to the maj:min of the devices it is built on,
+        the partitioned disk or the slaves of a device mapper or raid device.
+        scsi_ids maps the maj:min of a device to its scsi id under /dev/disk/azure, like scsi1/lun0.
+        """
+        self.device_items = device_items
+        self.mount_items = mount_items
+        self.lvm_items = lvm_items
+        self.ide_devices = None
+        self.by_name = {}
+        self.by_mount_point = {}
+        self.by_uuid = {}
+        self.by_majmin = {}
+        self.by_scsi_id = {}
+        self.children = {}
+
+        for device_item in device_items:
+            self.by_name.setdefault(device_item.name, device_item)
+            self.by_majmin.setdefault(device_item.majmin, device_item)
+            if device_item.mount_point:
+                self.by_mount_point[device_item.mount_point] = device_item
+            if device_item.uuid:
+                self.by_uuid.setdefault(device_item.uuid, device_item)
+
+        for majmin in sorted(parents):
+            for parent_majmin in parents[majmin]:
+                self.children.setdefault(parent_majmin, []).append(majmin)
+
+        for majmin, scsi_id in scsi_ids.items():
+            if majmin in self.by_majmin:
+                self.by_scsi_id[scsi_id] = self.by_majmin[majmin]
+
+    def get_device_item(self, name):
+        return self.by_name.get(name)
+
+    def get_device_item_by_mount_point(self, mount_point):
+        return self.by_mount_point.get(mount_point)
+
+    def get_device_item_by_uuid(self, uuid):
+        return self.by_uuid.get(uuid)
+
+    def get_device_item_by_majmin(self, majmin):
+        return self.by_majmin.get(majmin)
+
+    def get_device_item_by_scsi_id(self, scsi_id):
+        return self.by_scsi_id.get(scsi_id)
+
+    def get_device_tree(self, majmin):
+        """
+        the device and everything built on it, like lsblk lists them for a device path.
+        """
+        device_items = []
+        pending = [majmin]
+        while pending:
+            current = pending.pop()
+            if current in self.by_majmin:
+                device_items.append(self.by_majmin[current])
+            pending.extend(reversed(self.children.get(current, [])))
+        return device_items
+
+    def is_lvm_member(self, majmin):
+        """
+        whether logical volumes are built on the device, i.e. it is an active lvm physical volume.
+        """
+        return any(self.by_majmin[child].type == 'lvm'
+                   for child in self.children.get(majmin, []) if child in self.by_majmin)
@@ -21,6 +21,8 @@ import json
 import os
 import os.path
 import re
+import stat
+import threading
 from subprocess import Popen
 import shutil
 import traceback
@@ -32,6 +34,7 @@ from EncryptionConfig import EncryptionConfig
 from DecryptionMarkConfig import DecryptionMarkConfig
 from EncryptionMarkConfig import EncryptionMarkConfig
 from TransactionalCopyTask import TransactionalCopyTask
+from DiskTopology import DiskTopology
 from CommandExecutor import CommandExecutor, ProcessCommunicator
 from Common import CommonVariables, CryptItem, LvmItem, DeviceItem
 
@@ -48,17 +51,23 @@ class DiskUtil(object):
         self.logger = logger
         self.ide_class_id = "{32412632-86cb-44a2-9b5c-50d1417354f5}"
         self.vmbus_sys_path = '/sys/bus/vmbus/devices'
+        self.topology = None
+        self.topology_generation = 0
+        self.topology_lock = threading.Lock()
 
         self.command_executor = CommandExecutor(self.logger)
 
-    def copy(self, ongoing_item_config, status_prefix=''):
+    def copy(self, ongoing_item_config, status_prefix='', bandwidth_limiter=None, progress_callback=None, concurrent_copies=1):
         copy_task = TransactionalCopyTask(logger=self.logger,
                                           disk_util=self,
                                           hutil=self.hutil,
                                           ongoing_item_config=ongoing_item_config,
                                           patching=self.distro_patcher,
-                                          encryption_environment=self.encryption_environment,
-                                          status_prefix=status_prefix)
+                                          encryption_environment=ongoing_item_config.encryption_environment,
+                                          status_prefix=status_prefix,
+                                          bandwidth_limiter=bandwidth_limiter,
+                                          progress_callback=progress_callback,
+                                          concurrent_copies=concurrent_copies)
         try:
             mem_fs_result = copy_task.prepare_mem_fs()
             if mem_fs_result != CommonVariables.process_success:
@@ -70,13 +79,17 @@ class DiskUtil(object):
             self.logger.log(msg=message, level=CommonVariables.ErrorLevel)
         finally:
             copy_task.clear_mem_fs()
+            # the file systems and luks headers on the devices changed
+            self.invalidate_topology()
 
     def format_disk(self, dev_path, file_system):
         mkfs_command = ""
         if file_system in CommonVariables.format_supported_file_systems:
             mkfs_command = "mkfs." + file_system
         mkfs_cmd = "{0} {1}".format(mkfs_command, dev_path)
-        return self.command_executor.Execute(mkfs_cmd)
+        result = self.command_executor.Execute(mkfs_cmd)
+        self.invalidate_topology()
+        return result
 
     def make_sure_path_exists(self, path):
         mkdir_cmd = self.distro_patcher.mkdir_path + ' -p ' + path
@@ -437,14 +450,18 @@ class DiskUtil(object):
             passphrase = proc_comm.stdout
 
             cryptsetup_cmd = "{0} luksFormat {1} -q".format(self.distro_patcher.cryptsetup_path, dev_path)
-            return self.command_executor.Execute(cryptsetup_cmd, input=passphrase)
+            result = self.command_executor.Execute(cryptsetup_cmd, input=passphrase)
+            self.invalidate_topology()
+            return result
         else:
             if header_file is not None:
                 cryptsetup_cmd = "{0} luksFormat {1} --header {2} -d {3} -q".format(self.distro_patcher.cryptsetup_path, dev_path, header_file, passphrase_file)
             else:
                 cryptsetup_cmd = "{0} luksFormat {1} -d {2} -q".format(self.distro_patcher.cryptsetup_path, dev_path, passphrase_file)
             
-            return self.command_executor.Execute(cryptsetup_cmd)
+            result = self.command_executor.Execute(cryptsetup_cmd)
+            self.invalidate_topology()
+            return result
         
     def luks_add_key(self, passphrase_file, dev_path, mapper_name, header_file, new_key_path):
         """
@@ -530,7 +547,9 @@ class DiskUtil(object):
         else:
             cryptsetup_cmd = "{0} luksOpen {1} {2} -d {3} -q".format(self.distro_patcher.cryptsetup_path, dev_path, mapper_name, passphrase_file)
 
-        return self.command_executor.Execute(cryptsetup_cmd)
+        result = self.command_executor.Execute(cryptsetup_cmd)
+        self.invalidate_topology()
+        return result
 
     def luks_close(self, mapper_name):
         """
@@ -539,7 +558,9 @@ class DiskUtil(object):
         self.hutil.log("dev mapper name to cryptsetup luksOpen " + (mapper_name))
         cryptsetup_cmd = "{0} luksClose {1} -q".format(self.distro_patcher.cryptsetup_path, mapper_name)
 
-        return self.command_executor.Execute(cryptsetup_cmd)
+        result = self.command_executor.Execute(cryptsetup_cmd)
+        self.invalidate_topology()
+        return result
 
     # TODO error handling.
     def append_mount_info(self, dev_path, mount_point):
@@ -713,14 +734,18 @@ class DiskUtil(object):
         """
         self.make_sure_path_exists(mount_point)
         mount_cmd = self.distro_patcher.mount_path + ' -L "' + bek_label + '" ' + mount_point + ' -o ' + option_string
-        return self.command_executor.Execute(mount_cmd)
+        result = self.command_executor.Execute(mount_cmd)
+        self.invalidate_topology()
+        return result
 
     def mount_auto(self, dev_path_or_mount_point):
         """
         mount the file system via fstab entry
         """
         mount_cmd = self.distro_patcher.mount_path + ' ' + dev_path_or_mount_point
-        return self.command_executor.Execute(mount_cmd)
+        result = self.command_executor.Execute(mount_cmd)
+        self.invalidate_topology()
+        return result
 
     def mount_filesystem(self, dev_path, mount_point, file_system=None):
         """
@@ -732,7 +757,9 @@ class DiskUtil(object):
         else: 
             mount_cmd = self.distro_patcher.mount_path + ' ' + dev_path + ' ' + mount_point + ' -t ' + file_system
 
-        return self.command_executor.Execute(mount_cmd)
+        result = self.command_executor.Execute(mount_cmd)
+        self.invalidate_topology()
+        return result
 
     def mount_crypt_item(self, crypt_item, passphrase):
         self.logger.log("trying to mount the crypt item:" + str(crypt_item))
@@ -748,7 +775,9 @@ class DiskUtil(object):
 
     def umount(self, path):
         umount_cmd = self.distro_patcher.umount_path + ' ' + path
-        return self.command_executor.Execute(umount_cmd)
+        result = self.command_executor.Execute(umount_cmd)
+        self.invalidate_topology()
+        return result
 
     def umount_all_crypt_items(self):
         for crypt_item in self.get_crypt_items():
@@ -757,7 +786,9 @@ class DiskUtil(object):
 
     def mount_all(self):
         mount_all_cmd = self.distro_patcher.mount_path + ' -a'
-        return self.command_executor.Execute(mount_all_cmd)
+        result = self.command_executor.Execute(mount_all_cmd)
+        self.invalidate_topology()
+        return result
 
     def get_mount_items(self):
         items = []
@@ -779,27 +810,26 @@ class DiskUtil(object):
             "os": "NotEncrypted"
         }
 
-        mount_items = self.get_mount_items()
-        device_items = self.get_device_items(None)
-        device_items_dict = dict([(device_item.mount_point, device_item) for device_item in device_items])
+        topology = self.get_topology()
+        mount_items = topology.mount_items
 
         os_drive_encrypted = False
         data_drives_found = False
         all_data_drives_encrypted = True
 
         osmapper_path = os.path.join(CommonVariables.dev_mapper_root, CommonVariables.osmapper_name)
+        os_disk_lvm = self.is_os_disk_lvm()
 
-        if self.is_os_disk_lvm():
-            grep_result = self.command_executor.ExecuteInBash('pvdisplay | grep {0}'.format(osmapper_path),
-                                                              suppress_logging=True)
-            if grep_result == 0 and not os.path.exists('/volumes.lvm'):
+        if os_disk_lvm:
+            osmapper_item = topology.get_device_item(CommonVariables.osmapper_name)
+            if osmapper_item is not None and topology.is_lvm_member(osmapper_item.majmin) and not os.path.exists('/volumes.lvm'):
                 self.logger.log("OS PV is encrypted")
                 os_drive_encrypted = True
 
         special_azure_devices_to_skip = self.get_azure_devices()
 
         for mount_item in mount_items:
-            device_item = device_items_dict.get(mount_item["dest"])
+            device_item = topology.get_device_item_by_mount_point(mount_item["dest"])
 
             if device_item is not None and \
                mount_item["fs"] in CommonVariables.format_supported_file_systems and \
@@ -811,7 +841,7 @@ class DiskUtil(object):
                     all_data_drives_encrypted = False
 
             if mount_item["dest"] == "/" and \
-               not self.is_os_disk_lvm() and \
+               not os_disk_lvm and \
                CommonVariables.dev_mapper_root in mount_item["src"] or \
                "/dev/dm" in mount_item["src"]:
                 self.logger.log("OS volume {0} is mounted from {1}".format(mount_item["dest"], mount_item["src"]))
@@ -1066,76 +1096,179 @@ class DiskUtil(object):
 
         return device_items_to_return
 
-    def get_device_items(self, dev_path):
+    def get_topology(self):
+        """
+        the snapshot is built on first use, the operations changing the devices or the mounts drop it
+        once their command returned, a snapshot taken while the command ran may not show its change.
+        the copy threads of the encryption scheduler build it without the scheduler lock while another
+        pipeline changes the devices, so a snapshot is only kept when no invalidation happened while
+        it was built, it may have missed that change.
+        """
+        with self.topology_lock:
+            topology = self.topology
+            generation = self.topology_generation
+        if topology is None:
+            topology = self.build_topology()
+            with self.topology_lock:
+                if generation == self.topology_generation:
+                    self.topology = topology
+        return topology
+
+    def invalidate_topology(self):
+        with self.topology_lock:
+            self.topology = None
+            self.topology_generation += 1
+
+    def build_topology(self):
+        lvm_items = self.get_lvm_items()
         if self.distro_patcher.distro_info[0].lower() == 'suse' and self.distro_patcher.distro_info[1] == '11':
-            return self.get_device_items_sles(dev_path)
+            device_items = self.get_device_items_sles(None)
         else:
-            if dev_path:
-                self.logger.log(msg=("getting blk info for: " + str(dev_path)))
+            device_items = self.query_device_items(None, lvm_items=lvm_items)
 
-            if dev_path is None:
-                lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN'
-            else:
-                lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN ' + dev_path
-            
-            proc_comm = ProcessCommunicator()
-            self.command_executor.Execute(lsblk_command, communicator=proc_comm, raise_exception_on_failure=True, suppress_logging=True)
-            
-            device_items = []
+        parents = {}
+        for device_item in device_items:
+            if device_item.majmin and device_item.majmin not in parents:
+                parents[device_item.majmin] = self.get_sysfs_parents(device_item.majmin)
+
+        scsi_ids = {}
+        for device_path, symlink in self.get_block_device_to_azure_udev_table().items():
+            majmin = self.get_device_majmin(device_path)
+            if majmin is not None:
+                scsi_ids[majmin] = os.path.relpath(symlink, CommonVariables.azure_symlinks_dir)
+
+        return DiskTopology(device_items=device_items,
+                            parents=parents,
+                            mount_items=self.get_mount_items(),
+                            lvm_items=lvm_items,
+                            scsi_ids=scsi_ids)
+
+    def get_device_majmin(self, dev_path):
+        try:
+            dev_stat = os.stat(dev_path)
+        except OSError:
+            return None
+        if not stat.S_ISBLK(dev_stat.st_mode):
+            return None
+        return "{0}:{1}".format(os.major(dev_stat.st_rdev), os.minor(dev_stat.st_rdev))
+
+    def get_sysfs_parents(self, majmin):
+        """
+        the maj:min of the disk of a partition, or of the slaves of a device mapper or raid device.
+        """
+        sys_path = os.path.realpath(os.path.join('/sys/dev/block', majmin))
+        parent_paths = []
+        if os.path.exists(os.path.join(sys_path, 'partition')):
+            parent_paths.append(os.path.dirname(sys_path))
+        slaves_path = os.path.join(sys_path, 'slaves')
+        if os.path.isdir(slaves_path):
+            parent_paths.extend(os.path.realpath(os.path.join(slaves_path, slave)) for slave in sorted(os.listdir(slaves_path)))
+
+        parents = []
+        for parent_path in parent_paths:
+            try:
+                with open(os.path.join(parent_path, 'dev')) as f:
+                    parents.append(f.read().strip())
+            except IOError:
+                self.logger.log(msg="no block device found at {0}".format(parent_path), level=CommonVariables.WarningLevel)
+        return parents
+
+    def get_sysfs_device_id(self, majmin):
+        """
+        the device_id of the vmbus device the block device is on, which udevadm reports as ATTRS{device_id}.
+        """
+        sys_path = os.path.realpath(os.path.join('/sys/dev/block', majmin))
+        while sys_path.startswith('/sys/devices/'):
+            device_id_path = os.path.join(sys_path, 'device_id')
+            if os.path.isfile(device_id_path):
+                with open(device_id_path) as f:
+                    match = re.findall(r'{(.*)}', f.read().strip())
+                return match[0] if match else ""
+            sys_path = os.path.dirname(sys_path)
+        return ""
+
+    def get_device_items(self, dev_path):
+        """
+        the devices come from the topology snapshot, the device at dev_path is listed with everything built on it.
+        """
+        topology = self.get_topology()
+        if dev_path is None:
+            return list(topology.device_items)
+
+        self.logger.log(msg=("getting blk info for: " + str(dev_path)))
+        majmin = self.get_device_majmin(dev_path)
+        if majmin is None or topology.get_device_item_by_majmin(majmin) is None:
+            if self.distro_patcher.distro_info[0].lower() == 'suse' and self.distro_patcher.distro_info[1] == '11':
+                return self.get_device_items_sles(dev_path)
+            return self.query_device_items(dev_path)
+        return topology.get_device_tree(majmin)
+
+    def query_device_items(self, dev_path, lvm_items=None):
+        if dev_path is None:
+            lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN'
+        else:
+            lsblk_command = 'lsblk -b -n -P -o NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE,MAJ:MIN ' + dev_path
+        
+        proc_comm = ProcessCommunicator()
+        self.command_executor.Execute(lsblk_command, communicator=proc_comm, raise_exception_on_failure=True, suppress_logging=True)
+        
+        device_items = []
+        if lvm_items is None:
             lvm_items = self.get_lvm_items()
-            for line in proc_comm.stdout.splitlines():
-                if line:
-                    device_item = DeviceItem()
+        azure_symlinks = self.get_azure_symlinks()
+        for line in proc_comm.stdout.splitlines():
+            if line:
+                device_item = DeviceItem()
 
-                    for disk_info_property in line.split():
-                        property_item_pair = disk_info_property.split('=')
-                        if property_item_pair[0] == 'SIZE':
-                            device_item.size = int(property_item_pair[1].strip('"'))
+                for disk_info_property in line.split():
+                    property_item_pair = disk_info_property.split('=')
+                    if property_item_pair[0] == 'SIZE':
+                        device_item.size = int(property_item_pair[1].strip('"'))
 
-                        if property_item_pair[0] == 'NAME':
-                            device_item.name = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'NAME':
+                        device_item.name = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'TYPE':
-                            device_item.type = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'TYPE':
+                        device_item.type = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'FSTYPE':
-                            device_item.file_system = property_item_pair[1].strip('"')
-                        
-                        if property_item_pair[0] == 'MOUNTPOINT':
-                            device_item.mount_point = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'FSTYPE':
+                        device_item.file_system = property_item_pair[1].strip('"')
+                    
+                    if property_item_pair[0] == 'MOUNTPOINT':
+                        device_item.mount_point = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'LABEL':
-                            device_item.label = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'LABEL':
+                        device_item.label = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'UUID':
-                            device_item.uuid = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'UUID':
+                        device_item.uuid = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'MODEL':
-                            device_item.model = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'MODEL':
+                        device_item.model = property_item_pair[1].strip('"')
 
-                        if property_item_pair[0] == 'MAJ:MIN':
-                            device_item.majmin = property_item_pair[1].strip('"')
+                    if property_item_pair[0] == 'MAJ:MIN':
+                        device_item.majmin = property_item_pair[1].strip('"')
 
-                    device_item.device_id = self.get_device_id(self.get_device_path(device_item.name))
+                device_item.device_id = self.get_sysfs_device_id(device_item.majmin) if device_item.majmin else ""
 
-                    if device_item.type is None:
-                        device_item.type = ''
+                if device_item.type is None:
+                    device_item.type = ''
 
-                    if device_item.type.lower() == 'lvm':
-                        for lvm_item in lvm_items:
-                            majmin = lvm_item.lv_kernel_major + ':' + lvm_item.lv_kernel_minor
+                if device_item.type.lower() == 'lvm':
+                    for lvm_item in lvm_items:
+                        majmin = lvm_item.lv_kernel_major + ':' + lvm_item.lv_kernel_minor
 
-                            if majmin == device_item.majmin:
-                                device_item.name = lvm_item.vg_name + '/' + lvm_item.lv_name
+                        if majmin == device_item.majmin:
+                            device_item.name = lvm_item.vg_name + '/' + lvm_item.lv_name
 
-                    device_item.azure_name = ''
-                    for symlink, target in self.get_azure_symlinks().items():
-                        if device_item.name in target:
-                            device_item.azure_name = symlink
+                device_item.azure_name = ''
+                for symlink, target in azure_symlinks.items():
+                    if device_item.name in target:
+                        device_item.azure_name = symlink
 
-                    device_items.append(device_item)
+                device_items.append(device_item)
 
-            return device_items
+        return device_items
 
     def get_lvm_items(self):
         lvs_command = 'lvs --noheadings --nameprefixes --unquoted -o lv_name,vg_name,lv_kernel_major,lv_kernel_minor'
@@ -1178,13 +1311,13 @@ class DiskUtil(object):
         if DiskUtil.os_disk_lvm is not None:
             return DiskUtil.os_disk_lvm
 
-        device_items = self.get_device_items(None)
+        topology = self.get_topology()
 
-        if not any([item.type.lower() == 'lvm' for item in device_items]):
+        if not any([item.type.lower() == 'lvm' for item in topology.device_items]):
             DiskUtil.os_disk_lvm = False
             return False
 
-        lvm_items = filter(lambda item: item.vg_name == "rootvg", self.get_lvm_items())
+        lvm_items = filter(lambda item: item.vg_name == "rootvg", topology.lvm_items)
 
         current_lv_names = set([item.lv_name for item in lvm_items])
 
@@ -1267,9 +1400,11 @@ class DiskUtil(object):
             return False
 
     def get_azure_devices(self):
-        ide_devices = self.get_ide_devices()
+        topology = self.get_topology()
+        if topology.ide_devices is None:
+            topology.ide_devices = self.get_ide_devices()
         blk_items = []
-        for ide_device in ide_devices:
+        for ide_device in topology.ide_devices:
             current_blk_items = self.get_device_items("/dev/" + ide_device)
             for current_blk_item in current_blk_items:
                 blk_items.append(current_blk_item)
@@ -16,6 +16,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import os
 import os.path
 import subprocess
@@ -35,14 +36,39 @@ class EncryptionEnvironment(object):
         self.azure_crypt_request_queue_path = os.path.join(self.encryption_config_path, 'azure_crypt_request_queue.ini')
         self.azure_decrypt_request_queue_path = os.path.join(self.encryption_config_path, 'azure_decrypt_request_queue.ini')
         self.azure_crypt_ongoing_item_config_path = os.path.join(self.encryption_config_path, 'azure_crypt_ongoing_item.ini')
+        self.ongoing_items_path = os.path.join(self.encryption_config_path, 'ongoing_items')
         self.azure_crypt_current_transactional_copy_path = os.path.join(self.encryption_config_path, 'azure_crypt_copy_progress.ini')
         self.luks_header_base_path = os.path.join(self.encryption_config_path, 'azureluksheader')
         self.cleartext_key_base_path = os.path.join(self.encryption_config_path, 'cleartext_key')
         self.copy_header_slice_file_path = os.path.join(self.encryption_config_path, 'copy_header_slice_file')
         self.copy_slice_item_backup_file = os.path.join(self.encryption_config_path, 'copy_slice_item.bak')
+        self.copy_checkpoint_journal_file = os.path.join(self.encryption_config_path, 'copy_checkpoint.journal')
         self.os_encryption_markers_path = os.path.join(self.encryption_config_path, 'os_encryption_markers')
         self.bek_backup_path = os.path.join(self.encryption_config_path, 'bek_backup')
 
+    def get_ongoing_item_environment(self, item_id):
+        """
+        the ongoing item config and the copy files of a device encrypted in parallel with others are kept in its own directory.
+        """
+        item_environment = copy.copy(self)
+        item_path = os.path.join(self.ongoing_items_path, item_id)
+        if not os.path.exists(item_path):
+            os.makedirs(item_path)
+        item_environment.azure_crypt_ongoing_item_config_path = os.path.join(item_path, 'azure_crypt_ongoing_item.ini')
+        item_environment.copy_header_slice_file_path = os.path.join(item_path, 'copy_header_slice_file')
+        item_environment.copy_slice_item_backup_file = os.path.join(item_path, 'copy_slice_item.bak')
+        item_environment.copy_checkpoint_journal_file = os.path.join(item_path, 'copy_checkpoint.journal')
+        return item_environment
+
+    def get_ongoing_item_ids(self):
+        """
+        the devices whose encryption was interrupted, their ongoing item config is archived once they are done.
+        """
+        if not os.path.isdir(self.ongoing_items_path):
+            return []
+        return sorted(item_id for item_id in os.listdir(self.ongoing_items_path)
+                      if os.path.exists(os.path.join(self.ongoing_items_path, item_id, 'azure_crypt_ongoing_item.ini')))
+
     def get_se_linux(self):
         proc = Popen([self.patching.getenforce_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         identity, err = proc.communicate()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import traceback
+from Common import CommonVariables
+
+
+class BandwidthLimiter(object):
+    """
+    Shares bytes_per_second between the copies of all the devices, a copy waits
+    until the bytes handed out before it are within the limit.
+    """
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = float(bytes_per_second)
+        self.next_time = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time)
+            self.next_time = start + size / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+
+class EncryptionScheduler(object):
+    """
+    Runs the encryption pipelines of independent devices on up to max_concurrency threads.
+    A pipeline holds the scheduler lock while it changes the shared state of the system
+    (mounts, crypttab, fstab, selinux), the lock is only released while the pipeline copies
+    data through copy(), so only the copies of the devices overlap.
+    After a pipeline failed no new pipeline is started, the running ones are completed.
+    """
+    def __init__(self, logger, hutil, max_concurrency, bandwidth_limit=0, status_prefix=''):
+        self.logger = logger
+        self.hutil = hutil
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = 1
+        self.bandwidth_limiter = BandwidthLimiter(bandwidth_limit) if bandwidth_limit > 0 else None
+        self.status_prefix = status_prefix
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.progress_lock = threading.Lock()
+        self.sizes = {}
+        self.progress = {}
+        self.done = 0
+        self.last_status_message = None
+        self.last_status_report_time = None
+
+    def run(self, items):
+        """
+        items is a list of (key, size, pipeline), pipeline(key) returns True when the device is encrypted.
+        returns the keys of the failed pipelines and of the ones which were not started.
+        """
+        pending = list(items)
+        failed = []
+        for key, size, pipeline in pending:
+            self.sizes[key] = max(size or 0, 1)
+            self.progress[key] = 0.0
+
+        def worker():
+            while True:
+                with self.progress_lock:
+                    if not pending or failed:
+                        return
+                    key, size, pipeline = pending.pop(0)
+                if not self.run_pipeline(key, pipeline):
+                    with self.progress_lock:
+                        failed.append(key)
+
+        self.concurrency = max(1, min(self.max_concurrency, len(pending)))
+        threads = [threading.Thread(target=worker) for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return failed + [key for key, size, pipeline in pending]
+
+    def run_pipeline(self, key, pipeline):
+        self.local.key = key
+        self.lock.acquire()
+        try:
+            succeeded = pipeline(key)
+        except Exception as e:
+            self.logger.log(msg="encrypting {0} failed with error: {1}, stack trace: {2}".format(key, e, traceback.format_exc()),
+                            level=CommonVariables.ErrorLevel)
+            succeeded = False
+        finally:
+            self.lock.release()
+        if succeeded:
+            with self.progress_lock:
+                self.done += 1
+            self.update_progress(key, 1.0)
+        return succeeded
+
+    def copy(self, disk_util, ongoing_item_config, report_progress=False):
+        """
+        copy the data of the current pipeline without holding the scheduler lock.
+        the copies running at the same time split the memory budget of a copy between them.
+        """
+        progress_callback = None
+        if report_progress:
+            key = self.local.key
+            progress_callback = lambda current, total: self.update_progress(key, float(current) / total)
+        self.lock.release()
+        try:
+            return disk_util.copy(ongoing_item_config=ongoing_item_config,
+                                  bandwidth_limiter=self.bandwidth_limiter,
+                                  progress_callback=progress_callback,
+                                  concurrent_copies=self.concurrency)
+        finally:
+            self.lock.acquire()
+
+    def update_progress(self, key, fraction):
+        """
+        the combined progress is weighted by the device sizes, it is reported when the percentage
+        or the number of encrypted devices changes, at most every copy_status_report_interval seconds otherwise.
+        """
+        with self.progress_lock:
+            self.progress[key] = fraction
+            percentage = int(sum(self.sizes[k] * self.progress[k] for k in self.sizes) / float(sum(self.sizes.values())) * 100.0)
+            msg = "{0}: {1}% ({2}/{3} done)".format(self.status_prefix, percentage, self.done, len(self.sizes))
+            now = time.time()
+            if msg == self.last_status_message and \
+                    now - self.last_status_report_time < CommonVariables.copy_status_report_interval:
+                return
+            self.last_status_message = msg
+            self.last_status_report_time = now
+            self.hutil.do_status_report(operation='DataCopy',
+                                        status=CommonVariables.extension_success_status,
+                                        status_code=str(CommonVariables.success),
+                                        message=msg)
@@ -191,6 +191,8 @@ class ResourceDiskUtil(object):
                         something_closed = True
                     else:
                         self.logger.log('failed to remove ' + dm_item.name)
+            if something_closed:
+                self.disk_util.invalidate_topology()
 
     def _prepare_partition(self):
         """ create partition on resource disk if missing """
@@ -199,6 +201,7 @@ class ResourceDiskUtil(object):
         self.logger.log("resource disk partition does not exist", level='Info')
         cmd = 'parted ' + self.RD_BASE_DEV_PATH + ' mkpart primary ext4 0% 100%'
         if self.executor.ExecuteInBash(cmd) == CommonVariables.process_success:
+            self.disk_util.invalidate_topology()
             # wait for the corresponding udev name to become available
             for i in range(0, 10):
                 time.sleep(i)
@@ -213,7 +216,9 @@ class ResourceDiskUtil(object):
             self.logger.log("resource partition does not exist, no header to clear")
             return True
         cmd = 'dd if=/dev/urandom of=' + self.RD_DEV_PATH + ' bs=512 count=20480'
-        return self.executor.Execute(cmd) == CommonVariables.process_success
+        result = self.executor.Execute(cmd)
+        self.disk_util.invalidate_topology()
+        return result == CommonVariables.process_success
 
     def try_remount(self):
         """
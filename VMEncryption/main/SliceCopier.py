@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import mmap
+import os
+
+
+class SliceCopier(object):
+    """
+    Copies byte ranges between devices and files inside the process, on raw file
+    descriptors, instead of running dd.
+    A slice is read once into a reusable page aligned anonymous mmap buffer and can
+    then be written to several files from there. File to file copies go through
+    copy_file_range or sendfile when the interpreter and the kernel support them.
+    """
+    def __init__(self, buffer_size):
+        self.buffer_size = buffer_size
+        # mmap rounds the mapping up to whole pages, the memory is only committed when touched
+        self.buffer = mmap.mmap(-1, max(buffer_size, mmap.PAGESIZE))
+        try:
+            self.view = memoryview(self.buffer)
+        except TypeError:
+            # python 2 mmap objects only support the old buffer interface
+            self.view = None
+        self.use_copy_file_range = hasattr(os, 'copy_file_range')
+        self.use_sendfile = hasattr(os, 'sendfile')
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        self.buffer.close()
+
+    def read(self, fd, offset, length):
+        """
+        fill the first length bytes of the buffer from fd, starting at offset.
+        """
+        pos = 0
+        while pos < length:
+            if self.view is not None and hasattr(os, 'preadv'):
+                read = os.preadv(fd, [self.view[pos:length]], offset + pos)
+            else:
+                if hasattr(os, 'pread'):
+                    data = os.pread(fd, length - pos, offset + pos)
+                else:
+                    os.lseek(fd, offset + pos, os.SEEK_SET)
+                    data = os.read(fd, length - pos)
+                read = len(data)
+                self.buffer[pos:pos + read] = data
+            if read == 0:
+                raise IOError(errno.EIO, "reached the end of the file at offset {0}, {1} bytes short".format(offset + pos, length - pos))
+            pos += read
+
+    def write(self, fd, offset, length):
+        """
+        write the first length bytes of the buffer to fd, starting at offset.
+        """
+        pos = 0
+        while pos < length:
+            if self.view is not None:
+                written = os.pwrite(fd, self.view[pos:length], offset + pos)
+            else:
+                os.lseek(fd, offset + pos, os.SEEK_SET)
+                written = os.write(fd, buffer(self.buffer, pos, length - pos))
+            pos += written
+
+    def copy(self, in_fd, in_offset, out_fd, out_offset, length):
+        """
+        copy length bytes from in_fd at in_offset to out_fd at out_offset.
+        """
+        while length > 0:
+            copied = self._copy_in_kernel(in_fd, in_offset, out_fd, out_offset, length)
+            if copied is None:
+                copied = min(length, self.buffer_size)
+                self.read(in_fd, in_offset, copied)
+                self.write(out_fd, out_offset, copied)
+            elif copied == 0:
+                raise IOError(errno.EIO, "reached the end of the file at offset {0}, {1} bytes short".format(in_offset, length))
+            in_offset += copied
+            out_offset += copied
+            length -= copied
+
+    def _copy_in_kernel(self, in_fd, in_offset, out_fd, out_offset, length):
+        """
+        returns the number of bytes copied, or None when neither copy_file_range nor
+        sendfile can be used for these descriptors.
+        """
+        unsupported = (errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP, errno.EBADF)
+        if self.use_copy_file_range:
+            try:
+                return os.copy_file_range(in_fd, out_fd, length, in_offset, out_offset)
+            except OSError as e:
+                if e.errno not in unsupported:
+                    raise
+                self.use_copy_file_range = False
+        if self.use_sendfile:
+            try:
+                # sendfile writes at the current position of out_fd
+                os.lseek(out_fd, out_offset, os.SEEK_SET)
+                return os.sendfile(out_fd, in_fd, in_offset, length)
+            except OSError as e:
+                if e.errno not in unsupported:
+                    raise
+                self.use_sendfile = False
+        return None
+
+
+def fsync_directory(path):
+    """
+    make a file creation or removal in the directory durable.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -16,28 +16,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess
 import os
 import os.path
 import sys
-import shlex
-from subprocess import *
-from CommandExecutor import CommandExecutor
+import time
 from Common import CommonVariables
+from CheckpointJournal import CheckpointJournal
 from ConfigUtil import ConfigUtil
 from OnGoingItemConfig import *
+from SliceCopier import SliceCopier, fsync_directory
 
 
 class TransactionalCopyTask(object):
     """
     copy_total_size is in byte, skip_target_size is also in byte
     slice_size is in byte 50M
+    the slices are copied in batches, the number of slices in a batch follows the measured
+    throughput within the memory budget, and the progress is kept in a checkpoint journal.
     """
-    def __init__(self, logger, hutil, disk_util, ongoing_item_config, patching, encryption_environment, status_prefix=''):
+    def __init__(self, logger, hutil, disk_util, ongoing_item_config, patching, encryption_environment, status_prefix='',
+                 bandwidth_limiter=None, progress_callback=None, concurrent_copies=1):
         """
         copy_total_size is in bytes.
+        bandwidth_limiter is shared with the copies of other devices, progress_callback(current_slice_index, total_slice_size)
+        receives the progress of the copy.
+        concurrent_copies is the number of copies running at the same time, they share the memory budget.
         """
-        self.command_executer = CommandExecutor(logger)
         self.ongoing_item_config = ongoing_item_config
         self.total_size = self.ongoing_item_config.get_current_total_copy_size()
         self.block_size = self.ongoing_item_config.get_current_block_size()
@@ -56,239 +60,289 @@ class TransactionalCopyTask(object):
         self.patching = patching
         self.disk_util = disk_util
         self.hutil = hutil
-        self.tmpfs_mount_point = "/mnt/azure_encrypt_tmpfs"
-        self.slice_file_path = self.tmpfs_mount_point + "/slice_file"
-        self.copy_command = self.patching.dd_path
+        self.bandwidth_limiter = bandwidth_limiter
+        self.progress_callback = progress_callback
+        self.concurrent_copies = max(1, concurrent_copies)
+        self.slice_copier = None
+        self.fds = {}
+        self.batch_slice_count = 1
+        self.max_batch_slice_count = 1
+        self.journal = CheckpointJournal(path=self.encryption_environment.copy_checkpoint_journal_file,
+                                         identity='|'.join([self.source_dev_full_path, self.destination, str(self.total_size),
+                                                            str(self.block_size), str(self.from_end)]))
+        self.last_status_report_time = None
+        self.last_status_percentage = None
+        self.last_commit_time = time.time()
+
+    def open_device(self, path, flags):
+        """
+        the devices stay open for the whole copy, they are closed in clear_mem_fs.
+        """
+        if (path, flags) not in self.fds:
+            self.fds[(path, flags)] = os.open(path, flags)
+        return self.fds[(path, flags)]
 
-    def resume_copy_internal(self, copy_slice_item_backup_file_size, skip_block, original_total_copy_size):
-        block_size_of_slice_item_backup = 512
-        #copy the left slice
-        if copy_slice_item_backup_file_size <= original_total_copy_size:
-            skip_of_slice_item_backup_file = copy_slice_item_backup_file_size / block_size_of_slice_item_backup
-            left_count = ((original_total_copy_size - copy_slice_item_backup_file_size) / block_size_of_slice_item_backup)
-            total_count = original_total_copy_size / block_size_of_slice_item_backup
-            original_device_skip_count = (self.block_size * skip_block) / block_size_of_slice_item_backup 
-            if left_count != 0:
-                dd_cmd = str(self.copy_command) \
-                       + ' if=' + self.source_dev_full_path \
-                       + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                       + ' bs=' + str(block_size_of_slice_item_backup) \
-                       + ' skip=' + str(original_device_skip_count + skip_of_slice_item_backup_file) \
-                       + ' seek=' + str(skip_of_slice_item_backup_file) \
-                       + ' count=' + str(left_count)
-
-                return_code = self.command_executer.Execute(dd_cmd)
-                if return_code != CommonVariables.process_success:
-                    return return_code
-
-            dd_cmd = str(self.copy_command) \
-                   + ' if=' + self.encryption_environment.copy_slice_item_backup_file \
-                   + ' of=' + self.destination \
-                   + ' bs=' + str(block_size_of_slice_item_backup) \
-                   + ' seek=' + str(original_device_skip_count) \
-                   + ' count=' + str(total_count)
-
-            return_code = self.command_executer.Execute(dd_cmd)
-            if return_code != CommonVariables.process_success:
-                return return_code
-            else:
-                self.current_slice_index += 1
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                return return_code
-        else:
-            self.logger.log(msg="copy_slice_item_backup_file_size is bigger than original_total_copy_size",
-                            level=CommonVariables.ErrorLevel)
-            return CommonVariables.backup_slice_file_error
+    def is_last_slice(self, slice_index):
+        """
+        the last slice is the partial one at the end of the device, it is the first one copied when copying from the end.
+        """
+        if self.from_end.lower() == 'true':
+            return slice_index == 0
+        return slice_index == self.total_slice_size - 1
 
-    def resume_copy(self):
+    def get_batch_slice_count(self, slice_index):
+        """
+        the last slice is always copied alone, a batch of full slices never goes past it.
+        """
+        if self.is_last_slice(slice_index):
+            return 1
         if self.from_end.lower() == 'true':
-            skip_block = (self.total_slice_size - self.current_slice_index - 1)
-        else:
-            skip_block = self.current_slice_index
-
-        return_code = CommonVariables.process_success
-
-        if self.current_slice_index == 0:
-            if self.last_slice_size > 0:
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
-                    return_code = self.resume_copy_internal(copy_slice_item_backup_file_size=copy_slice_item_backup_file_size,
-                                                           skip_block=skip_block,
-                                                           original_total_copy_size=self.last_slice_size)
-                else:
-                    self.logger.log(msg="1. the slice item backup file not exists.",
-                                    level=CommonVariables.WarningLevel)
-            else:
-                self.logger.log(msg="the last slice",
-                                level=CommonVariables.WarningLevel)
+            remaining = self.total_slice_size - slice_index
         else:
-            if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
-                return_code = self.resume_copy_internal(copy_slice_item_backup_file_size, skip_block=skip_block, original_total_copy_size=self.block_size)
-            else:
-                self.logger.log(msg="2. unfortunately the slice item backup file not exists.",
-                                level=CommonVariables.WarningLevel)
-        return return_code
-
-    def copy_last_slice(self, skip_block):
-        block_size_of_last_slice = 512
-        skip_of_last_slice = (skip_block * self.block_size) / block_size_of_last_slice
-        count_of_last_slice = self.last_slice_size / block_size_of_last_slice
-
-        copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                         to_device = self.destination,
-                                         skip=skip_of_last_slice,
-                                         seek=skip_of_last_slice,
-                                         block_size=block_size_of_last_slice,
-                                         count = count_of_last_slice)
-        return copy_result
+            remaining = self.total_slice_size - 1 - slice_index
+        return min(self.batch_slice_count, remaining)
 
-    def begin_copy(self):
+    def get_batch_extent(self, slice_index, slice_count):
         """
-        check the device_item size first, cut it
+        returns the offset and the length in bytes of slice_count slices starting at slice_index.
         """
-        self.resume_copy()
+        if self.is_last_slice(slice_index):
+            return (self.total_size - self.last_slice_size, self.last_slice_size)
         if self.from_end.lower() == 'true':
-            while self.current_slice_index < self.total_slice_size:
-                skip_block = (self.total_slice_size - self.current_slice_index - 1)
-
-                if self.current_slice_index == 0:
-                    if self.last_slice_size > 0:
-                        copy_result = self.copy_last_slice(skip_block)
-                        if copy_result != CommonVariables.process_success:
-                            return copy_result
-                    else:
-                        self.logger.log(msg = "the last slice size is zero, so skip the 0 index.")
-                else:
-                    copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                                     to_device=self.destination,
-                                                     skip=skip_block,
-                                                     seek=skip_block,
-                                                     block_size=self.block_size)
-
-                    if copy_result != CommonVariables.process_success:
-                        return copy_result
-
-                self.current_slice_index += 1
-
-                if self.status_prefix:
-                    msg = self.status_prefix + ': ' \
-                        + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
-                        + '%'
-
-                    self.hutil.do_status_report(operation='DataCopy',
-                                                status=CommonVariables.extension_success_status,
-                                                status_code=str(CommonVariables.success),
-                                                message=msg)
-
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
+            skip_block = self.total_slice_size - slice_index - slice_count
+        else:
+            skip_block = slice_index
+        return (skip_block * self.block_size, slice_count * self.block_size)
 
-            return CommonVariables.process_success
+    def get_copy_buffer_size(self):
+        """
+        the memory budget of a batch, copy_buffer_max_size or a quarter of the available memory, but at least one slice.
+        the buffers are only committed once they are touched, so the concurrent copies would not see each
+        other in MemAvailable, the budget is split between them up front.
+        """
+        buffer_size = CommonVariables.copy_buffer_max_size
+        try:
+            with open('/proc/meminfo') as meminfo:
+                for line in meminfo:
+                    if line.startswith('MemAvailable:'):
+                        buffer_size = min(buffer_size, int(line.split()[1]) * 1024 // 4)
+                        break
+        except (IOError, ValueError) as e:
+            self.logger.log(msg="failed to read the available memory: {0}".format(e),
+                            level=CommonVariables.WarningLevel)
+        buffer_size //= self.concurrent_copies
+        return max(self.block_size, buffer_size - buffer_size % self.block_size)
+
+    def adapt_batch_slice_count(self, length, elapsed):
+        """
+        size the next batch to take about copy_batch_target_seconds at the measured throughput,
+        growing at most twice per batch.
+        """
+        if elapsed <= 0:
+            wanted = self.max_batch_slice_count
         else:
-            while self.current_slice_index < self.total_slice_size:
-                skip_block = self.current_slice_index
-
-                if self.current_slice_index == (self.total_slice_size - 1):
-                    if self.last_slice_size > 0:
-                        copy_result = self.copy_last_slice(skip_block)
-                        if copy_result != CommonVariables.process_success:
-                            return copy_result
-                    else:
-                        self.logger.log(msg = "the last slice size is zero, so skip the last slice index.")
-                else:
-                    copy_result = self.copy_internal(from_device=self.source_dev_full_path,
-                                                     to_device=self.destination,
-                                                     skip=skip_block,
-                                                     seek=skip_block,
-                                                     block_size=self.block_size)
-
-                    if copy_result != CommonVariables.process_success:
-                        return copy_result
-
-                self.current_slice_index += 1
-
-                if self.status_prefix:
-                    msg = self.status_prefix + ': ' \
-                        + str(int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)) \
-                        + '%'
-
-                    self.hutil.do_status_report(operation='DataCopy',
-                                                status=CommonVariables.extension_success_status,
-                                                status_code=str(CommonVariables.success),
-                                                message=msg)
+            wanted = int(length / elapsed * CommonVariables.copy_batch_target_seconds / self.block_size)
+        self.batch_slice_count = max(1, min(wanted, self.batch_slice_count * 2, self.max_batch_slice_count))
 
+    def remove_backup_file(self):
+        """
+        the removal must be durable before the next batch is journaled, resume_copy would take
+        a backup left behind by a crash for the backup of that batch and write it over the batch.
+        """
+        backup_file = self.encryption_environment.copy_slice_item_backup_file
+        if os.path.exists(backup_file):
+            self.logger.log(msg = "clean up the backup file")
+            os.remove(backup_file)
+            fsync_directory(os.path.dirname(backup_file))
+
+    def commit_slice_index(self):
+        self.ongoing_item_config.current_slice_index = self.current_slice_index
+        self.ongoing_item_config.commit()
+        self.last_commit_time = time.time()
+
+    def report_progress(self):
+        """
+        the journal is the checkpoint, the configuration is only committed every copy_commit_interval seconds.
+        the status is reported when the percentage changes, at most every copy_status_report_interval seconds otherwise.
+        """
+        now = time.time()
+        if now - self.last_commit_time >= CommonVariables.copy_commit_interval:
+            self.commit_slice_index()
+
+        if self.progress_callback is not None:
+            self.progress_callback(self.current_slice_index, self.total_slice_size)
+
+        if self.status_prefix:
+            percentage = int(self.current_slice_index / (float)(self.total_slice_size) * 100.0)
+            if percentage != self.last_status_percentage or \
+                    now - self.last_status_report_time >= CommonVariables.copy_status_report_interval:
+                msg = self.status_prefix + ': ' + str(percentage) + '%'
                 self.hutil.do_status_report(operation='DataCopy',
                                             status=CommonVariables.extension_success_status,
                                             status_code=str(CommonVariables.success),
                                             message=msg)
+                self.last_status_percentage = percentage
+                self.last_status_report_time = now
+
+    def resume_copy_internal(self, copy_slice_item_backup_file_size, offset, original_total_copy_size):
+        block_size_of_slice_item_backup = 512
+        #copy the left slice
+        if copy_slice_item_backup_file_size <= original_total_copy_size:
+            # the end of the backup file may not have made it to the disk, redo the last partial sector
+            backup_size = copy_slice_item_backup_file_size - copy_slice_item_backup_file_size % block_size_of_slice_item_backup
+            backup_fd = None
+            try:
+                backup_fd = os.open(self.encryption_environment.copy_slice_item_backup_file, os.O_RDWR)
+                if backup_size < original_total_copy_size:
+                    # the destination was not written yet, so the rest of the batch is still in the source
+                    source_fd = self.open_device(self.source_dev_full_path, os.O_RDONLY)
+                    self.slice_copier.copy(source_fd, offset + backup_size,
+                                           backup_fd, backup_size,
+                                           original_total_copy_size - backup_size)
+                    os.fsync(backup_fd)
+
+                destination_fd = self.open_device(self.destination, os.O_WRONLY)
+                self.slice_copier.copy(backup_fd, 0, destination_fd, offset, original_total_copy_size)
+                os.fsync(destination_fd)
+            except (IOError, OSError) as e:
+                self.logger.log(msg="failed to restore the slice from the backup file: {0}".format(e),
+                                level=CommonVariables.ErrorLevel)
+                return CommonVariables.copy_data_error
+            finally:
+                if backup_fd is not None:
+                    os.close(backup_fd)
+            return CommonVariables.process_success
+        else:
+            self.logger.log(msg="copy_slice_item_backup_file_size is bigger than original_total_copy_size",
+                            level=CommonVariables.ErrorLevel)
+            return CommonVariables.backup_slice_file_error
 
-                self.ongoing_item_config.current_slice_index = self.current_slice_index
-                self.ongoing_item_config.commit()
+    def resume_copy(self):
+        """
+        the journal records the batch being copied, a copy started before the journal existed
+        only has the backup of the current slice.
+        """
+        checkpoint = self.journal.load()
+        if checkpoint is not None and checkpoint[0] >= self.current_slice_index:
+            self.current_slice_index, pending_slice_count = checkpoint
+        else:
+            pending_slice_count = 1
+
+        backup_exists = os.path.exists(self.encryption_environment.copy_slice_item_backup_file)
+        if pending_slice_count == 0 or self.current_slice_index >= self.total_slice_size:
+            if backup_exists:
+                self.logger.log(msg="the backup file belongs to a batch which is already copied.")
+                self.remove_backup_file()
+            return CommonVariables.process_success
+        if not backup_exists:
+            self.logger.log(msg="the slice item backup file not exists.",
+                            level=CommonVariables.WarningLevel)
             return CommonVariables.process_success
 
-    """
-    TODO: if the copy failed?
-    """
-    def copy_internal(self, from_device, to_device,  block_size, skip=0, seek=0, count=1):
+        offset, length = self.get_batch_extent(self.current_slice_index, pending_slice_count)
+        if length == 0:
+            self.logger.log(msg="the last slice",
+                            level=CommonVariables.WarningLevel)
+            self.remove_backup_file()
+            return CommonVariables.process_success
+
+        copy_slice_item_backup_file_size = os.path.getsize(self.encryption_environment.copy_slice_item_backup_file)
+        return_code = self.resume_copy_internal(copy_slice_item_backup_file_size=copy_slice_item_backup_file_size,
+                                                offset=offset,
+                                                original_total_copy_size=length)
+        if return_code != CommonVariables.process_success:
+            return return_code
+
+        self.current_slice_index += pending_slice_count
+        self.journal.append(self.current_slice_index, 0)
+        self.commit_slice_index()
+        self.remove_backup_file()
+        return CommonVariables.process_success
+
+    def begin_copy(self):
         """
-        first, copy the data to the middle cache
+        check the device_item size first, cut it
         """
-        dd_cmd = str(self.copy_command) \
-               + ' if=' + from_device \
-               + ' of=' + self.slice_file_path \
-               + ' bs=' + str(block_size) \
-               + ' skip=' + str(skip) \
-               + ' count=' + str(count)
-
-        return_code = self.command_executer.Execute(dd_cmd)
+        return_code = self.resume_copy()
         if return_code != CommonVariables.process_success:
-            self.logger.log(msg="{0} is {1}".format(dd_cmd, return_code), level=CommonVariables.ErrorLevel)
             return return_code
-        else:
-            slice_file_size = os.path.getsize(self.slice_file_path)
-            self.logger.log(msg=("slice_file_size is: {0}".format(slice_file_size)))
+
+        while self.current_slice_index < self.total_slice_size:
+            slice_count = self.get_batch_slice_count(self.current_slice_index)
+            offset, length = self.get_batch_extent(self.current_slice_index, slice_count)
+
+            if length == 0:
+                self.logger.log(msg = "the last slice size is zero, so skip it.")
+            else:
+                if self.bandwidth_limiter is not None:
+                    self.bandwidth_limiter.consume(length)
+                start_time = time.time()
+                copy_result = self.copy_internal(offset=offset, length=length, slice_count=slice_count)
+                if copy_result != CommonVariables.process_success:
+                    return copy_result
+                if not self.is_last_slice(self.current_slice_index):
+                    self.adapt_batch_slice_count(length, time.time() - start_time)
+
+            self.current_slice_index += slice_count
+            self.journal.append(self.current_slice_index, 0)
+            #the batch is done and recorded, so clear the backup slice file item.
+            self.remove_backup_file()
+            self.report_progress()
+
+        self.commit_slice_index()
+        self.journal.remove()
+        return CommonVariables.process_success
+
+    def copy_internal(self, offset, length, slice_count):
+        """
+        first, record the batch in the journal and read it into the memory buffer
+        """
+        try:
+            self.journal.append(self.current_slice_index, slice_count)
+            source_fd = self.open_device(self.source_dev_full_path, os.O_RDONLY)
+            self.slice_copier.read(source_fd, offset, length)
+
             """
-            second, copy the data in the middle cache to the backup slice.
+            second, persist the batch in the backup file before the target device is touched,
+            resume_copy restores the batch from it if we are interrupted while writing the target.
             """
-            backup_slice_item_cmd = str(self.copy_command) \
-                                  + ' if=' + self.slice_file_path \
-                                  + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                                  + ' bs=' + str(block_size) \
-                                  + ' count=' + str(count)
-            backup_slice_args = shlex.split(backup_slice_item_cmd)
-            backup_process = Popen(backup_slice_args)
-            self.logger.log("backup_slice_item_cmd is:{0}".format(backup_slice_item_cmd))
+            backup_file = self.encryption_environment.copy_slice_item_backup_file
+            backup_fd = os.open(backup_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                self.slice_copier.write(backup_fd, 0, length)
+                os.fsync(backup_fd)
+            finally:
+                os.close(backup_fd)
+            fsync_directory(os.path.dirname(backup_file))
 
             """
-            third, copy the data in the middle cache to the target device.
+            third, write the batch to the target device.
             """
-            dd_cmd = str(self.copy_command) + ' if=' + self.slice_file_path + ' of=' + to_device + ' bs=' + str(block_size) + ' seek=' + str(seek) + ' count=' + str(count)
-            return_code = self.command_executer.Execute(dd_cmd)
-            if return_code != CommonVariables.process_success:
-                self.logger.log(msg=("{0} is: {1}".format(dd_cmd, return_code)), level = CommonVariables.ErrorLevel)
-            else:
-                #the copy done correctly, so clear the backup slice file item.
-                backup_process.kill()
-                if os.path.exists(self.encryption_environment.copy_slice_item_backup_file):
-                    self.logger.log(msg = "clean up the backup file")
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                if os.path.exists(self.slice_file_path):
-                    self.logger.log(msg = "clean up the slice file")
-                    os.remove(self.slice_file_path)
-            return return_code
+            destination_fd = self.open_device(self.destination, os.O_WRONLY)
+            self.slice_copier.write(destination_fd, offset, length)
+            os.fsync(destination_fd)
+        except (IOError, OSError) as e:
+            self.logger.log(msg="failed to copy {0} bytes at {1} from {2} to {3}: {4}".format(
+                                length, offset, self.source_dev_full_path, self.destination, e),
+                            level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+        return CommonVariables.process_success
 
     def prepare_mem_fs(self):
-        self.disk_util.make_sure_path_exists(self.tmpfs_mount_point)
-        commandToExecute = self.patching.mount_path + " -t tmpfs -o size=" + str(self.block_size + 1024) + " tmpfs " + self.tmpfs_mount_point
-        self.logger.log("prepare mem fs script is: {0}".format(commandToExecute))
-        return_code = self.command_executer.Execute(commandToExecute)
-        return return_code
+        """
+        the batches used to be staged in a tmpfs file, now they go through a memory buffer sized to the memory budget.
+        """
+        buffer_size = self.get_copy_buffer_size()
+        self.max_batch_slice_count = buffer_size // self.block_size
+        self.slice_copier = SliceCopier(buffer_size)
+        return CommonVariables.process_success
 
     def clear_mem_fs(self):
-        commandToExecute = self.patching.umount_path + " " + self.tmpfs_mount_point
-        return_code = self.command_executer.Execute(commandToExecute)
-        return return_code
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+        if self.slice_copier is not None:
+            self.slice_copier.close()
+            self.slice_copier = None
+        self.journal.close()
+        return CommonVariables.process_success
@@ -43,6 +43,7 @@ from check_util import CheckUtil
 from DecryptionMarkConfig import DecryptionMarkConfig
 from EncryptionMarkConfig import EncryptionMarkConfig
 from EncryptionEnvironment import EncryptionEnvironment
+from EncryptionScheduler import EncryptionScheduler
 from OnGoingItemConfig import OnGoingItemConfig
 from ProcessLock import ProcessLock
 from CommandExecutor import CommandExecutor, ProcessCommunicator
@@ -397,15 +398,26 @@ def none_or_empty(obj):
         return False
 
 
+se_linux_disable_count = 0
+
+
 def toggle_se_linux_for_centos7(disable):
+    """
+    the calls are counted, se linux stays disabled while a device encrypted in parallel with others needs it.
+    """
+    global se_linux_disable_count
     if DistroPatcher.distro_info[0].lower() == 'centos' and DistroPatcher.distro_info[1].startswith('7.0'):
         if disable:
-            se_linux_status = encryption_environment.get_se_linux()
-            if se_linux_status.lower() == 'enforcing':
-                encryption_environment.disable_se_linux()
-                return True
+            se_linux_disable_count += 1
+            if se_linux_disable_count == 1:
+                se_linux_status = encryption_environment.get_se_linux()
+                if se_linux_status.lower() == 'enforcing':
+                    encryption_environment.disable_se_linux()
+                    return True
         else:
-            encryption_environment.enable_se_linux()
+            se_linux_disable_count = max(0, se_linux_disable_count - 1)
+            if se_linux_disable_count == 0:
+                encryption_environment.enable_se_linux()
     return False
 
 
@@ -883,20 +895,33 @@ def enable_encryption_format(passphrase, disk_format_query, disk_util, force=Fal
                 logger.log(msg=("the item fstype is not empty {0}".format(device_item.file_system)))
 
 
+def copy_in_place(disk_util, ongoing_item_config, status_prefix, scheduler=None, report_progress=False):
+    """
+    the scheduler reports the combined progress of the devices it encrypts in parallel.
+    """
+    if scheduler is None:
+        return disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
+    return scheduler.copy(disk_util, ongoing_item_config, report_progress)
+
+
 def encrypt_inplace_without_seperate_header_file(passphrase_file,
                                                  device_item,
                                                  disk_util,
                                                  bek_util,
                                                  status_prefix='',
-                                                 ongoing_item_config=None):
+                                                 ongoing_item_config=None,
+                                                 scheduler=None,
+                                                 item_environment=None):
     """
     if ongoing_item_config is not None, then this is a resume case.
     this function will return the phase
     """
     logger.log("encrypt_inplace_without_seperate_header_file")
+    if item_environment is None:
+        item_environment = encryption_environment
     current_phase = CommonVariables.EncryptionPhaseBackupHeader
     if ongoing_item_config is None:
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment, logger=logger)
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=item_environment, logger=logger)
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
         ongoing_item_config.current_slice_index = 0
         ongoing_item_config.device_size = device_item.size
@@ -957,17 +982,17 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
             else:
                 ongoing_item_config.current_slice_index = 0
                 ongoing_item_config.current_source_path = original_dev_path
-                ongoing_item_config.current_destination = encryption_environment.copy_header_slice_file_path
+                ongoing_item_config.current_destination = item_environment.copy_header_slice_file_path
                 ongoing_item_config.current_total_copy_size = CommonVariables.default_block_size
                 ongoing_item_config.from_end = False
-                ongoing_item_config.header_slice_file_path = encryption_environment.copy_header_slice_file_path
+                ongoing_item_config.header_slice_file_path = item_environment.copy_header_slice_file_path
                 ongoing_item_config.original_dev_path = original_dev_path
                 ongoing_item_config.commit()
-                if os.path.exists(encryption_environment.copy_header_slice_file_path):
+                if os.path.exists(item_environment.copy_header_slice_file_path):
                     logger.log(msg="the header slice file is there, remove it.", level=CommonVariables.WarningLevel)
-                    os.remove(encryption_environment.copy_header_slice_file_path)
+                    os.remove(item_environment.copy_header_slice_file_path)
 
-                copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
+                copy_result = copy_in_place(disk_util, ongoing_item_config, status_prefix, scheduler)
 
                 if copy_result != CommonVariables.process_success:
                     logger.log(msg="copy the header block failed, return code is: {0}".format(copy_result),
@@ -1010,7 +1035,7 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
             ongoing_item_config.phase = CommonVariables.EncryptionPhaseCopyData
             ongoing_item_config.commit()
 
-            copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
+            copy_result = copy_in_place(disk_util, ongoing_item_config, status_prefix, scheduler, report_progress=True)
             if copy_result != CommonVariables.process_success:
                 logger.log(msg="copy the main content block failed, return code is: {0}".format(copy_result),
                            level=CommonVariables.ErrorLevel)
@@ -1032,7 +1057,7 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
             ongoing_item_config.current_total_copy_size = CommonVariables.default_block_size
             ongoing_item_config.commit()
 
-            copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
+            copy_result = copy_in_place(disk_util, ongoing_item_config, status_prefix, scheduler)
 
             if copy_result == CommonVariables.process_success:
                 crypt_item_to_update = CryptItem()
@@ -1062,8 +1087,8 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file,
                     logger.log(msg=original_dev_name_path + " is not defined in fstab, no need to update",
                                level=CommonVariables.InfoLevel)
 
-                if os.path.exists(encryption_environment.copy_header_slice_file_path):
-                    os.remove(encryption_environment.copy_header_slice_file_path)
+                if os.path.exists(item_environment.copy_header_slice_file_path):
+                    os.remove(item_environment.copy_header_slice_file_path)
 
                 current_phase = CommonVariables.EncryptionPhaseDone
                 ongoing_item_config.phase = current_phase
@@ -1091,14 +1116,18 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file,
                                               disk_util,
                                               bek_util,
                                               status_prefix='',
-                                              ongoing_item_config=None):
+                                              ongoing_item_config=None,
+                                              scheduler=None,
+                                              item_environment=None):
     """
     if ongoing_item_config is not None, then this is a resume case.
     """
     logger.log("encrypt_inplace_with_seperate_header_file")
+    if item_environment is None:
+        item_environment = encryption_environment
     current_phase = CommonVariables.EncryptionPhaseEncryptDevice
     if ongoing_item_config is None:
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment,
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=item_environment,
                                                 logger=logger)
         mapper_name = str(uuid.uuid4())
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
@@ -1183,7 +1212,7 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file,
                 ongoing_item_config.from_end = True
                 ongoing_item_config.commit()
 
-                copy_result = disk_util.copy(ongoing_item_config=ongoing_item_config, status_prefix=status_prefix)
+                copy_result = copy_in_place(disk_util, ongoing_item_config, status_prefix, scheduler, report_progress=True)
 
                 if copy_result != CommonVariables.success:
                     error_message = "the copying result is {0} so skip the mounting".format(copy_result)
@@ -1424,9 +1453,29 @@ def find_all_devices_to_encrypt(encryption_marker, disk_util, bek_util):
     return device_items_to_encrypt
 
 
+def get_inplace_encryption_limits():
+    """
+    returns the number of devices encrypted at the same time and their combined bandwidth limit in bytes per second.
+    """
+    max_concurrency = CommonVariables.inplace_encryption_max_concurrency
+    bandwidth_limit = 0
+    public_settings = get_public_settings() or {}
+    try:
+        if public_settings.get(CommonVariables.InPlaceEncryptionMaxConcurrencyKey):
+            max_concurrency = int(public_settings.get(CommonVariables.InPlaceEncryptionMaxConcurrencyKey))
+        if public_settings.get(CommonVariables.InPlaceEncryptionBandwidthLimitKey):
+            bandwidth_limit = int(float(public_settings.get(CommonVariables.InPlaceEncryptionBandwidthLimitKey)) * 1024 * 1024)
+    except (TypeError, ValueError) as e:
+        logger.log(msg="ignoring the invalid in place encryption limits: {0}".format(e),
+                   level=CommonVariables.WarningLevel)
+    logger.log("encrypting up to {0} data volumes at the same time, bandwidth limit {1} bytes/s".format(max_concurrency, bandwidth_limit))
+    return max_concurrency, bandwidth_limit
+
+
 def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util, bek_util):
     """
     if return None for the success case, or return the device item which failed.
+    the devices are encrypted in parallel, each one has its own ongoing item config.
     """
     logger.log(msg="executing the enable_encryption_all_in_place command.")
 
@@ -1439,17 +1488,27 @@ def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util
                            status_code=str(CommonVariables.success),
                            message=msg)
 
-    for device_num, device_item in enumerate(device_items_to_encrypt):
-        umount_status_code = CommonVariables.success
-        if device_item.mount_point is not None and device_item.mount_point != "":
-            umount_status_code = disk_util.umount(device_item.mount_point)
-        if umount_status_code != CommonVariables.success:
-            logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
-        else:
+    max_concurrency, bandwidth_limit = get_inplace_encryption_limits()
+    scheduler = EncryptionScheduler(logger=logger,
+                                    hutil=hutil,
+                                    max_concurrency=max_concurrency,
+                                    bandwidth_limit=bandwidth_limit,
+                                    status_prefix=msg)
+
+    def device_item_pipeline(device_num, device_item):
+        def pipeline(key):
+            umount_status_code = CommonVariables.success
+            if device_item.mount_point is not None and device_item.mount_point != "":
+                umount_status_code = disk_util.umount(device_item.mount_point)
+            if umount_status_code != CommonVariables.success:
+                logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
+                return True
+
             logger.log(msg=("encrypting: {0}".format(device_item)))
             no_header_file_support = not_support_header_option_distro(DistroPatcher)
             status_prefix = "Encrypting data volume {0}/{1}".format(device_num + 1,
                                                                     len(device_items_to_encrypt))
+            item_environment = encryption_environment.get_ongoing_item_environment(str(uuid.uuid4()))
 
             # TODO check the file system before encrypting it.
             if no_header_file_support:
@@ -1460,22 +1519,101 @@ def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util
                                                                                        device_item=device_item,
                                                                                        disk_util=disk_util,
                                                                                        bek_util=bek_util,
-                                                                                       status_prefix=status_prefix)
+                                                                                       status_prefix=status_prefix,
+                                                                                       scheduler=scheduler,
+                                                                                       item_environment=item_environment)
             else:
                 encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
                                                                                     device_item=device_item,
                                                                                     disk_util=disk_util,
                                                                                     bek_util=bek_util,
-                                                                                    status_prefix=status_prefix)
-
-            if encryption_result_phase == CommonVariables.EncryptionPhaseDone:
-                continue
-            else:
-                # do exit to exit from this round
-                return device_item
+                                                                                    status_prefix=status_prefix,
+                                                                                    scheduler=scheduler,
+                                                                                    item_environment=item_environment)
+
+            return encryption_result_phase == CommonVariables.EncryptionPhaseDone
+        return pipeline
+
+    failed_names = scheduler.run([(device_item.name, device_item.size, device_item_pipeline(device_num, device_item))
+                                  for device_num, device_item in enumerate(device_items_to_encrypt)])
+    for device_item in device_items_to_encrypt:
+        if device_item.name in failed_names:
+            # do exit to exit from this round
+            return device_item
     return None
 
 
+def resume_encryption_in_place(ongoing_item_config, disk_util, bek_util, passphrase_file, status_prefix, scheduler=None):
+    """
+    continue the encryption recorded in ongoing_item_config, returns the phase it reached.
+    """
+    header_file_path = ongoing_item_config.get_header_file_path()
+    mount_point = ongoing_item_config.get_mount_point()
+    if not none_or_empty(mount_point):
+        logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
+        umount_status_code = disk_util.umount(mount_point)
+        logger.log("unmount return code is {0}".format(umount_status_code))
+    if none_or_empty(header_file_path):
+        encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=passphrase_file,
+                                                                               device_item=None,
+                                                                               disk_util=disk_util,
+                                                                               bek_util=bek_util,
+                                                                               status_prefix=status_prefix,
+                                                                               ongoing_item_config=ongoing_item_config,
+                                                                               scheduler=scheduler,
+                                                                               item_environment=ongoing_item_config.encryption_environment)
+        # TODO mount it back when shrink failed
+    else:
+        encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=passphrase_file,
+                                                                            device_item=None,
+                                                                            disk_util=disk_util,
+                                                                            bek_util=bek_util,
+                                                                            status_prefix=status_prefix,
+                                                                            ongoing_item_config=ongoing_item_config,
+                                                                            scheduler=scheduler,
+                                                                            item_environment=ongoing_item_config.encryption_environment)
+    return encryption_result_phase
+
+
+def resume_encryption_all_in_place(item_ids, passphrase_file, disk_util, bek_util):
+    """
+    continue every device whose encryption was interrupted, in parallel.
+    """
+    status_prefix = "Resuming encryption of {0} data volumes after reboot".format(len(item_ids))
+    logger.log(status_prefix)
+    max_concurrency, bandwidth_limit = get_inplace_encryption_limits()
+    scheduler = EncryptionScheduler(logger=logger,
+                                    hutil=hutil,
+                                    max_concurrency=max_concurrency,
+                                    bandwidth_limit=bandwidth_limit,
+                                    status_prefix=status_prefix)
+
+    ongoing_item_configs = {}
+    for item_id in item_ids:
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment.get_ongoing_item_environment(item_id),
+                                                logger=logger)
+        ongoing_item_config.load_value_from_file()
+        ongoing_item_configs[item_id] = ongoing_item_config
+
+    def item_pipeline(ongoing_item_config):
+        def pipeline(key):
+            encryption_result_phase = resume_encryption_in_place(ongoing_item_config=ongoing_item_config,
+                                                                 disk_util=disk_util,
+                                                                 bek_util=bek_util,
+                                                                 passphrase_file=passphrase_file,
+                                                                 status_prefix=status_prefix,
+                                                                 scheduler=scheduler)
+            return encryption_result_phase == CommonVariables.EncryptionPhaseDone
+        return pipeline
+
+    failed_ids = scheduler.run([(item_id, ongoing_item_configs[item_id].get_device_size(), item_pipeline(ongoing_item_configs[item_id]))
+                                for item_id in item_ids])
+    if failed_ids:
+        original_dev_paths = [ongoing_item_configs[item_id].get_original_dev_path() for item_id in failed_ids]
+        message = 'EnableEncryption: resuming encryption for {0} failed'.format(', '.join(original_dev_paths))
+        raise Exception(message)
+
+
 def disable_encryption_all_in_place(passphrase_file, decryption_marker, disk_util):
     """
     On success, returns None. Otherwise returns the crypt item for which decryption failed.
@@ -1752,37 +1890,26 @@ def daemon_encrypt_data_volumes(encryption_marker, encryption_config, disk_util,
         if ongoing_item_config.config_file_exists():
             logger.log("OngoingItemConfig exists.")
             ongoing_item_config.load_value_from_file()
-            header_file_path = ongoing_item_config.get_header_file_path()
-            mount_point = ongoing_item_config.get_mount_point()
-            status_prefix = "Resuming encryption after reboot"
-            if not none_or_empty(mount_point):
-                logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
-                umount_status_code = disk_util.umount(mount_point)
-                logger.log("unmount return code is {0}".format(umount_status_code))
-            if none_or_empty(header_file_path):
-                encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file=bek_passphrase_file,
-                                                                                       device_item=None,
-                                                                                       disk_util=disk_util,
-                                                                                       bek_util=bek_util,
-                                                                                       status_prefix=status_prefix,
-                                                                                       ongoing_item_config=ongoing_item_config)
-                # TODO mount it back when shrink failed
-            else:
-                encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file=bek_passphrase_file,
-                                                                                    device_item=None,
-                                                                                    disk_util=disk_util,
-                                                                                    bek_util=bek_util,
-                                                                                    status_prefix=status_prefix,
-                                                                                    ongoing_item_config=ongoing_item_config)
+            encryption_result_phase = resume_encryption_in_place(ongoing_item_config=ongoing_item_config,
+                                                                 disk_util=disk_util,
+                                                                 bek_util=bek_util,
+                                                                 passphrase_file=bek_passphrase_file,
+                                                                 status_prefix="Resuming encryption after reboot")
             """
             if the resuming failed, we should fail.
             """
             if encryption_result_phase != CommonVariables.EncryptionPhaseDone:
-                original_dev_path = ongoing_item_config.get_original_dev_path
+                original_dev_path = ongoing_item_config.get_original_dev_path()
                 message = 'EnableEncryption: resuming encryption for {0} failed'.format(original_dev_path)
                 raise Exception(message)
             else:
                 ongoing_item_config.clear_config()
+        elif encryption_environment.get_ongoing_item_ids():
+            logger.log("OngoingItemConfig exists for data volumes encrypted in parallel.")
+            resume_encryption_all_in_place(item_ids=encryption_environment.get_ongoing_item_ids(),
+                                           passphrase_file=bek_passphrase_file,
+                                           disk_util=disk_util,
+                                           bek_util=bek_util)
         else:
             logger.log("OngoingItemConfig does not exist")
             failed_item = None
@@ -1877,6 +2004,13 @@ def daemon_decrypt():
                           message='Decryption succeeded')
 
 
+def log_command_timings():
+    # the log goes to the telemetry, the summary shows which tools the daemon waited for
+    summary = CommandExecutor.timing_ledger.summary()
+    if summary:
+        logger.log("external command timings: {0}".format(summary))
+
+
 def daemon():
     hutil.find_last_nonquery_operation = True
     hutil.do_parse_context('Executing')
@@ -1912,6 +2046,7 @@ def daemon():
         finally:
             lock.release_lock()
             logger.log("returned to daemon")
+            log_command_timings()
             logger.log("exiting daemon")
 
             return
@@ -1938,6 +2073,7 @@ def daemon():
         hutil.redo_current_status()
     finally:
         lock.release_lock()
+        log_command_timings()
         logger.log("exiting daemon")
 
 
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main.CheckpointJournal import CheckpointJournal
+
+
+class TestCheckpointJournal(unittest.TestCase):
+    """ unit tests for functions in the CheckpointJournal module """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'copy_checkpoint.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_last_record(self):
+        journal = CheckpointJournal(self.path, 'copy')
+        self.assertEqual(None, journal.load())
+        journal.append(0, 1)
+        journal.append(1, 0)
+        journal.append(1, 4)
+        journal.close()
+        self.assertEqual((1, 4), CheckpointJournal(self.path, 'copy').load())
+
+    def test_torn_record(self):
+        journal = CheckpointJournal(self.path, 'copy')
+        journal.append(2, 0)
+        journal.append(2, 3)
+        journal.close()
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.truncate()
+        self.assertEqual((2, 0), journal.load())
+
+    def test_other_copy(self):
+        journal = CheckpointJournal(self.path, 'copy')
+        journal.append(5, 0)
+        journal.close()
+        self.assertEqual(None, CheckpointJournal(self.path, 'another copy').load())
+
+    def test_compaction(self):
+        journal = CheckpointJournal(self.path, 'copy', compact_records=3)
+        for i in range(0, 7):
+            journal.append(i, 0)
+        journal.close()
+        self.assertTrue(os.path.getsize(self.path) <= CheckpointJournal.Header.size + 3 * CheckpointJournal.Record.size)
+        self.assertEqual((6, 0), journal.load())
+        journal.remove()
+        self.assertFalse(os.path.exists(self.path))
@@ -1,5 +1,8 @@
+import os
+import threading
+import time
 import unittest
-from main.CommandExecutor import CommandExecutor
+from main.CommandExecutor import CommandExecutor, CommandTimingLedger, OutputRingBuffer, ProcessCommunicator, TimeoutScheduler
 from console_logger import ConsoleLogger
 
 class TestCommandExecutor(unittest.TestCase):
@@ -14,4 +17,105 @@ class TestCommandExecutor(unittest.TestCase):
 
     def test_command_no_timeout(self):
         return_code = self.cmd_executor.Execute('sleep 5', timeout=10)
-        self.assertEqual(return_code, 0, msg="The command should have completed successfully")
\ No newline at end of file
+        self.assertEqual(return_code, 0, msg="The command should have completed successfully")
+
+    def test_output_capture(self):
+        communicator = ProcessCommunicator()
+        return_code = self.cmd_executor.Execute('cat', communicator=communicator, input='passphrase' * 10000)
+        self.assertEqual(0, return_code)
+        self.assertEqual('passphrase' * 10000, communicator.stdout)
+        self.assertEqual('', communicator.stderr)
+
+    def test_output_keeps_tail(self):
+        self.cmd_executor.output_buffer_size = 1000
+        communicator = ProcessCommunicator()
+        self.cmd_executor.ExecuteInBash('seq 1 100000; echo failed >&2; exit 3', communicator=communicator)
+        self.assertEqual(1000, len(communicator.stdout))
+        self.assertTrue(communicator.stdout.endswith('99999\n100000\n'))
+        self.assertEqual('failed\n', communicator.stderr)
+
+    def test_ring_buffer(self):
+        ring_buffer = OutputRingBuffer(8)
+        for data in ['abc', 'defgh', 'ij', 'klmnopqrstu']:
+            ring_buffer.write(data)
+        self.assertEqual('nopqrstu', ring_buffer.getvalue())
+        self.assertEqual(13, ring_buffer.dropped)
+
+    def test_timing_ledger(self):
+        CommandExecutor.timing_ledger.reset()
+        self.cmd_executor.Execute('sleep 0.2')
+        self.cmd_executor.ExecuteInBash('sleep 0.1 && false')
+        self.cmd_executor.Execute('/nonexistent/tool')
+        entry = CommandExecutor.timing_ledger.get_entry('sleep')
+        self.assertEqual(2, entry['count'])
+        self.assertEqual(1, entry['failures'])
+        self.assertTrue(entry['wall_time'] >= 0.3)
+        self.assertTrue(entry['max_wall_time'] >= 0.2)
+        self.assertEqual(1, CommandExecutor.timing_ledger.get_entry('tool')['failures'])
+        self.assertTrue(CommandExecutor.timing_ledger.summary().startswith('sleep: 2 runs, 1 failed'))
+
+    def test_timing_ledger_cpu_time(self):
+        ledger = CommandTimingLedger()
+        CommandExecutor.timing_ledger, saved = ledger, CommandExecutor.timing_ledger
+        try:
+            self.cmd_executor.Execute('dd if=/dev/zero of=/dev/null bs=1M count=2000')
+        finally:
+            CommandExecutor.timing_ledger = saved
+        self.assertTrue(ledger.get_entry('dd')['cpu_time'] > 0)
+
+    def test_timeout_scheduler(self):
+        scheduler = TimeoutScheduler()
+        fired = []
+        scheduler.schedule(0.3, lambda: fired.append('late'))
+        cancelled = scheduler.schedule(0.1, lambda: fired.append('cancelled'))
+        scheduler.schedule(0.2, lambda: fired.append('early'))
+        scheduler.cancel(cancelled)
+        time.sleep(0.6)
+        self.assertEqual(['early', 'late'], fired)
+
+    def test_timeout_racing_reap_does_not_kill(self):
+        class CapturingScheduler(object):
+            def __init__(self):
+                self.callbacks = []
+
+            def schedule(self, delay, callback):
+                self.callbacks.append(callback)
+                return len(self.callbacks)
+
+            def cancel(self, handle):
+                pass
+
+        messages = []
+        self.cmd_executor.logger = type('Logger', (object,), {'log': lambda logger, msg: messages.append(msg)})()
+        scheduler = CapturingScheduler()
+        timeout_threads = []
+        errors = []
+        wait4 = os.wait4
+
+        def time_out():
+            try:
+                scheduler.callbacks[0]()
+            except OSError as e:
+                errors.append(e)
+
+        def reap_then_time_out(pid, options):
+            result = wait4(pid, options)
+            if result[0] != 0:
+                # the timeout fires right after the process was reaped
+                thread = threading.Thread(target=time_out)
+                thread.start()
+                thread.join(0.2)
+                timeout_threads.append(thread)
+            return result
+
+        CommandExecutor.timeouts, saved = scheduler, CommandExecutor.timeouts
+        os.wait4 = reap_then_time_out
+        try:
+            self.assertEqual(0, self.cmd_executor.Execute('true', timeout=10, suppress_logging=True))
+        finally:
+            os.wait4 = wait4
+            CommandExecutor.timeouts = saved
+        timeout_threads[0].join()
+        # the reaped pid was not signalled
+        self.assertEqual([], errors)
+        self.assertEqual([], messages)
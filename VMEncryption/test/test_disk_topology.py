@@ -0,0 +1,48 @@
+import unittest
+
+from main.Common import DeviceItem, LvmItem
+from main.DiskTopology import DiskTopology
+
+
+class TestDiskTopology(unittest.TestCase):
+    """ unit tests for the lookups of the DiskTopology module """
+    def _device_item(self, name, majmin, type, mount_point='', uuid=''):
+        device_item = DeviceItem()
+        device_item.name = name
+        device_item.majmin = majmin
+        device_item.type = type
+        device_item.mount_point = mount_point
+        device_item.uuid = uuid
+        return device_item
+
+    def setUp(self):
+        self.sda = self._device_item('sda', '8:0', 'disk')
+        self.sda1 = self._device_item('sda1', '8:1', 'part', '/boot', 'boot-uuid')
+        self.sda2 = self._device_item('sda2', '8:2', 'part')
+        self.osencrypt = self._device_item('osencrypt', '253:0', 'crypt')
+        self.rootlv = self._device_item('rootvg/rootlv', '253:1', 'lvm', '/', 'root-uuid')
+        self.sdc = self._device_item('sdc', '8:32', 'disk', '/data', 'data-uuid')
+        self.topology = DiskTopology(device_items=[self.sda, self.sda1, self.sda2, self.osencrypt, self.rootlv, self.sdc],
+                                     parents={'8:1': ['8:0'], '8:2': ['8:0'], '253:0': ['8:2'], '253:1': ['253:0']},
+                                     mount_items=[],
+                                     lvm_items=[LvmItem()],
+                                     scsi_ids={'8:32': 'scsi1/lun0', '8:48': 'scsi1/lun1'})
+
+    def test_lookups(self):
+        self.assertEqual(self.osencrypt, self.topology.get_device_item('osencrypt'))
+        self.assertEqual(self.rootlv, self.topology.get_device_item_by_mount_point('/'))
+        self.assertEqual(self.sda1, self.topology.get_device_item_by_uuid('boot-uuid'))
+        self.assertEqual(self.sdc, self.topology.get_device_item_by_majmin('8:32'))
+        self.assertEqual(self.sdc, self.topology.get_device_item_by_scsi_id('scsi1/lun0'))
+        # lun1 is not a device of the snapshot
+        self.assertEqual(None, self.topology.get_device_item_by_scsi_id('scsi1/lun1'))
+        self.assertEqual(None, self.topology.get_device_item('sdd'))
+
+    def test_device_tree(self):
+        self.assertEqual([self.sda, self.sda1, self.sda2, self.osencrypt, self.rootlv], self.topology.get_device_tree('8:0'))
+        self.assertEqual([self.sdc], self.topology.get_device_tree('8:32'))
+
+    def test_is_lvm_member(self):
+        self.assertTrue(self.topology.is_lvm_member('253:0'))
+        self.assertFalse(self.topology.is_lvm_member('8:2'))
+        self.assertFalse(self.topology.is_lvm_member('8:32'))
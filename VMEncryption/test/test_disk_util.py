@@ -1,7 +1,8 @@
 import unittest
 import mock
 
-from main.Common import CryptItem
+from main.Common import CryptItem, DeviceItem
+from main.CommandExecutor import CommandExecutor
 from main.EncryptionEnvironment import EncryptionEnvironment
 from main.DiskUtil import DiskUtil
 from console_logger import ConsoleLogger
@@ -57,6 +58,61 @@ class TestDiskUtil(unittest.TestCase):
         crypt_item.current_luks_slot = current_luks_slot
         return crypt_item
 
+    @mock.patch('main.DiskUtil.DiskUtil.get_block_device_to_azure_udev_table', return_value={})
+    @mock.patch('main.DiskUtil.DiskUtil.get_mount_items', return_value=[])
+    @mock.patch('main.DiskUtil.DiskUtil.get_lvm_items', return_value=[])
+    @mock.patch('main.DiskUtil.DiskUtil.get_sysfs_parents', return_value=[])
+    @mock.patch('main.DiskUtil.DiskUtil.query_device_items')
+    def test_topology_snapshot(self, query_mock, parents_mock, lvm_mock, mount_items_mock, azure_mock):
+        device_item = DeviceItem()
+        device_item.name = 'sdc'
+        device_item.majmin = '8:32'
+        query_mock.return_value = [device_item]
+        self.disk_util.command_executor = mock.create_autospec(CommandExecutor)
+        self.disk_util.distro_patcher.umount_path = '/bin/umount'
+
+        self.assertEqual([device_item], self.disk_util.get_device_items(None))
+        self.assertEqual([device_item], self.disk_util.get_device_items(None))
+        self.assertEqual(1, query_mock.call_count)
+
+        # unmounting changes the topology, the next lookup takes a new snapshot
+        self.disk_util.umount('/data')
+        self.assertEqual([device_item], self.disk_util.get_device_items(None))
+        self.assertEqual(2, query_mock.call_count)
+        self.assertEqual(2, lvm_mock.call_count)
+
+    def test_topology_invalidated_while_built(self):
+        topology = mock.Mock()
+        built = []
+
+        def build_topology():
+            # another pipeline mounts a device while the snapshot is taken
+            if not built:
+                self.disk_util.invalidate_topology()
+            built.append(topology)
+            return topology
+
+        self.disk_util.build_topology = build_topology
+        self.assertIs(topology, self.disk_util.get_topology())
+        self.assertIsNone(self.disk_util.topology)
+        self.assertIs(topology, self.disk_util.get_topology())
+        self.assertIs(topology, self.disk_util.topology)
+        self.assertEqual(2, len(built))
+
+        # a copy thread reports the status while the umount runs, the snapshot it takes
+        # may miss the umount, it is dropped once the umount returned
+        def execute(command, *args, **kwargs):
+            self.disk_util.get_topology()
+            self.assertIs(topology, self.disk_util.topology)
+            return 0
+
+        self.disk_util.command_executor = mock.Mock()
+        self.disk_util.command_executor.Execute.side_effect = execute
+        self.disk_util.distro_patcher.umount_path = '/bin/umount'
+        self.disk_util.invalidate_topology()
+        self.assertEqual(0, self.disk_util.umount('/data'))
+        self.assertIsNone(self.disk_util.topology)
+
     def test_parse_crypttab_line(self):
         # empty line
         line = ""
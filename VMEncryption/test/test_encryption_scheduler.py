@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+
+from main.Common import CommonVariables
+from main.EncryptionScheduler import BandwidthLimiter, EncryptionScheduler
+from console_logger import ConsoleLogger
+
+
+class FakeHandlerUtil(object):
+    def __init__(self):
+        self.messages = []
+
+    def do_status_report(self, operation, status, status_code, message):
+        self.messages.append(message)
+
+
+class FakeDiskUtil(object):
+    """ copies take copy_seconds and report their progress twice """
+    def __init__(self, copy_seconds):
+        self.copy_seconds = copy_seconds
+        self.lock = threading.Lock()
+        self.copying = 0
+        self.max_copying = 0
+        self.concurrent_copies = []
+
+    def copy(self, ongoing_item_config, bandwidth_limiter=None, progress_callback=None, concurrent_copies=1):
+        with self.lock:
+            self.concurrent_copies.append(concurrent_copies)
+            self.copying += 1
+            self.max_copying = max(self.max_copying, self.copying)
+        if progress_callback is not None:
+            progress_callback(1, 2)
+        time.sleep(self.copy_seconds)
+        if progress_callback is not None:
+            progress_callback(2, 2)
+        with self.lock:
+            self.copying -= 1
+        return CommonVariables.process_success
+
+
+class TestEncryptionScheduler(unittest.TestCase):
+    """ unit tests for the EncryptionScheduler module """
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.hutil = FakeHandlerUtil()
+
+    def _pipeline(self, scheduler, disk_util, succeeds=True):
+        def pipeline(key):
+            # the lock is held outside of the copies
+            self.assertFalse(scheduler.lock.acquire(False))
+            result = scheduler.copy(disk_util, None, report_progress=True)
+            self.assertEqual(CommonVariables.process_success, result)
+            return succeeds
+        return pipeline
+
+    def test_copies_overlap_up_to_max_concurrency(self):
+        scheduler = EncryptionScheduler(self.logger, self.hutil, max_concurrency=2, status_prefix='Encrypting 3 data volumes')
+        disk_util = FakeDiskUtil(0.2)
+        failed = scheduler.run([(name, 1024, self._pipeline(scheduler, disk_util)) for name in ['sdc', 'sdd', 'sde']])
+        self.assertEqual([], failed)
+        self.assertEqual(2, disk_util.max_copying)
+        self.assertEqual([2, 2, 2], disk_util.concurrent_copies)
+        self.assertEqual('Encrypting 3 data volumes: 100% (3/3 done)', self.hutil.messages[-1])
+
+    def test_combined_progress_is_weighted_by_size(self):
+        scheduler = EncryptionScheduler(self.logger, self.hutil, max_concurrency=1, status_prefix='Encrypting')
+        scheduler.sizes = {'sdc': 3, 'sdd': 1}
+        scheduler.progress = {'sdc': 0.0, 'sdd': 0.0}
+        scheduler.update_progress('sdd', 1.0)
+        scheduler.update_progress('sdc', 0.5)
+        self.assertEqual(['Encrypting: 25% (0/2 done)', 'Encrypting: 62% (0/2 done)'], self.hutil.messages)
+        # the same percentage is not reported again
+        scheduler.update_progress('sdc', 0.5)
+        self.assertEqual(2, len(self.hutil.messages))
+
+    def test_failure_stops_new_pipelines(self):
+        scheduler = EncryptionScheduler(self.logger, self.hutil, max_concurrency=1)
+        disk_util = FakeDiskUtil(0)
+
+        def raising_pipeline(key):
+            raise Exception("luks format failed")
+
+        failed = scheduler.run([('sdc', 1, self._pipeline(scheduler, disk_util, succeeds=False)),
+                                ('sdd', 1, raising_pipeline),
+                                ('sde', 1, self._pipeline(scheduler, disk_util))])
+        self.assertEqual(['sdc', 'sdd', 'sde'], failed)
+        self.assertTrue(scheduler.lock.acquire(False))
+
+    def test_bandwidth_limiter(self):
+        limiter = BandwidthLimiter(1024 * 1024)
+        start = time.time()
+        for i in range(0, 3):
+            limiter.consume(128 * 1024)
+        # the first 256K wait for the 128K handed out before them
+        self.assertTrue(time.time() - start >= 0.2)
@@ -0,0 +1,220 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main.CheckpointJournal import CheckpointJournal
+from main.Common import CommonVariables
+import main.TransactionalCopyTask as TransactionalCopyTask_module
+from main.TransactionalCopyTask import TransactionalCopyTask
+from console_logger import ConsoleLogger
+
+
+class FakeOnGoingItemConfig(object):
+    def __init__(self, source, destination, total_size, block_size, from_end):
+        self.source = source
+        self.destination = destination
+        self.total_size = total_size
+        self.block_size = block_size
+        self.from_end = from_end
+        self.current_slice_index = 0
+        self.commits = []
+
+    def get_current_total_copy_size(self):
+        return self.total_size
+
+    def get_current_block_size(self):
+        return self.block_size
+
+    def get_current_source_path(self):
+        return self.source
+
+    def get_current_destination(self):
+        return self.destination
+
+    def get_current_slice_index(self):
+        return self.current_slice_index
+
+    def get_from_end(self):
+        return self.from_end
+
+    def commit(self):
+        self.commits.append(self.current_slice_index)
+
+
+class FakeEncryptionEnvironment(object):
+    def __init__(self, directory):
+        self.copy_slice_item_backup_file = os.path.join(directory, 'copy_slice_item.bak')
+        self.copy_checkpoint_journal_file = os.path.join(directory, 'copy_checkpoint.journal')
+
+
+class FakeHandlerUtil(object):
+    def __init__(self):
+        self.messages = []
+
+    def do_status_report(self, operation, status, status_code, message):
+        self.messages.append(message)
+
+
+class TestTransactionalCopyTask(unittest.TestCase):
+    """ unit tests for the slice copy of the TransactionalCopyTask module """
+    block_size = 8192
+    # three full slices and a partial one
+    total_size = 3 * 8192 + 1024
+
+    def setUp(self):
+        self.logger = ConsoleLogger()
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'source')
+        self.destination = os.path.join(self.directory, 'destination')
+        self.data = os.urandom(self.total_size)
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+        with open(self.destination, 'wb') as f:
+            f.write(b'\0' * self.total_size)
+        self.environment = FakeEncryptionEnvironment(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _create_task(self, from_end, current_slice_index=0):
+        self.ongoing_item_config = FakeOnGoingItemConfig(self.source, self.destination, self.total_size,
+                                                         self.block_size, from_end)
+        self.ongoing_item_config.current_slice_index = current_slice_index
+        self.hutil = FakeHandlerUtil()
+        return TransactionalCopyTask(logger=self.logger,
+                                     hutil=self.hutil,
+                                     disk_util=None,
+                                     ongoing_item_config=self.ongoing_item_config,
+                                     patching=None,
+                                     encryption_environment=self.environment,
+                                     status_prefix='Copying')
+
+    def _copy(self, task):
+        self.assertEqual(CommonVariables.process_success, task.prepare_mem_fs())
+        try:
+            return task.begin_copy()
+        finally:
+            task.clear_mem_fs()
+
+    def _journal(self, task):
+        return CheckpointJournal(self.environment.copy_checkpoint_journal_file,
+                                 '|'.join([self.source, self.destination, str(self.total_size),
+                                           str(self.block_size), task.from_end]))
+
+    def _read_destination(self):
+        with open(self.destination, 'rb') as f:
+            return f.read()
+
+    def test_copy_forward(self):
+        task = self._create_task('False')
+        self.assertEqual(CommonVariables.process_success, self._copy(task))
+        self.assertEqual(self.data, self._read_destination())
+        # the configuration is only committed at the end, the journal kept the progress
+        self.assertEqual([4], self.ongoing_item_config.commits)
+        self.assertEqual('Copying: 100%', self.hutil.messages[-1])
+        self.assertEqual(len(self.hutil.messages), len(set(self.hutil.messages)))
+        self.assertFalse(os.path.exists(self.environment.copy_slice_item_backup_file))
+        self.assertFalse(os.path.exists(self.environment.copy_checkpoint_journal_file))
+
+    def test_copy_in_batches(self):
+        task = self._create_task('False')
+        task.prepare_mem_fs()
+        try:
+            task.max_batch_slice_count = 2
+            task.batch_slice_count = 2
+            self.assertEqual((0, 2 * self.block_size), task.get_batch_extent(0, task.get_batch_slice_count(0)))
+            # the last slice is never part of a batch
+            self.assertEqual(1, task.get_batch_slice_count(2))
+            self.assertEqual(CommonVariables.process_success, task.begin_copy())
+        finally:
+            task.clear_mem_fs()
+        self.assertEqual(self.data, self._read_destination())
+
+    def test_copy_from_end(self):
+        task = self._create_task('True')
+        self.assertEqual(CommonVariables.process_success, self._copy(task))
+        self.assertEqual(self.data, self._read_destination())
+        self.assertEqual(4, self.ongoing_item_config.commits[-1])
+
+    def test_batch_extent_from_end(self):
+        task = self._create_task('True')
+        task.batch_slice_count = 2
+        self.assertEqual((3 * self.block_size, 1024), task.get_batch_extent(0, 1))
+        self.assertEqual(2, task.get_batch_slice_count(1))
+        self.assertEqual((self.block_size, 2 * self.block_size), task.get_batch_extent(1, 2))
+        self.assertEqual(1, task.get_batch_slice_count(3))
+
+    def test_copy_buffer_is_split_between_concurrent_copies(self):
+        task = self._create_task('False')
+        buffer_size = task.get_copy_buffer_size()
+        task.concurrent_copies = 4
+        split_buffer_size = task.get_copy_buffer_size()
+        self.assertTrue(split_buffer_size <= max(self.block_size, buffer_size // 4))
+        self.assertEqual(0, split_buffer_size % self.block_size)
+
+    def test_resume_from_journal(self):
+        # interrupted while the destination of slices 1 and 2 was written, the backup is complete
+        task = self._create_task('False')
+        journal = self._journal(task)
+        journal.append(1, 2)
+        journal.close()
+        with open(self.environment.copy_slice_item_backup_file, 'wb') as f:
+            f.write(self.data[self.block_size:3 * self.block_size])
+        with open(self.destination, 'r+b') as f:
+            f.seek(self.block_size)
+            f.write(b'\1' * self.block_size)
+        self.assertEqual(CommonVariables.process_success, self._copy(task))
+        destination = self._read_destination()
+        self.assertEqual(b'\0' * self.block_size, destination[:self.block_size])
+        self.assertEqual(self.data[self.block_size:], destination[self.block_size:])
+        self.assertEqual([3, 4], self.ongoing_item_config.commits)
+
+    def test_resume_with_stale_backup(self):
+        # interrupted after the batch was recorded as copied, before its backup was removed
+        task = self._create_task('False')
+        journal = self._journal(task)
+        journal.append(1, 2)
+        journal.append(3, 0)
+        journal.close()
+        with open(self.environment.copy_slice_item_backup_file, 'wb') as f:
+            f.write(b'\1' * 2 * self.block_size)
+        self.assertEqual(CommonVariables.process_success, self._copy(task))
+        destination = self._read_destination()
+        self.assertEqual(b'\0' * 3 * self.block_size, destination[:3 * self.block_size])
+        self.assertEqual(self.data[3 * self.block_size:], destination[3 * self.block_size:])
+        self.assertFalse(os.path.exists(self.environment.copy_slice_item_backup_file))
+
+    def test_resume_from_partial_backup(self):
+        # interrupted while the backup of slice 1 was written, the destination was not touched yet
+        with open(self.environment.copy_slice_item_backup_file, 'wb') as f:
+            f.write(self.data[self.block_size:self.block_size + 3000])
+        task = self._create_task('False', current_slice_index=1)
+        self.assertEqual(CommonVariables.process_success, self._copy(task))
+        destination = self._read_destination()
+        self.assertEqual(b'\0' * self.block_size, destination[:self.block_size])
+        self.assertEqual(self.data[self.block_size:], destination[self.block_size:])
+        self.assertFalse(os.path.exists(self.environment.copy_slice_item_backup_file))
+
+    def test_backup_removal_is_durable(self):
+        task = self._create_task('False')
+        with open(self.environment.copy_slice_item_backup_file, 'wb') as f:
+            f.write(self.data[:self.block_size])
+        synced = []
+        fsync_directory = TransactionalCopyTask_module.fsync_directory
+        TransactionalCopyTask_module.fsync_directory = lambda path: synced.append(
+            (path, os.path.exists(self.environment.copy_slice_item_backup_file)))
+        try:
+            task.remove_backup_file()
+        finally:
+            TransactionalCopyTask_module.fsync_directory = fsync_directory
+        # the directory is synced once the backup is gone
+        self.assertEqual([(os.path.dirname(self.environment.copy_slice_item_backup_file), False)], synced)
+
+    def test_copy_error(self):
+        os.remove(self.source)
+        task = self._create_task('False')
+        self.assertEqual(CommonVariables.copy_data_error, self._copy(task))
+        self.assertEqual([], self.ongoing_item_config.commits)
+        # the failed batch stays pending in the journal
+        self.assertEqual((0, 1), self._journal(task).load())